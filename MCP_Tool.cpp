@@ -4,10 +4,95 @@
 #include <sstream>
 #include <vector>
 #include <cstdio>
+#include <cstdint>
+#include <cstring>
+#include <chrono>
+#include <mutex>
+#include <condition_variable>
+#include <deque>
+#include <memory>
+#include <map>
+#include <atomic>
 #include <iostream> // For debug printing if needed
 
 // Use WCHAR for string literals and Windows API compatibility
 #define PIPE_NAME_BASE L"\\\\.\\pipe\\GenericInputPipe_"
+#define PIPE_BUFFER_SIZE 4096
+#define THREAD_STOP_TIMEOUT_MS 5000
+
+// --- Framed protocol (must match wire_protocol.py) ---
+// magic(2) | version(1) | opcode(1) | flags(2) | request_id(4) | payload_len(4) | payload
+#define PROTOCOL_VERSION 1
+#define MAX_PAYLOAD_SIZE (1 << 20)
+
+#define OP_HELLO      0x01
+#define OP_TYPE       0x02
+#define OP_MENU       0x03
+#define OP_QUERY_INFO 0x04
+#define OP_BATCH      0x05
+#define OP_TYPE_EX    0x06
+#define OP_PING       0x07   // heartbeat, answered on the reader thread
+#define OP_RING_ATTACH 0x08  // maps the controller's shared-memory command ring, answered on the reader thread
+#define OP_SNAPSHOT    0x09  // window tree and menu table, as a diff against the client's last version
+
+#define FLAG_RESPONSE 0x0001
+#define FLAG_NO_REPLY 0x0002
+#define FLAG_ERROR    0x0004
+
+// --- Text injection modes (OP_TYPE_EX) ---
+#define TEXT_MODE_LEGACY 0   // one WM_CHAR every LEGACY_CHAR_DELAY_MS
+#define TEXT_MODE_BULK   1   // WM_CHAR bursts paced by the posted-message quota
+#define TEXT_MODE_PASTE  2   // clipboard + WM_PASTE to the focused control; the clipboard is restored
+
+#define LEGACY_CHAR_DELAY_MS 25
+#define BULK_BURST_SIZE 256
+#define BULK_SYNC_TIMEOUT_MS 1000
+#define QUOTA_RETRY_LIMIT 5000
+#define PASTE_TIMEOUT_MS 2000
+#define CLIPBOARD_OPEN_RETRIES 10
+#define CLIPBOARD_RETRY_DELAY_MS 10
+
+// --- Window snapshots (OP_SNAPSHOT, record format shared with window_snapshot.py) ---
+#define SNAPSHOT_MAX_TEXT_CHARS 512
+#define SNAPSHOT_MAX_WINDOWS 4096
+#define SNAPSHOT_MAX_MENU_DEPTH 8
+#define SNAPSHOT_MAX_BYTES (MAX_PAYLOAD_SIZE - 4096)  // records beyond this are dropped and Truncated is set
+#define SNAPSHOT_TEXT_TIMEOUT_MS 50                   // WM_GETTEXT to a hung window gives up after this
+
+// Shared-memory command ring (layout shared with shared_ring.py):
+// header | head index @64 | tail index @128 | consumer-waiting flag @192 | slots @256.
+// Each slot holds a u32 length followed by one or more complete frames.
+#define RING_VERSION 1
+#define RING_HEAD_OFFSET 64
+#define RING_TAIL_OFFSET 128
+#define RING_WAITING_OFFSET 192
+#define RING_SLOTS_OFFSET 256
+#define RING_MAX_SLOTS 4096
+#define RING_MAX_SLOT_SIZE 65536
+#define RING_SPIN_COUNT 4000      // polls of an empty ring before the consumer sleeps
+#define RING_WAIT_TIMEOUT_MS 50   // bounds the delay of a lost wake-up (the producer has no fence)
+
+// Returned by DispatchFrames for data that is not a valid frame stream.
+#define DISPATCH_CORRUPT ((size_t)-1)
+
+#pragma pack(push, 1)
+struct RingHeader {
+    char magic[2];
+    uint8_t version;
+    uint8_t reserved;
+    uint32_t slotCount;
+    uint32_t slotSize;
+};
+
+struct FrameHeader {
+    char magic[2];
+    uint8_t version;
+    uint8_t opcode;
+    uint16_t flags;
+    uint32_t requestId;
+    uint32_t length;
+};
+#pragma pack(pop)
 
 // Global variable to store the main window handle of the target process.
 HWND g_hTargetWnd = NULL;
@@ -15,9 +100,15 @@ HWND g_hTargetWnd = NULL;
 // Global flag to control the named pipe server thread's execution.
 volatile bool g_bRunServer = true;
 
-// Handle for the server thread.
+// Handle for the server (listener) thread.
 HANDLE g_hServerThread = NULL;
 
+// Handle for the command executor thread.
+HANDLE g_hExecutorThread = NULL;
+
+// Manual-reset event signalled on unload; wakes every thread blocked on pipe I/O.
+HANDLE g_hShutdownEvent = NULL;
+
 // Callback function for EnumWindows. Finds the main window of the current process.
 BOOL CALLBACK EnumWindowsProc(HWND hwnd, LPARAM lParam) {
     DWORD dwProcId;
@@ -27,7 +118,7 @@ BOOL CALLBACK EnumWindowsProc(HWND hwnd, LPARAM lParam) {
     if (dwProcId == GetCurrentProcessId()) {
         // Check if it's visible and has no owner (likely the main window).
         if (IsWindowVisible(hwnd) && GetWindow(hwnd, GW_OWNER) == NULL) {
-            g_hTargetWnd = hwnd;
+            *reinterpret_cast<HWND*>(lParam) = hwnd;
             // Stop enumerating windows.
             return FALSE;
         }
@@ -37,23 +128,200 @@ BOOL CALLBACK EnumWindowsProc(HWND hwnd, LPARAM lParam) {
 }
 
 // Finds the main window of the current process.
+// The result is published once, so other pipe threads never see a transient NULL.
 void FindMainWindow() {
-    g_hTargetWnd = NULL;
-    EnumWindows(EnumWindowsProc, 0);
+    HWND hFound = NULL;
+    EnumWindows(EnumWindowsProc, reinterpret_cast<LPARAM>(&hFound));
+    g_hTargetWnd = hFound;
+}
+
+std::wstring Utf8ToWide(const std::string& str) {
+    if (str.empty()) return L"";
+    int size_needed = MultiByteToWideChar(CP_UTF8, 0, str.data(), (int)str.size(), NULL, 0);
+    std::wstring wstrTo(size_needed, 0);
+    MultiByteToWideChar(CP_UTF8, 0, str.data(), (int)str.size(), &wstrTo[0], size_needed);
+    return wstrTo;
+}
+
+// Result of one text injection, reported back to the controller.
+struct TypeStats {
+    size_t chars;    // UTF-16 code units delivered
+    double ms;       // time spent inside the DLL
+};
+
+// Posts one WM_CHAR. When the target's posted-message quota is exhausted the
+// queue is full, so wait for the target to drain it instead of dropping input.
+bool PostCharPaced(HWND hwnd, WCHAR ch) {
+    for (int attempt = 0; attempt < QUOTA_RETRY_LIMIT; ++attempt) {
+        if (PostMessageW(hwnd, WM_CHAR, (WPARAM)ch, 0)) return true;
+        if (GetLastError() != ERROR_NOT_ENOUGH_QUOTA) return false;
+        Sleep(1);
+    }
+    return false;
+}
+
+// A clipboard format saved before a paste, so the user's clipboard can be put back.
+struct ClipboardItem {
+    UINT format;
+    std::string data;
+};
+
+// Formats whose clipboard data is a GDI handle rather than a global memory block
+// cannot be copied byte for byte; they are not restored.
+bool IsMemoryClipboardFormat(UINT format) {
+    switch (format) {
+    case CF_BITMAP:
+    case CF_METAFILEPICT:
+    case CF_PALETTE:
+    case CF_ENHMETAFILE:
+    case CF_OWNERDISPLAY:
+    case CF_DSPBITMAP:
+    case CF_DSPMETAFILEPICT:
+    case CF_DSPENHMETAFILE:
+        return false;
+    }
+    return format < CF_GDIOBJFIRST || format > CF_GDIOBJLAST;
 }
 
-// Sends a string of text to the target window handle using PostMessageW.
-void SendTextToWindow(const std::string& text) {
+// Another process may hold the clipboard for a moment; retry briefly before giving up.
+bool OpenClipboardRetry() {
+    for (int attempt = 0; attempt < CLIPBOARD_OPEN_RETRIES; ++attempt) {
+        if (OpenClipboard(NULL)) return true;
+        Sleep(CLIPBOARD_RETRY_DELAY_MS);
+    }
+    return false;
+}
+
+// Copies every restorable format on the (open) clipboard.
+std::vector<ClipboardItem> SaveClipboard() {
+    std::vector<ClipboardItem> items;
+    for (UINT format = EnumClipboardFormats(0); format != 0; format = EnumClipboardFormats(format)) {
+        if (!IsMemoryClipboardFormat(format)) continue;
+        HANDLE hData = GetClipboardData(format);
+        if (hData == NULL) continue;
+        const char* data = static_cast<const char*>(GlobalLock(hData));
+        if (data == NULL) continue;
+        items.push_back({ format, std::string(data, GlobalSize(hData)) });
+        GlobalUnlock(hData);
+    }
+    return items;
+}
+
+// Puts a memory block on the (open) clipboard; the clipboard owns it on success.
+bool SetClipboardBytes(UINT format, const void* data, size_t size) {
+    HGLOBAL hMem = GlobalAlloc(GMEM_MOVEABLE, size);
+    if (hMem == NULL) return false;
+    void* target = GlobalLock(hMem);
+    if (target == NULL) {
+        GlobalFree(hMem);
+        return false;
+    }
+    memcpy(target, data, size);
+    GlobalUnlock(hMem);
+    if (SetClipboardData(format, hMem) == NULL) {
+        GlobalFree(hMem);
+        return false;
+    }
+    return true;
+}
+
+// Replaces the clipboard contents with the saved formats.
+void RestoreClipboard(const std::vector<ClipboardItem>& items) {
+    if (!OpenClipboardRetry()) return;
+    EmptyClipboard();
+    for (const ClipboardItem& item : items) {
+        SetClipboardBytes(item.format, item.data.data(), item.data.size());
+    }
+    CloseClipboard();
+}
+
+// Pastes text into the focused control of the target window with WM_PASTE.
+// Unlike Ctrl+V through SendInput this does not depend on the target being the
+// foreground window, and the message is sent rather than posted, so the paste
+// has finished before the user's clipboard is restored. Returns 0 when the
+// target has no focused control or the control's text and selection did not
+// change (it ignored WM_PASTE).
+size_t PasteTextToWindow(const std::wstring& text) {
+    GUITHREADINFO threadInfo = {};
+    threadInfo.cbSize = sizeof(threadInfo);
+    DWORD threadId = GetWindowThreadProcessId(g_hTargetWnd, NULL);
+    if (text.empty() || !GetGUIThreadInfo(threadId, &threadInfo) || threadInfo.hwndFocus == NULL
+        || GetAncestor(threadInfo.hwndFocus, GA_ROOT) != g_hTargetWnd) {
+        return 0;
+    }
+    HWND hFocus = threadInfo.hwndFocus;
+
+    if (!OpenClipboardRetry()) return 0;
+    std::vector<ClipboardItem> saved = SaveClipboard();
+    EmptyClipboard();
+    bool placed = SetClipboardBytes(CF_UNICODETEXT, text.c_str(), (text.size() + 1) * sizeof(WCHAR));
+    CloseClipboard();
+
+    size_t delivered = 0;
+    if (placed) {
+        DWORD_PTR lengthBefore = 0, selectionBefore = 0, lengthAfter = 0, selectionAfter = 0, result = 0;
+        UINT flags = SMTO_BLOCK | SMTO_ABORTIFHUNG;
+        SendMessageTimeoutW(hFocus, WM_GETTEXTLENGTH, 0, 0, flags, PASTE_TIMEOUT_MS, &lengthBefore);
+        SendMessageTimeoutW(hFocus, EM_GETSEL, 0, 0, flags, PASTE_TIMEOUT_MS, &selectionBefore);
+        if (SendMessageTimeoutW(hFocus, WM_PASTE, 0, 0, flags, PASTE_TIMEOUT_MS, &result)) {
+            SendMessageTimeoutW(hFocus, WM_GETTEXTLENGTH, 0, 0, flags, PASTE_TIMEOUT_MS, &lengthAfter);
+            SendMessageTimeoutW(hFocus, EM_GETSEL, 0, 0, flags, PASTE_TIMEOUT_MS, &selectionAfter);
+            // 粘贴后文本长度或插入点至少有一个会变化
+            if (lengthAfter != lengthBefore || selectionAfter != selectionBefore) {
+                delivered = text.size();
+            }
+        }
+    }
+    RestoreClipboard(saved);
+    return delivered;
+}
+
+// Sends a string of UTF-8 text to the target window handle.
+// Text is converted to UTF-16 first, so non-ASCII (e.g. Chinese) input arrives intact.
+TypeStats SendTextToWindow(const std::string& text, int mode = TEXT_MODE_LEGACY) {
+    TypeStats stats = { 0, 0.0 };
     if (g_hTargetWnd == NULL) {
         FindMainWindow();
     }
     if (g_hTargetWnd == NULL) {
-        return;
+        return stats;
     }
-    for (char c : text) {
-        PostMessageW(g_hTargetWnd, WM_CHAR, (WPARAM)c, 0);
-        Sleep(25);
+    auto start = std::chrono::steady_clock::now();
+    std::wstring wide = Utf8ToWide(text);
+
+    if (mode == TEXT_MODE_PASTE) {
+        stats.chars = PasteTextToWindow(wide);
     }
+    else if (mode == TEXT_MODE_BULK) {
+        for (WCHAR ch : wide) {
+            if (!PostCharPaced(g_hTargetWnd, ch)) break;
+            ++stats.chars;
+            // 每个批次后与目标 UI 线程同步一次, 确认其消息循环仍在处理
+            if (stats.chars % BULK_BURST_SIZE == 0) {
+                DWORD_PTR result;
+                SendMessageTimeoutW(g_hTargetWnd, WM_NULL, 0, 0, SMTO_ABORTIFHUNG, BULK_SYNC_TIMEOUT_MS, &result);
+            }
+        }
+    }
+    else {
+        for (WCHAR ch : wide) {
+            PostMessageW(g_hTargetWnd, WM_CHAR, (WPARAM)ch, 0);
+            ++stats.chars;
+            Sleep(LEGACY_CHAR_DELAY_MS);
+        }
+    }
+
+    stats.ms = std::chrono::duration<double, std::milli>(std::chrono::steady_clock::now() - start).count();
+    return stats;
+}
+
+// Builds "Status:OK;Chars:...;Ms:...;CharsPerSec:...;" for TYPE responses.
+std::string BuildTypeResponse(const TypeStats& stats) {
+    double charsPerSec = stats.ms > 0.0 ? stats.chars * 1000.0 / stats.ms : 0.0;
+    char buffer[128];
+    snprintf(buffer, sizeof(buffer), "Status:OK;Chars:%zu;Ms:%.3f;CharsPerSec:%.1f;",
+        stats.chars, stats.ms, charsPerSec);
+    return buffer;
 }
 
 // *** 新增函数: 发送菜单命令 ***
@@ -85,73 +353,747 @@ std::string WcharToUtf8(const WCHAR* wstr) {
 }
 
 
-DWORD WINAPI NamedPipeServerThread(LPVOID lpParam) {
-    const WCHAR* pipeName = static_cast<const WCHAR*>(lpParam);
-    char buffer[1024];
+// Builds the "PID:...;HWND:...;Title:...;" answer to QUERY_INFO.
+std::string BuildQueryInfoResponse() {
+    if (g_hTargetWnd == NULL) FindMainWindow();
+
+    WCHAR windowTitle[256] = { 0 };
+    if (g_hTargetWnd != NULL) GetWindowTextW(g_hTargetWnd, windowTitle, 255);
+
+    std::string titleUtf8 = WcharToUtf8(windowTitle);
+    std::stringstream ss;
+    ss << "PID:" << GetCurrentProcessId()
+        << ";HWND:" << reinterpret_cast<uintptr_t>(g_hTargetWnd)
+        << ";Title:" << (titleUtf8.empty() ? "N/A" : titleUtf8)
+        << ";";
+    return ss.str();
+}
+
+std::string GetKvField(const std::string& payload, const char* key);
+
+// Last snapshot sent on one connection; OP_SNAPSHOT answers with the records
+// that changed since. Only touched by the command executor thread.
+struct SnapshotState {
+    uint32_t version = 0;
+    std::map<std::string, std::string> records;  // "W\t<hwnd>" / "M\t<path>" -> record line
+};
+
+// Snapshot versions are unique across connections, so a version obtained on an
+// earlier connection never passes for the base of a diff.
+std::atomic<uint32_t> g_snapshotVersion(0);
+
+struct SnapshotCollector {
+    std::map<std::string, std::string> records;
+    size_t windows = 0;
+    size_t menus = 0;
+    size_t bytes = 0;
+    bool truncated = false;
+};
+
+// Escapes backslashes, tabs and line breaks so a text fits in one tab-separated field.
+std::string EscapeSnapshotField(const std::string& text) {
+    std::string escaped;
+    escaped.reserve(text.size());
+    for (char ch : text) {
+        switch (ch) {
+        case '\\': escaped += "\\\\"; break;
+        case '\t': escaped += "\\t"; break;
+        case '\n': escaped += "\\n"; break;
+        case '\r': escaped += "\\r"; break;
+        default: escaped += ch;
+        }
+    }
+    return escaped;
+}
+
+// Reads a window's text without hanging on a window whose thread does not respond.
+std::string GetWindowTextBounded(HWND hwnd) {
+    WCHAR text[SNAPSHOT_MAX_TEXT_CHARS + 1] = { 0 };
+    DWORD_PTR copied = 0;
+    if (!SendMessageTimeoutW(hwnd, WM_GETTEXT, SNAPSHOT_MAX_TEXT_CHARS + 1, reinterpret_cast<LPARAM>(text),
+                             SMTO_ABORTIFHUNG | SMTO_BLOCK, SNAPSHOT_TEXT_TIMEOUT_MS, &copied)) {
+        return "";
+    }
+    text[SNAPSHOT_MAX_TEXT_CHARS] = L'\0';
+    return WcharToUtf8(text);
+}
+
+bool AddSnapshotRecord(SnapshotCollector& collector, const std::string& key, const std::string& line) {
+    if (collector.bytes + line.size() + 1 > SNAPSHOT_MAX_BYTES) {
+        collector.truncated = true;
+        return false;
+    }
+    collector.bytes += line.size() + 1;
+    collector.records[key] = line;
+    return true;
+}
+
+void AddWindowRecord(SnapshotCollector& collector, HWND hwnd) {
+    if (collector.windows >= SNAPSHOT_MAX_WINDOWS) {
+        collector.truncated = true;
+        return;
+    }
+    HWND parent = GetAncestor(hwnd, GA_PARENT);
+    if (parent == GetDesktopWindow()) parent = NULL;
+    WCHAR className[256] = { 0 };
+    GetClassNameW(hwnd, className, 255);
+    RECT rect = {};
+    GetWindowRect(hwnd, &rect);
+
+    std::string key = "W\t" + std::to_string(reinterpret_cast<uintptr_t>(hwnd));
+    std::stringstream ss;
+    ss << key << '\t' << reinterpret_cast<uintptr_t>(parent)
+        << '\t' << (parent ? GetDlgCtrlID(hwnd) : 0)  // top-level windows have no control ID
+        << '\t' << EscapeSnapshotField(WcharToUtf8(className))
+        << '\t' << std::hex << static_cast<uint32_t>(GetWindowLongPtrW(hwnd, GWL_STYLE)) << std::dec
+        << '\t' << (IsWindowVisible(hwnd) ? '1' : '0') << (IsWindowEnabled(hwnd) ? '1' : '0')
+        << '\t' << rect.left << ',' << rect.top << ',' << rect.right << ',' << rect.bottom
+        << '\t' << EscapeSnapshotField(GetWindowTextBounded(hwnd));
+    if (AddSnapshotRecord(collector, key, ss.str())) {
+        collector.windows++;
+    }
+}
+
+BOOL CALLBACK SnapshotChildProc(HWND hwnd, LPARAM lParam) {
+    AddWindowRecord(*reinterpret_cast<SnapshotCollector*>(lParam), hwnd);
+    return TRUE;
+}
+
+// Adds every visible top-level window of this process and all of its descendants.
+BOOL CALLBACK SnapshotTopLevelProc(HWND hwnd, LPARAM lParam) {
+    DWORD dwProcId;
+    GetWindowThreadProcessId(hwnd, &dwProcId);
+    if (dwProcId == GetCurrentProcessId() && IsWindowVisible(hwnd)) {
+        AddWindowRecord(*reinterpret_cast<SnapshotCollector*>(lParam), hwnd);
+        EnumChildWindows(hwnd, SnapshotChildProc, lParam);
+    }
+    return TRUE;
+}
+
+// Adds the items of a menu; path is the position of each item on every level ("1.0").
+void AddMenuRecords(SnapshotCollector& collector, HMENU menu, const std::string& path, int depth) {
+    int count = GetMenuItemCount(menu);
+    for (int i = 0; i < count; i++) {
+        WCHAR text[256] = { 0 };
+        MENUITEMINFOW item = {};
+        item.cbSize = sizeof(item);
+        item.fMask = MIIM_ID | MIIM_STATE | MIIM_SUBMENU | MIIM_STRING;
+        item.dwTypeData = text;
+        item.cch = 255;
+        if (!GetMenuItemInfoW(menu, i, TRUE, &item)) {
+            continue;
+        }
+        std::string itemPath = path.empty() ? std::to_string(i) : path + "." + std::to_string(i);
+        std::string key = "M\t" + itemPath;
+        std::stringstream ss;
+        ss << key << '\t' << (item.hSubMenu ? 0 : item.wID)
+            << '\t' << std::hex << item.fState << std::dec
+            << '\t' << (item.hSubMenu ? '1' : '0')
+            << '\t' << EscapeSnapshotField(WcharToUtf8(text));
+        if (AddSnapshotRecord(collector, key, ss.str())) {
+            collector.menus++;
+        }
+        if (item.hSubMenu && depth < SNAPSHOT_MAX_MENU_DEPTH) {
+            AddMenuRecords(collector, item.hSubMenu, itemPath, depth + 1);
+        }
+    }
+}
+
+// Answers OP_SNAPSHOT. A client that sends the version it last received on this
+// connection ("Since:<n>;") gets only the records that changed or disappeared
+// since then; any other version gets the full snapshot. The menu table is the
+// main window's menu bar as it is right now: applications that fill a popup on
+// WM_INITMENUPOPUP show those items only after the popup was opened once.
+std::string BuildSnapshotResponse(SnapshotState& state, const std::string& payload) {
+    if (g_hTargetWnd == NULL) FindMainWindow();
+
+    SnapshotCollector collector;
+    EnumWindows(SnapshotTopLevelProc, reinterpret_cast<LPARAM>(&collector));
+    HMENU menuBar = g_hTargetWnd ? GetMenu(g_hTargetWnd) : NULL;
+    if (menuBar) {
+        AddMenuRecords(collector, menuBar, "", 0);
+    }
+
+    uint32_t since = (uint32_t)strtoul(GetKvField(payload, "Since").c_str(), NULL, 10);
+    bool full = since == 0 || since != state.version;
+    std::string body;
+    if (full) {
+        for (const auto& record : collector.records) {
+            body += record.second + "\n";
+        }
+    }
+    else {
+        for (const auto& record : collector.records) {
+            auto previous = state.records.find(record.first);
+            if (previous == state.records.end() || previous->second != record.second) {
+                body += record.second + "\n";
+            }
+        }
+        for (const auto& record : state.records) {
+            if (collector.records.find(record.first) == collector.records.end()) {
+                body += "-" + record.first + "\n";
+            }
+        }
+    }
+    // 没有变化时版本号不变, 客户端的副本仍然是最新的
+    uint32_t version = (full || !body.empty()) ? ++g_snapshotVersion : since;
+    state.version = version;
+    state.records = std::move(collector.records);
+
+    char header[160];
+    snprintf(header, sizeof(header), "Version:%u;Base:%u;Full:%d;Windows:%zu;Menus:%zu;Truncated:%d;\n",
+        version, full ? 0u : since, full ? 1 : 0, collector.windows, collector.menus, collector.truncated ? 1 : 0);
+    return header + body;
+}
+
+// One connected client.
+// Reads run on the connection's reader thread while writes may come from the
+// reader (inline queries) or the command executor. The pipe is therefore opened
+// for overlapped I/O: on a synchronous handle a pending ReadFile would block
+// every WriteFile until the client sends more data.
+struct PipeConnection {
+    HANDLE hPipe;
+    HANDLE hReadEvent;
+    HANDLE hWriteEvent;
+    std::mutex writeMutex;
+    SnapshotState snapshot;
+
+    explicit PipeConnection(HANDLE pipe)
+        : hPipe(pipe),
+          hReadEvent(CreateEventW(NULL, TRUE, FALSE, NULL)),
+          hWriteEvent(CreateEventW(NULL, TRUE, FALSE, NULL)) {}
+
+    ~PipeConnection() {
+        DisconnectNamedPipe(hPipe);
+        CloseHandle(hPipe);
+        if (hReadEvent) CloseHandle(hReadEvent);
+        if (hWriteEvent) CloseHandle(hWriteEvent);
+    }
+
+    // Waits for an overlapped operation; returns false on failure or shutdown.
+    bool Complete(OVERLAPPED& ov, DWORD* transferred) {
+        HANDLE waits[2] = { ov.hEvent, g_hShutdownEvent };
+        if (WaitForMultipleObjects(2, waits, FALSE, INFINITE) != WAIT_OBJECT_0) {
+            CancelIoEx(hPipe, &ov);
+            GetOverlappedResult(hPipe, &ov, transferred, TRUE);
+            return false;
+        }
+        return GetOverlappedResult(hPipe, &ov, transferred, FALSE) != FALSE;
+    }
+
+    bool Read(char* buffer, DWORD size, DWORD* dwRead) {
+        OVERLAPPED ov = {};
+        ov.hEvent = hReadEvent;
+        if (!ReadFile(hPipe, buffer, size, NULL, &ov) && GetLastError() != ERROR_IO_PENDING) {
+            return false;
+        }
+        return Complete(ov, dwRead);
+    }
+
+    bool Write(const std::string& data) {
+        std::lock_guard<std::mutex> lock(writeMutex);
+        OVERLAPPED ov = {};
+        ov.hEvent = hWriteEvent;
+        DWORD dwWritten = 0;
+        if (!WriteFile(hPipe, data.data(), (DWORD)data.size(), NULL, &ov) && GetLastError() != ERROR_IO_PENDING) {
+            return false;
+        }
+        return Complete(ov, &dwWritten);
+    }
+};
+
+// Consumer side of a shared-memory command ring offered by the controller.
+// Frames published into the ring are dispatched exactly like frames read from
+// the pipe, without a ReadFile per command; responses go back over the pipe of
+// the connection that attached the ring. Owned by that connection's reader thread.
+struct SharedRing {
+    HANDLE hMapping = NULL;
+    HANDLE hEvent = NULL;
+    HANDLE hThread = NULL;
+    char* base = nullptr;
+    uint32_t slotCount = 0;
+    uint32_t slotSize = 0;
+    volatile LONG stop = 0;
+    std::shared_ptr<PipeConnection> connection;
+
+    volatile LONG* Index(size_t offset) { return reinterpret_cast<volatile LONG*>(base + offset); }
+
+    ~SharedRing() {
+        bool stopped = true;
+        if (hThread) {
+            InterlockedExchange(&stop, 1);
+            SetEvent(hEvent);
+            stopped = WaitForSingleObject(hThread, THREAD_STOP_TIMEOUT_MS) == WAIT_OBJECT_0;
+            CloseHandle(hThread);
+        }
+        // 消费线程未能退出时保留映射, 避免其访问已释放的内存
+        if (base && stopped) UnmapViewOfFile(base);
+        if (hMapping) CloseHandle(hMapping);
+        if (hEvent) CloseHandle(hEvent);
+    }
+};
+
+// A TYPE/MENU/BATCH command waiting for the executor thread.
+struct CommandJob {
+    std::shared_ptr<PipeConnection> connection;
+    bool framed;
+    FrameHeader header;
+    std::string payload;  // Frame payload, or the whole legacy command string
+};
+
+// Commands are executed one at a time in arrival order, independent of which connection sent them.
+std::deque<CommandJob> g_commandQueue;
+std::mutex g_queueMutex;
+std::condition_variable g_queueCv;
+
+void EnqueueCommand(CommandJob job) {
+    {
+        std::lock_guard<std::mutex> lock(g_queueMutex);
+        g_commandQueue.push_back(std::move(job));
+    }
+    g_queueCv.notify_one();
+}
+
+// Handles one command of the legacy string protocol ("TYPE:...", "MENU:<id>", "QUERY_INFO").
+void HandleLegacyCommand(PipeConnection& connection, const std::string& command) {
+    // 检查 TYPE: 命令 (已有功能)
+    if (command.rfind("TYPE:", 0) == 0) {
+        std::string textToType = command.substr(5);
+        SendTextToWindow(textToType);
+    }
+    // 检查 MENU: 命令
+    else if (command.rfind("MENU:", 0) == 0) {
+        try {
+            // 提取冒号后面的ID字符串并转换为整数
+            std::string idStr = command.substr(5);
+            int menuId = std::stoi(idStr);
+            // 调用新函数来发送WM_COMMAND消息
+            SendMenuCommand(menuId);
+        }
+        catch (const std::invalid_argument& ia) {
+            // 如果ID不是有效的数字，则忽略
+        }
+        catch (const std::out_of_range& oor) {
+            // 如果ID超出范围，则忽略
+        }
+    }
+    // 检查 QUERY_INFO 命令 (已有功能)
+    else if (command == "QUERY_INFO") {
+        connection.Write(BuildQueryInfoResponse());
+    }
+}
+
+// Encodes one response frame carrying the request ID it answers.
+std::string EncodeFrame(uint8_t opcode, uint16_t flags, uint32_t requestId, const std::string& payload) {
+    FrameHeader header;
+    header.magic[0] = 'M';
+    header.magic[1] = 'I';
+    header.version = PROTOCOL_VERSION;
+    header.opcode = opcode;
+    header.flags = flags | FLAG_RESPONSE;
+    header.requestId = requestId;
+    header.length = (uint32_t)payload.size();
+
+    std::string frame(reinterpret_cast<const char*>(&header), sizeof(header));
+    frame += payload;
+    return frame;
+}
+
+std::string ExecuteBatch(PipeConnection& connection, const std::string& payload, uint16_t& flags);
+
+// Executes one framed command and returns its response payload; sets FLAG_ERROR in flags on failure.
+std::string ExecuteFrame(PipeConnection& connection, const FrameHeader& header, const std::string& payload,
+                         uint16_t& flags) {
+    if (header.version != PROTOCOL_VERSION) {
+        flags |= FLAG_ERROR;
+        return "Status:ERROR;Error:unsupported version;";
+    }
+    switch (header.opcode) {
+    case OP_HELLO:
+        return "Version:" + std::to_string(PROTOCOL_VERSION) + ";";
+    case OP_PING:
+        return std::string("Status:OK;Window:") + (g_hTargetWnd && IsWindow(g_hTargetWnd) ? "1" : "0") + ";";
+    case OP_TYPE:
+        return BuildTypeResponse(SendTextToWindow(payload));
+    case OP_TYPE_EX:
+        if (payload.empty()) {
+            flags |= FLAG_ERROR;
+            return "Status:ERROR;Error:missing text mode;";
+        }
+        if ((uint8_t)payload[0] > TEXT_MODE_PASTE) {
+            flags |= FLAG_ERROR;
+            return "Status:ERROR;Error:unknown text mode;";
+        }
+        {
+            TypeStats stats = SendTextToWindow(payload.substr(1), (uint8_t)payload[0]);
+            if ((uint8_t)payload[0] == TEXT_MODE_PASTE && stats.chars == 0 && payload.size() > 1) {
+                flags |= FLAG_ERROR;
+                return "Status:ERROR;Error:paste not delivered;";
+            }
+            return BuildTypeResponse(stats);
+        }
+    case OP_MENU:
+        if (payload.size() == sizeof(int32_t)) {
+            int32_t menuId;
+            memcpy(&menuId, payload.data(), sizeof(menuId));
+            SendMenuCommand(menuId);
+            return "Status:OK;";
+        }
+        flags |= FLAG_ERROR;
+        return "Status:ERROR;Error:bad menu payload;";
+    case OP_QUERY_INFO:
+        return BuildQueryInfoResponse();
+    case OP_SNAPSHOT:
+        return BuildSnapshotResponse(connection.snapshot, payload);
+    case OP_BATCH:
+        return ExecuteBatch(connection, payload, flags);
+    default:
+        flags |= FLAG_ERROR;
+        return "Status:ERROR;Error:unknown opcode;";
+    }
+}
+
+// Executes a frame and appends the time spent inside the DLL ("ExecUs:<n>;") to
+// its key/value response, so the client can tell DLL time from pipe latency.
+// OP_BATCH responses are frame lists; their sub-responses carry their own ExecUs.
+std::string ExecuteTimedFrame(PipeConnection& connection, const FrameHeader& header, const std::string& payload,
+                              uint16_t& flags) {
+    auto start = std::chrono::steady_clock::now();
+    std::string response = ExecuteFrame(connection, header, payload, flags);
+    if (header.opcode != OP_BATCH) {
+        long long execUs = std::chrono::duration_cast<std::chrono::microseconds>(
+            std::chrono::steady_clock::now() - start).count();
+        response += "ExecUs:" + std::to_string(execUs) + ";";
+    }
+    return response;
+}
+
+// Runs the sub-frames of an OP_BATCH payload in order; the response payload
+// is the concatenation of one response frame per sub-frame.
+std::string ExecuteBatch(PipeConnection& connection, const std::string& payload, uint16_t& flags) {
+    std::string responses;
+    size_t offset = 0;
+    while (offset + sizeof(FrameHeader) <= payload.size()) {
+        FrameHeader header;
+        memcpy(&header, payload.data() + offset, sizeof(header));
+        if (header.magic[0] != 'M' || header.magic[1] != 'I'
+            || offset + sizeof(FrameHeader) + header.length > payload.size()) {
+            break;
+        }
+        std::string subPayload = payload.substr(offset + sizeof(FrameHeader), header.length);
+        offset += sizeof(FrameHeader) + header.length;
+
+        uint16_t subFlags = 0;
+        std::string subResponse;
+        if (header.opcode == OP_BATCH) {
+            subFlags |= FLAG_ERROR;
+            subResponse = "Status:ERROR;Error:nested batch;";
+        }
+        else {
+            subResponse = ExecuteTimedFrame(connection, header, subPayload, subFlags);
+        }
+        responses += EncodeFrame(header.opcode, subFlags, header.requestId, subResponse);
+    }
+    if (offset != payload.size()) {
+        flags |= FLAG_ERROR;
+        responses += EncodeFrame(OP_BATCH, FLAG_ERROR, 0xFFFFFFFF, "Status:ERROR;Error:malformed batch;");
+    }
+    return responses;
+}
+
+// Executes one framed command and answers it unless the client set FLAG_NO_REPLY.
+void HandleFrame(PipeConnection& connection, const FrameHeader& header, const std::string& payload) {
+    uint16_t flags = 0;
+    std::string response = ExecuteTimedFrame(connection, header, payload, flags);
+    if (!(header.flags & FLAG_NO_REPLY)) {
+        connection.Write(EncodeFrame(header.opcode, flags, header.requestId, response));
+    }
+}
+
+// Commands that only read state are answered on the reader thread, so they
+// never wait behind slow TYPE/MENU commands in the execution queue.
+bool IsInlineOpcode(uint8_t opcode) {
+    return opcode == OP_HELLO || opcode == OP_PING || opcode == OP_QUERY_INFO;
+}
+
+// Returns the value of key in a "Key:Value;Key:Value;" payload, or an empty string.
+std::string GetKvField(const std::string& payload, const char* key) {
+    std::string prefix = std::string(key) + ":";
+    size_t start = 0;
+    while (start < payload.size()) {
+        size_t end = payload.find(';', start);
+        if (end == std::string::npos) end = payload.size();
+        if (payload.compare(start, prefix.size(), prefix) == 0) {
+            return payload.substr(start + prefix.size(), end - start - prefix.size());
+        }
+        start = end + 1;
+    }
+    return "";
+}
+
+size_t DispatchFrames(const std::shared_ptr<PipeConnection>& connection, const char* data, size_t size,
+                      std::unique_ptr<SharedRing>* ringOwner);
+
+// Consumes a shared ring until the connection closes. The consumer spins briefly
+// on an empty ring and only then sets the waiting flag and sleeps on the event,
+// so the controller signals the event only when the DLL is actually idle.
+DWORD WINAPI RingConsumerThread(LPVOID lpParam) {
+    SharedRing* ring = static_cast<SharedRing*>(lpParam);
+    volatile LONG* head = ring->Index(RING_HEAD_OFFSET);
+    volatile LONG* tail = ring->Index(RING_TAIL_OFFSET);
+    volatile LONG* waiting = ring->Index(RING_WAITING_OFFSET);
+    uint32_t next = (uint32_t)InterlockedCompareExchange(tail, 0, 0);
+    HANDLE waits[2] = { ring->hEvent, g_hShutdownEvent };
+    int spins = 0;
+    while (g_bRunServer && !ring->stop) {
+        if ((uint32_t)InterlockedCompareExchange(head, 0, 0) == next) {
+            if (++spins < RING_SPIN_COUNT) {
+                YieldProcessor();
+                continue;
+            }
+            spins = 0;
+            // 这里的 Interlocked 操作是完整屏障, 但生产者 (shared_ring.py) 只是普通地写 head 再读等待标志,
+            // x86 允许这两步重排: 生产者可能读到旧的 0 而我们也看不到新 head, 这次唤醒就丢了.
+            // 丢失的唤醒由 RING_WAIT_TIMEOUT_MS 兜底, 最坏情况下命令晚这么久才执行
+            InterlockedExchange(waiting, 1);
+            if ((uint32_t)InterlockedCompareExchange(head, 0, 0) == next) {
+                WaitForMultipleObjects(2, waits, FALSE, RING_WAIT_TIMEOUT_MS);
+            }
+            InterlockedExchange(waiting, 0);
+            continue;
+        }
+        spins = 0;
+        const char* slot = ring->base + RING_SLOTS_OFFSET + (size_t)(next & (ring->slotCount - 1)) * ring->slotSize;
+        uint32_t length;
+        memcpy(&length, slot, sizeof(length));
+        bool valid = length <= ring->slotSize - sizeof(uint32_t)
+            && DispatchFrames(ring->connection, slot + sizeof(uint32_t), length, nullptr) == length;
+        next++;
+        InterlockedExchange(tail, (LONG)next);
+        if (!valid) {
+            break; // Corrupt slot; the controller's heartbeat will notice the missing responses
+        }
+    }
+    return 0;
+}
+
+// Maps the ring described by an OP_RING_ATTACH payload
+// ("Ring:<mapping>;Event:<event>;Slots:<n>;SlotSize:<n>;") and starts its consumer.
+// Returns nullptr and sets FLAG_ERROR if the ring cannot be used; the controller then keeps using the pipe.
+std::unique_ptr<SharedRing> AttachRing(const std::shared_ptr<PipeConnection>& connection, const std::string& payload,
+                                       uint16_t& flags, std::string& response) {
+    std::unique_ptr<SharedRing> ring(new SharedRing());
+    try {
+        ring->slotCount = (uint32_t)std::stoul(GetKvField(payload, "Slots"));
+        ring->slotSize = (uint32_t)std::stoul(GetKvField(payload, "SlotSize"));
+    }
+    catch (const std::exception&) {
+        ring->slotCount = 0;
+    }
+    if (ring->slotCount == 0 || ring->slotCount > RING_MAX_SLOTS || (ring->slotCount & (ring->slotCount - 1))
+        || ring->slotSize <= sizeof(uint32_t) || ring->slotSize > RING_MAX_SLOT_SIZE || ring->slotSize % 4) {
+        flags |= FLAG_ERROR;
+        response = "Status:ERROR;Error:bad ring layout;";
+        return nullptr;
+    }
+    SIZE_T mappedSize = RING_SLOTS_OFFSET + (SIZE_T)ring->slotCount * ring->slotSize;
+    ring->hMapping = OpenFileMappingW(FILE_MAP_READ | FILE_MAP_WRITE, FALSE,
+                                      Utf8ToWide(GetKvField(payload, "Ring")).c_str());
+    if (ring->hMapping) {
+        ring->base = static_cast<char*>(MapViewOfFile(ring->hMapping, FILE_MAP_READ | FILE_MAP_WRITE, 0, 0, mappedSize));
+    }
+    ring->hEvent = OpenEventW(SYNCHRONIZE | EVENT_MODIFY_STATE, FALSE, Utf8ToWide(GetKvField(payload, "Event")).c_str());
+    if (!ring->base || !ring->hEvent) {
+        flags |= FLAG_ERROR;
+        response = "Status:ERROR;Error:cannot open ring;";
+        return nullptr;
+    }
+    RingHeader header;
+    memcpy(&header, ring->base, sizeof(header));
+    if (header.magic[0] != 'M' || header.magic[1] != 'R' || header.version != RING_VERSION
+        || header.slotCount != ring->slotCount || header.slotSize != ring->slotSize) {
+        flags |= FLAG_ERROR;
+        response = "Status:ERROR;Error:ring header mismatch;";
+        return nullptr;
+    }
+    ring->connection = connection;
+    ring->hThread = CreateThread(NULL, 0, RingConsumerThread, ring.get(), 0, NULL);
+    if (ring->hThread == NULL) {
+        flags |= FLAG_ERROR;
+        response = "Status:ERROR;Error:cannot start ring consumer;";
+        return nullptr;
+    }
+    response = "Status:OK;";
+    return ring;
+}
+
+// Dispatches every complete frame in data and returns the number of bytes consumed,
+// or DISPATCH_CORRUPT if data is not valid framed data. ringOwner receives a ring
+// attached by OP_RING_ATTACH; frames arriving through a ring pass nullptr.
+size_t DispatchFrames(const std::shared_ptr<PipeConnection>& connection, const char* data, size_t size,
+                      std::unique_ptr<SharedRing>* ringOwner) {
+    size_t offset = 0;
+    while (size - offset >= sizeof(FrameHeader)) {
+        FrameHeader header;
+        memcpy(&header, data + offset, sizeof(header));
+        if (header.magic[0] != 'M' || header.magic[1] != 'I' || header.length > MAX_PAYLOAD_SIZE) {
+            return DISPATCH_CORRUPT;
+        }
+        size_t frameSize = sizeof(FrameHeader) + header.length;
+        if (size - offset < frameSize) {
+            break;
+        }
+        std::string payload(data + offset + sizeof(FrameHeader), header.length);
+        offset += frameSize;
+        if (header.opcode == OP_RING_ATTACH) {
+            uint16_t flags = 0;
+            std::string response = "Status:ERROR;Error:ring already attached;";
+            if (ringOwner && !*ringOwner) {
+                *ringOwner = AttachRing(connection, payload, flags, response);
+            }
+            else {
+                flags |= FLAG_ERROR;
+            }
+            connection->Write(EncodeFrame(OP_RING_ATTACH, flags, header.requestId, response));
+        }
+        else if (IsInlineOpcode(header.opcode)) {
+            HandleFrame(*connection, header, payload);
+        }
+        else {
+            EnqueueCommand(CommandJob{ connection, true, header, std::move(payload) });
+        }
+    }
+    return offset;
+}
+
+// Dispatches every complete frame in the buffer and keeps the incomplete tail.
+// Returns false if the stream is not valid framed data.
+bool ProcessFramedBuffer(const std::shared_ptr<PipeConnection>& connection, std::string& pending,
+                         std::unique_ptr<SharedRing>& ring) {
+    size_t consumed = DispatchFrames(connection, pending.data(), pending.size(), &ring);
+    if (consumed == DISPATCH_CORRUPT) {
+        return false;
+    }
+    // 一次性移除已处理的帧, 而不是每帧移动一次剩余数据
+    pending.erase(0, consumed);
+    return true;
+}
+
+// Runs queued commands until shutdown.
+DWORD WINAPI CommandExecutorThread(LPVOID lpParam) {
+    while (true) {
+        CommandJob job;
+        {
+            std::unique_lock<std::mutex> lock(g_queueMutex);
+            g_queueCv.wait(lock, [] { return !g_commandQueue.empty() || !g_bRunServer; });
+            if (!g_bRunServer) break;
+            job = std::move(g_commandQueue.front());
+            g_commandQueue.pop_front();
+        }
+        if (job.framed) {
+            HandleFrame(*job.connection, job.header, job.payload);
+        }
+        else {
+            HandleLegacyCommand(*job.connection, job.payload);
+        }
+    }
+    return 0;
+}
+
+// Reader thread of one client connection.
+DWORD WINAPI PipeConnectionThread(LPVOID lpParam) {
+    std::shared_ptr<PipeConnection>* param = static_cast<std::shared_ptr<PipeConnection>*>(lpParam);
+    std::shared_ptr<PipeConnection> connection = *param;
+    delete param;
+
+    char buffer[PIPE_BUFFER_SIZE];
     DWORD dwRead;
-    HANDLE hPipe = CreateNamedPipeW(
-        pipeName, PIPE_ACCESS_DUPLEX,
-        PIPE_TYPE_BYTE | PIPE_READMODE_BYTE | PIPE_WAIT,
-        1, sizeof(buffer), sizeof(buffer), 0, NULL);
+    // 每个连接由第一个数据块决定协议: 以 "MI" 开头为帧协议, 否则为旧的字符串协议
+    bool modeKnown = false;
+    bool framed = false;
+    std::string pending;
+    // Shared-memory ring attached by this client, stopped before the connection goes away.
+    std::unique_ptr<SharedRing> ring;
+    while (g_bRunServer && connection->Read(buffer, sizeof(buffer) - 1, &dwRead)) {
+        if (!modeKnown && dwRead > 0) {
+            framed = dwRead >= 2 && buffer[0] == 'M' && buffer[1] == 'I';
+            modeKnown = true;
+        }
+        if (framed) {
+            pending.append(buffer, dwRead);
+            if (!ProcessFramedBuffer(connection, pending, ring)) {
+                break; // Corrupt stream, drop the client
+            }
+        }
+        else {
+            buffer[dwRead] = '\0';
+            std::string command(buffer);
+            if (command == "QUERY_INFO") {
+                HandleLegacyCommand(*connection, command);
+            }
+            else {
+                EnqueueCommand(CommandJob{ connection, false, FrameHeader(), command });
+            }
+        }
+    }
+    ring.reset();
+    return 0;
+}
 
-    delete[] pipeName;
+// Accepts clients on an unlimited number of pipe instances; every client gets its own reader thread.
+DWORD WINAPI NamedPipeServerThread(LPVOID lpParam) {
+    const WCHAR* pipeNameParam = static_cast<const WCHAR*>(lpParam);
+    std::wstring pipeName(pipeNameParam);
+    delete[] pipeNameParam;
     lpParam = NULL;
 
-    if (hPipe == INVALID_HANDLE_VALUE) return 1;
+    HANDLE hConnectEvent = CreateEventW(NULL, TRUE, FALSE, NULL);
+    if (hConnectEvent == NULL) return 1;
 
     while (g_bRunServer) {
-        if (ConnectNamedPipe(hPipe, NULL) != FALSE) {
-            while (g_bRunServer && ReadFile(hPipe, buffer, sizeof(buffer) - 1, &dwRead, NULL) != FALSE) {
-                buffer[dwRead] = '\0';
-                std::string command(buffer);
-
-                // 检查 TYPE: 命令 (已有功能)
-                if (command.rfind("TYPE:", 0) == 0) {
-                    std::string textToType = command.substr(5);
-                    SendTextToWindow(textToType);
-                }
-                // *** 新增部分开始 ***
-                // 检查新的 MENU: 命令
-                else if (command.rfind("MENU:", 0) == 0) {
-                    try {
-                        // 提取冒号后面的ID字符串并转换为整数
-                        std::string idStr = command.substr(5);
-                        int menuId = std::stoi(idStr);
-                        // 调用新函数来发送WM_COMMAND消息
-                        SendMenuCommand(menuId);
-                    }
-                    catch (const std::invalid_argument& ia) {
-                        // 如果ID不是有效的数字，则忽略
-                    }
-                    catch (const std::out_of_range& oor) {
-                        // 如果ID超出范围，则忽略
-                    }
+        HANDLE hPipe = CreateNamedPipeW(
+            pipeName.c_str(), PIPE_ACCESS_DUPLEX | FILE_FLAG_OVERLAPPED,
+            PIPE_TYPE_BYTE | PIPE_READMODE_BYTE | PIPE_WAIT,
+            PIPE_UNLIMITED_INSTANCES, PIPE_BUFFER_SIZE, PIPE_BUFFER_SIZE, 0, NULL);
+        if (hPipe == INVALID_HANDLE_VALUE) break;
+
+        OVERLAPPED ov = {};
+        ov.hEvent = hConnectEvent;
+        bool connected = ConnectNamedPipe(hPipe, &ov) != FALSE;
+        if (!connected) {
+            DWORD error = GetLastError();
+            if (error == ERROR_PIPE_CONNECTED) {
+                connected = true;
+            }
+            else if (error == ERROR_IO_PENDING) {
+                DWORD unused;
+                HANDLE waits[2] = { hConnectEvent, g_hShutdownEvent };
+                if (WaitForMultipleObjects(2, waits, FALSE, INFINITE) == WAIT_OBJECT_0) {
+                    connected = GetOverlappedResult(hPipe, &ov, &unused, FALSE) != FALSE;
                 }
-                // *** 新增部分结束 ***
-                // 检查 QUERY_INFO 命令 (已有功能)
-                else if (command == "QUERY_INFO") {
-                    if (g_hTargetWnd == NULL) FindMainWindow();
-
-                    WCHAR windowTitle[256] = { 0 };
-                    if (g_hTargetWnd != NULL) GetWindowTextW(g_hTargetWnd, windowTitle, 255);
-
-                    std::string titleUtf8 = WcharToUtf8(windowTitle);
-                    std::stringstream ss;
-                    ss << "PID:" << GetCurrentProcessId()
-                        << ";HWND:" << reinterpret_cast<uintptr_t>(g_hTargetWnd)
-                        << ";Title:" << (titleUtf8.empty() ? "N/A" : titleUtf8)
-                        << ";";
-                    std::string response = ss.str();
-
-                    DWORD dwWritten;
-                    WriteFile(hPipe, response.c_str(), (DWORD)response.length(), &dwWritten, NULL);
+                else {
+                    CancelIoEx(hPipe, &ov);
+                    GetOverlappedResult(hPipe, &ov, &unused, TRUE);
                 }
             }
         }
-        DisconnectNamedPipe(hPipe);
+        if (!connected) {
+            CloseHandle(hPipe);
+            continue;
+        }
+
+        std::shared_ptr<PipeConnection>* param =
+            new std::shared_ptr<PipeConnection>(std::make_shared<PipeConnection>(hPipe));
+        HANDLE hThread = CreateThread(NULL, 0, PipeConnectionThread, param, 0, NULL);
+        if (hThread == NULL) {
+            delete param;
+        }
+        else {
+            CloseHandle(hThread);
+        }
     }
 
-    CloseHandle(hPipe);
+    CloseHandle(hConnectEvent);
     return 0;
 }
 
@@ -159,11 +1101,16 @@ DWORD WINAPI NamedPipeServerThread(LPVOID lpParam) {
 BOOL APIENTRY DllMain(HMODULE hModule,
     DWORD  ul_reason_for_call,
     LPVOID lpReserved) {
-    // ... DllMain 函数保持不变 ...
     switch (ul_reason_for_call) {
     case DLL_PROCESS_ATTACH:
     {
         DisableThreadLibraryCalls(hModule);
+        g_hShutdownEvent = CreateEventW(NULL, TRUE, FALSE, NULL);
+        if (g_hShutdownEvent == NULL) {
+            break;
+        }
+        g_hExecutorThread = CreateThread(NULL, 0, CommandExecutorThread, NULL, 0, NULL);
+
         DWORD currentPid = GetCurrentProcessId();
         std::wstring pipeNameW = std::wstring(PIPE_NAME_BASE) + std::to_wstring(currentPid);
         WCHAR* dynamicPipeName = new WCHAR[pipeNameW.length() + 1];
@@ -184,20 +1131,24 @@ BOOL APIENTRY DllMain(HMODULE hModule,
     break;
 
     case DLL_PROCESS_DETACH:
-        if (g_hServerThread != NULL) {
-            g_bRunServer = false;
-            DWORD currentPid = GetCurrentProcessId();
-            std::wstring pipeNameW = std::wstring(PIPE_NAME_BASE) + std::to_wstring(currentPid);
-            HANDLE hPipeClient = CreateFileW(
-                pipeNameW.c_str(),
-                GENERIC_READ | GENERIC_WRITE,
-                0, NULL, OPEN_EXISTING, 0, NULL);
-            if (hPipeClient != INVALID_HANDLE_VALUE) {
-                CloseHandle(hPipeClient);
-            }
-            WaitForSingleObject(g_hServerThread, 5000);
-            CloseHandle(g_hServerThread);
-            g_hServerThread = NULL;
+        if (g_hShutdownEvent != NULL) {
+            {
+                std::lock_guard<std::mutex> lock(g_queueMutex);
+                g_bRunServer = false;
+            }
+            g_queueCv.notify_all();
+            SetEvent(g_hShutdownEvent);
+
+            if (g_hServerThread != NULL) {
+                WaitForSingleObject(g_hServerThread, THREAD_STOP_TIMEOUT_MS);
+                CloseHandle(g_hServerThread);
+                g_hServerThread = NULL;
+            }
+            if (g_hExecutorThread != NULL) {
+                WaitForSingleObject(g_hExecutorThread, THREAD_STOP_TIMEOUT_MS);
+                CloseHandle(g_hExecutorThread);
+                g_hExecutorThread = NULL;
+            }
         }
         break;
 
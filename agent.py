@@ -0,0 +1,256 @@
+"""
+Controller agent: exposes one machine's injected processes to a remote aggregator.
+
+The agent wraps a PipeConnectionPool behind the compact protocol in
+agent_protocol.py; main.py's AgentAggregator connects to many agents and
+fans MCP tool calls out to them.
+
+Anyone who can reach the agent can type into its targets, so an agent
+listening on anything but a loopback address refuses to start without a
+token unless --insecure is given. The token and all traffic are sent in
+plaintext: run agents on a trusted network or behind an SSH tunnel or VPN.
+
+Usage: python agent.py --host 0.0.0.0 --port 8765 --token SECRET   (or $MCP_INJECTOR_AGENT_TOKEN)
+       python agent.py --port 8766 --simulate 50   (loopback only, simulated targets, see fake_dll.py)
+"""
+import argparse
+import asyncio
+import hmac
+import ipaddress
+import os
+import re
+import socket
+
+from agent_protocol import (AgentError, encode_message, read_message, AGENT_PROTOCOL_VERSION,
+                            DEFAULT_AGENT_HOST, DEFAULT_AGENT_PORT, AGENT_METHOD_HELLO, AGENT_METHOD_TARGETS,
+                            AGENT_METHOD_TYPE, AGENT_METHOD_MENU, AGENT_METHOD_BATCH, AGENT_METHOD_REDISCOVER,
+                            AGENT_METHOD_METRICS, AGENT_TOKEN_ENV)
+from log_config import get_logger, configure_logging
+from controller import PipeConnectionPool, AsyncProcessInputController
+from wire_protocol import TEXT_MODES, TEXT_MODE_BULK
+
+logger = get_logger("agent")
+
+
+def is_loopback_host(host: str) -> bool:
+    """True if host only accepts local connections ("" and 0.0.0.0 listen on every interface)."""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class ControllerAgent:
+    """
+    TCP server answering agent_protocol requests with a local PipeConnectionPool.
+
+    Each request runs as its own task, so a slow typing job on one set of
+    targets does not hold up queries from the same aggregator. Target
+    selectors (pids, exe, title) are resolved on the agent, where the target
+    index lives.
+    """
+
+    def __init__(self, pool: PipeConnectionPool, host: str = DEFAULT_AGENT_HOST, port: int = DEFAULT_AGENT_PORT,
+                 node: str | None = None, token: str | None = None, insecure: bool = False):
+        """
+        Args:
+            pool: The connection pool whose controller serves the requests.
+            host: Interface to listen on; the default only accepts local connections.
+            port: TCP port; 0 picks a free port (see the port attribute after start()).
+            node: Name reported to aggregators; defaults to "<hostname>:<port>".
+            token: Shared secret required in hello. It travels in plaintext.
+            insecure: Allow a non-loopback host without a token.
+
+        Raises:
+            ValueError: If host is not a loopback address, no token is given and insecure is False.
+        """
+        if not token and not insecure and not is_loopback_host(host):
+            raise ValueError(f"Refusing to serve {host!r} without a token; pass a token or insecure=True")
+        self.pool = pool
+        self.host = host
+        self.port = port
+        self.node = node
+        self.token = token or None
+        self._server = None
+        self._handlers = {
+            AGENT_METHOD_TARGETS: self._targets,
+            AGENT_METHOD_TYPE: self._type,
+            AGENT_METHOD_MENU: self._menu,
+            AGENT_METHOD_BATCH: self._batch,
+            AGENT_METHOD_REDISCOVER: self._rediscover,
+            AGENT_METHOD_METRICS: self._metrics,
+        }
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        if self.node is None:
+            self.node = f"{socket.gethostname()}:{self.port}"
+        logger.info("Controller agent %s listening on %s:%s.", self.node, self.host, self.port)
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        await self._server.serve_forever()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    # --- Connections ---
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = writer.get_extra_info("peername")
+        authenticated = False
+        tasks = set()
+        try:
+            while True:
+                message = await read_message(reader)
+                if message is None:
+                    break
+                request_id, method = message.get("id"), message.get("method")
+                params = message.get("params") or {}
+                if method == AGENT_METHOD_HELLO:
+                    authenticated = self._check_token(params.get("token"))
+                    writer.write(encode_message(
+                        {"id": request_id, "result": await self._hello()} if authenticated
+                        else {"id": request_id, "error": "invalid token"}))
+                    continue
+                if not authenticated:
+                    writer.write(encode_message({"id": request_id, "error": "hello required"}))
+                    continue
+                task = asyncio.create_task(self._respond(writer, request_id, method, params))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (OSError, AgentError, ValueError) as e:
+            logger.warning("Agent connection from %s failed: %s", peer, e)
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    def _check_token(self, token: str | None) -> bool:
+        if self.token is None:
+            return True
+        return token is not None and hmac.compare_digest(str(token), self.token)
+
+    async def _respond(self, writer: asyncio.StreamWriter, request_id, method: str, params: dict):
+        handler = self._handlers.get(method)
+        if handler is None:
+            response = {"id": request_id, "error": f"unknown method: {method}"}
+        else:
+            try:
+                response = {"id": request_id, "result": await handler(**params)}
+            except (TypeError, ValueError, re.error, AgentError) as e:
+                response = {"id": request_id, "error": str(e)}
+            except Exception as e:
+                logger.error("Agent method %s failed: %s", method, e)
+                response = {"id": request_id, "error": f"internal error: {e}"}
+        if not writer.is_closing():
+            writer.write(encode_message(response))
+
+    # --- Methods ---
+
+    async def _controller(self) -> AsyncProcessInputController:
+        return await self.pool.acquire_async()
+
+    @staticmethod
+    async def _select(controller: AsyncProcessInputController, pids: list[int] | None, exe: str | None,
+                      title: str | None) -> list[int] | None:
+        if pids is None and exe is None and title is None:
+            return None
+        return await controller.select_targets(pids, exe, title)
+
+    async def _hello(self) -> dict:
+        controller = await self._controller()
+        return {"node": self.node, "version": AGENT_PROTOCOL_VERSION, "targets": len(controller.get_connected_pids())}
+
+    async def _targets(self, max_age_s: float | None = None, pids: list[int] | None = None, exe: str | None = None,
+                       title: str | None = None) -> dict:
+        controller = await self._controller()
+        infos = await controller.query_all(max_age_s, await self._select(controller, pids, exe, title))
+        target_index = controller.controller.target_index
+        return {str(pid): dict(info or {}, exe=target_index.exe_name(pid)) for pid, info in infos.items()}
+
+    async def _type(self, text: str, mode: str = TEXT_MODE_BULK, pids: list[int] | None = None,
+                    exe: str | None = None, title: str | None = None) -> dict:
+        if mode not in TEXT_MODES:
+            raise ValueError(f"Unknown text mode: {mode}")
+        controller = await self._controller()
+        results = await controller.type_queued(text, mode, await self._select(controller, pids, exe, title))
+        return {str(pid): result if isinstance(result, dict) else {"ok": False, "error": str(result)}
+                for pid, result in results.items()}
+
+    async def _menu(self, command_id: int, pids: list[int] | None = None, exe: str | None = None,
+                    title: str | None = None) -> dict:
+        controller = await self._controller()
+        results = await controller.menu_queued(int(command_id), await self._select(controller, pids, exe, title))
+        return {str(pid): result if isinstance(result, bool) else str(result) for pid, result in results.items()}
+
+    async def _batch(self, operations: list[dict], pids: list[int] | None = None, exe: str | None = None,
+                     title: str | None = None) -> dict:
+        controller = await self._controller()
+        results = await controller.execute_batch(operations, await self._select(controller, pids, exe, title))
+        return {str(pid): result for pid, result in results.items()}
+
+    async def _rediscover(self) -> dict:
+        controller = await self._controller()
+        return {str(pid): status for pid, status in (await controller.discover()).items()}
+
+    async def _metrics(self) -> dict:
+        controller = await self._controller()
+        return controller.metrics_snapshot()
+
+
+async def _run(args):
+    fleet = None
+    if args.simulate:
+        from fake_dll import FakeDllFleet
+        from process_discovery import PipeNamespaceDiscovery
+        from transport import UnixSocketTransport
+        fleet = FakeDllFleet()
+        fleet.spawn(args.simulate)
+        pool = PipeConnectionPool(pipe_name_base=fleet.pipe_name_base, transport=UnixSocketTransport(),
+                                  discovery=PipeNamespaceDiscovery(fleet.directory + os.sep, fleet.prefix))
+    else:
+        pool = PipeConnectionPool()
+    agent = ControllerAgent(pool, args.host, args.port, args.node, args.token, args.insecure)
+    pool.warm_up()
+    try:
+        await agent.serve_forever()
+    finally:
+        await agent.stop()
+        await asyncio.to_thread(pool.close)
+        if fleet is not None:
+            fleet.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve this machine's injected processes to an MCP aggregator.")
+    parser.add_argument("--host", default=DEFAULT_AGENT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_AGENT_PORT)
+    parser.add_argument("--node", help="node name reported to aggregators (default: <hostname>:<port>)")
+    parser.add_argument("--token", help=f"shared secret required from aggregators, sent in plaintext "
+                                        f"(default: ${AGENT_TOKEN_ENV})")
+    parser.add_argument("--insecure", action="store_true",
+                        help="allow a non-loopback --host without a token: anyone who can connect may type")
+    parser.add_argument("--simulate", type=int, default=0, metavar="N",
+                        help="serve N simulated targets instead of injected processes")
+    args = parser.parse_args()
+    args.token = args.token or os.environ.get(AGENT_TOKEN_ENV)
+    if not args.token and not args.insecure and not is_loopback_host(args.host):
+        parser.error(f"--host {args.host} accepts remote connections; set --token (or ${AGENT_TOKEN_ENV}) "
+                     f"or pass --insecure")
+    configure_logging()
+    try:
+        asyncio.run(_run(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
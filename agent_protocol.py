@@ -0,0 +1,194 @@
+import asyncio
+import itertools
+import json
+import struct
+import time
+
+from log_config import get_logger
+
+logger = get_logger("agent_protocol")
+
+# --- Agent Wire Protocol ---
+# 每条消息: 长度(4, 小端) + UTF-8 JSON
+# 请求 {"id": n, "method": "...", "params": {...}}, 响应 {"id": n, "result": ...} 或 {"id": n, "error": "..."}
+# 一个连接上可以同时有多个未完成的请求, 响应按完成顺序返回
+AGENT_PROTOCOL_VERSION = 1
+AGENT_MESSAGE_HEADER = struct.Struct("<I")
+AGENT_MAX_MESSAGE_SIZE = 16 << 20
+DEFAULT_AGENT_PORT = 8765
+DEFAULT_AGENT_HOST = "127.0.0.1"
+# 聚合器读取的逗号分隔 "host:port" 列表, 以及代理和聚合器共用的令牌
+# 令牌在 hello 中以明文发送, 连接本身不加密; 跨主机时应只在可信网络或 SSH 隧道/VPN 内使用
+AGENTS_ENV = "MCP_INJECTOR_AGENTS"
+AGENT_TOKEN_ENV = "MCP_INJECTOR_AGENT_TOKEN"
+
+# --- Agent Methods ---
+AGENT_METHOD_HELLO = "hello"
+AGENT_METHOD_TARGETS = "targets"
+AGENT_METHOD_TYPE = "type"
+AGENT_METHOD_MENU = "menu"
+AGENT_METHOD_BATCH = "batch"
+AGENT_METHOD_REDISCOVER = "rediscover"
+AGENT_METHOD_METRICS = "metrics"
+
+# --- Client Settings ---
+AGENT_CONNECT_TIMEOUT_S = 3.0
+AGENT_CALL_TIMEOUT_S = 30.0
+# 连接失败后在此时间内直接报错, 不可达的节点不会拖慢每一次调用
+AGENT_RECONNECT_BACKOFF_S = 5.0
+
+
+class AgentError(Exception):
+    """Raised when an agent cannot be reached or reports an error."""
+
+
+def encode_message(message: dict) -> bytes:
+    body = json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+    return AGENT_MESSAGE_HEADER.pack(len(body)) + body
+
+
+async def read_message(reader: asyncio.StreamReader) -> dict | None:
+    """Reads one message; returns None when the peer closed the connection."""
+    try:
+        header = await reader.readexactly(AGENT_MESSAGE_HEADER.size)
+    except asyncio.IncompleteReadError:
+        return None
+    (length,) = AGENT_MESSAGE_HEADER.unpack(header)
+    if length > AGENT_MAX_MESSAGE_SIZE:
+        raise AgentError(f"Agent message of {length} bytes exceeds {AGENT_MAX_MESSAGE_SIZE}")
+    try:
+        return json.loads(await reader.readexactly(length))
+    except asyncio.IncompleteReadError:
+        return None
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    """Splits "host:port" (or "host", using DEFAULT_AGENT_PORT)."""
+    host, sep, port = address.rpartition(":")
+    if not sep:
+        return address, DEFAULT_AGENT_PORT
+    return host, int(port)
+
+
+class AgentClient:
+    """
+    Persistent connection to one controller agent.
+
+    Requests are multiplexed by ID over a single TCP connection, so parallel
+    calls to the same agent do not wait for each other. The connection is
+    opened on first use and re-opened after a failure, at most once per
+    AGENT_RECONNECT_BACKOFF_S.
+    """
+
+    def __init__(self, address: str, token: str | None = None,
+                 connect_timeout_s: float = AGENT_CONNECT_TIMEOUT_S, call_timeout_s: float = AGENT_CALL_TIMEOUT_S):
+        """
+        Args:
+            address: "host:port" of the agent.
+            token: Shared secret the agent expects in hello, if it was started with one.
+            connect_timeout_s: Deadline for connecting and the hello exchange.
+            call_timeout_s: Default deadline of a call.
+        """
+        self.address = address
+        self.host, self.port = parse_address(address)
+        self.token = token
+        self.connect_timeout_s = connect_timeout_s
+        self.call_timeout_s = call_timeout_s
+        # 由 hello 响应填充: 节点名称、协议版本和目标数量
+        self.info = {}
+        self.last_error = None
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+        self._pending = {}
+        self._ids = itertools.count(1)
+        self._connect_lock = asyncio.Lock()
+        self._retry_at = 0.0
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def _ensure_connected(self):
+        async with self._connect_lock:
+            if self.connected:
+                return
+            if time.monotonic() < self._retry_at:
+                raise AgentError(f"Agent {self.address} unreachable: {self.last_error}")
+            try:
+                self._reader, self._writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), self.connect_timeout_s)
+                self._read_task = asyncio.create_task(self._read_loop(self._reader))
+                self.info = await self._request(AGENT_METHOD_HELLO, {"token": self.token,
+                                                                     "version": AGENT_PROTOCOL_VERSION},
+                                                self.connect_timeout_s)
+            except (OSError, asyncio.TimeoutError, AgentError) as e:
+                self.last_error = str(e) or type(e).__name__
+                self._retry_at = time.monotonic() + AGENT_RECONNECT_BACKOFF_S
+                self._disconnect()
+                logger.warning("Cannot connect to agent %s: %s", self.address, self.last_error)
+                raise AgentError(f"Agent {self.address} unreachable: {self.last_error}") from e
+            self.last_error = None
+            logger.info("Connected to agent %s (%s).", self.address, self.info.get("node"))
+
+    async def _read_loop(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                message = await read_message(reader)
+                if message is None:
+                    break
+                future = self._pending.pop(message.get("id"), None)
+                if future is None or future.done():
+                    continue
+                if "error" in message:
+                    future.set_exception(AgentError(message["error"]))
+                else:
+                    future.set_result(message.get("result"))
+        except (OSError, AgentError, ValueError) as e:
+            self.last_error = str(e)
+        finally:
+            if self._reader is reader:
+                self._disconnect()
+
+    def _disconnect(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(AgentError(f"Connection to agent {self.address} lost"))
+
+    async def _request(self, method: str, params: dict, timeout_s: float):
+        if self._writer is None:
+            raise AgentError(f"Connection to agent {self.address} lost")
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            self._writer.write(encode_message({"id": request_id, "method": method, "params": params}))
+            await self._writer.drain()
+            return await asyncio.wait_for(future, timeout_s)
+        except asyncio.TimeoutError:
+            raise AgentError(f"Agent {self.address} did not answer {method} within {timeout_s} s")
+        except OSError as e:
+            self._disconnect()
+            raise AgentError(f"Connection to agent {self.address} lost: {e}") from e
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def call(self, method: str, timeout_s: float | None = None, **params):
+        """
+        Calls a method on the agent, connecting first if needed.
+
+        Raises:
+            AgentError: If the agent is unreachable, times out or reports an error.
+        """
+        await self._ensure_connected()
+        return await self._request(method, params, timeout_s if timeout_s is not None else self.call_timeout_s)
+
+    async def close(self):
+        read_task, self._read_task = self._read_task, None
+        self._disconnect()
+        if read_task is not None:
+            read_task.cancel()
@@ -0,0 +1,230 @@
+"""
+Benchmarks ProcessInputController against simulated targets (see fake_dll.py).
+
+For each target count the run measures discovery, connect + HELLO
+negotiation, broadcast fan-out (send_text), back-to-back small command
+writes, QUERY_INFO round trips, full and incremental window snapshots and
+streaming a large payload, then prints
+p50/p99 latency and throughput. --ring repeats every scenario with
+shared-memory command rings. --startup measures cold start instead: the
+time from launching a fresh interpreter until the modules are imported and
+until the first tool call (MCP server) or query (script) has been served.
+Runs on any Linux box; no Windows or injected process is needed.
+
+Usage: python benchmark.py --targets 1,10,100,500 --iterations 20 --ring
+       python benchmark.py --startup --targets 10 --iterations 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from fake_dll import FakeDllFleet
+from log_config import configure_logging
+from controller import ProcessInputController
+from process_discovery import PipeNamespaceDiscovery
+from transport import UnixSocketTransport
+from wire_protocol import encode_frame, encode_menu_payload, OP_MENU, FLAG_NO_REPLY, TEXT_MODE_BULK, TEXT_MODES
+
+DEFAULT_TARGET_COUNTS = "1,10,100"
+DEFAULT_ITERATIONS = 20
+DEFAULT_PAYLOAD_CHARS = 100_000
+# write_small 阶段每个样本向每个目标连续写入的命令数
+SMALL_WRITES_PER_SAMPLE = 200
+
+# --- Cold Start ---
+# 在新的解释器中运行; 输出导入完成和首次调用完成时的 time.time()
+# server: 导入 main.py 并调用 query_targets 工具 (不经过 SSE 传输); script: 只导入 controller.py
+STARTUP_SERVER_CODE = """
+import asyncio, json, sys, time
+from log_config import configure_logging
+import main
+from transport import UnixSocketTransport
+imported = time.time()
+configure_logging("WARNING")
+main.connection_pool = main.PipeConnectionPool(pipe_name_base=sys.argv[1], transport=UnixSocketTransport())
+main.connection_pool.warm_up()
+infos = asyncio.run(main.query_targets())
+print(json.dumps({"imported": imported, "served": time.time(), "targets": len(infos)}))
+main.connection_pool.close()
+"""
+STARTUP_SCRIPT_CODE = """
+import json, sys, time
+from log_config import configure_logging
+from controller import ProcessInputController
+from transport import UnixSocketTransport
+imported = time.time()
+configure_logging("WARNING")
+controller = ProcessInputController(pipe_name_base=sys.argv[1], transport=UnixSocketTransport())
+infos = controller.get_process_infos()
+print(json.dumps({"imported": imported, "served": time.time(), "targets": len(infos)}))
+controller.close()
+"""
+
+
+def _percentile(samples: list[float], percent: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _summarize(stage: str, targets: int, samples: list[float], operations_per_sample: int) -> dict:
+    """Summarizes latency samples (seconds); each sample covered operations_per_sample target operations."""
+    total = sum(samples)
+    return {"stage": stage, "targets": targets, "samples": len(samples),
+            "p50_ms": _percentile(samples, 50) * 1000, "p99_ms": _percentile(samples, 99) * 1000,
+            "mean_ms": statistics.fmean(samples) * 1000,
+            "ops_per_s": operations_per_sample * len(samples) / total if total > 0 else 0.0}
+
+
+def _timed(function, *args, **kwargs) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def run_scenario(target_count: int, iterations: int, payload_chars: int, mode: str,
+                 char_delay_s: float, max_workers: int, shared_ring: bool = False) -> list[dict]:
+    """Runs every stage against target_count fresh simulated targets and returns one summary per stage."""
+    results = []
+    with FakeDllFleet(char_delay_s=char_delay_s) as fleet:
+        fleet.spawn(target_count)
+        discovery = PipeNamespaceDiscovery(fleet.directory + "/", fleet.prefix)
+
+        samples = [_timed(discovery.discover)[0] for _ in range(iterations)]
+        results.append(_summarize("discover", target_count, samples, 1))
+
+        controller = ProcessInputController(pipe_name_base=fleet.pipe_name_base, auto_connect=False,
+                                            discovery=discovery, transport=UnixSocketTransport(),
+                                            max_workers=max_workers, shared_ring=shared_ring)
+        try:
+            elapsed, report = _timed(controller.rediscover)
+            connected = len(controller.get_connected_pids())
+            if connected != target_count:
+                raise RuntimeError(f"Connected to {connected} of {target_count} targets: {report}")
+            results.append(_summarize("connect", target_count, [elapsed], target_count))
+
+            samples = [_timed(controller.send_text, "x", mode)[0] for _ in range(iterations)]
+            results.append(_summarize("broadcast", target_count, samples, target_count))
+
+            # 单个小命令的写入开销 (管道写入或环形缓冲区发布), 不经过广播的线程池
+            pids = controller.get_connected_pids()
+            frame = encode_frame(OP_MENU, 0, encode_menu_payload(0), FLAG_NO_REPLY)
+            samples = []
+            for _ in range(iterations):
+                elapsed = 0.0
+                for pid in pids[:iterations]:
+                    elapsed += _timed(_write_burst, controller, pid, frame, SMALL_WRITES_PER_SAMPLE)[0]
+                    time.sleep(0.01)
+                samples.append(elapsed / min(len(pids), iterations))
+            results.append(_summarize("write_small", target_count, samples, SMALL_WRITES_PER_SAMPLE))
+
+            samples = [_timed(controller.query_process_info, pid, 0)[0]
+                       for _ in range(iterations) for pid in pids[:iterations]]
+            results.append(_summarize("query_rtt", target_count, samples, 1))
+
+            samples = [_timed(controller.get_process_infos, None, 0)[0] for _ in range(iterations)]
+            results.append(_summarize("query_all", target_count, samples, target_count))
+
+            # 完整快照 (丢弃本地副本) 与一次输入之后的增量快照
+            samples = []
+            for pid in pids[:iterations]:
+                controller.snapshots.discard(pid)
+                samples.append(_timed(controller.query_snapshot, pid, None, 0)[0])
+            results.append(_summarize("snapshot_full", target_count, samples, 1))
+            samples = []
+            for pid in pids[:iterations]:
+                controller.send_text("x", mode, pids=[pid])
+                samples.append(_timed(controller.query_snapshot, pid, None, 0)[0])
+            results.append(_summarize("snapshot_diff", target_count, samples, 1))
+
+            elapsed, streamed = _timed(controller.stream_text, "x" * payload_chars, mode)
+            failed = [pid for pid, result in streamed.items() if not result["ok"]]
+            if failed:
+                raise RuntimeError(f"Streaming failed for PIDs {failed}")
+            summary = _summarize("stream", target_count, [elapsed], target_count)
+            summary["chars_per_s"] = payload_chars * target_count / elapsed
+            results.append(summary)
+        finally:
+            controller.close()
+    for row in results:
+        row["ring"] = shared_ring
+    return results
+
+
+def run_startup(target_count: int, iterations: int) -> list[dict]:
+    """Launches fresh interpreters against target_count simulated targets and times their cold start."""
+    results = []
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        filter(None, [os.path.dirname(os.path.abspath(__file__)), os.environ.get("PYTHONPATH")])))
+    with FakeDllFleet() as fleet:
+        fleet.spawn(target_count)
+        for kind, code in (("server", STARTUP_SERVER_CODE), ("script", STARTUP_SCRIPT_CODE)):
+            imported, served = [], []
+            for _ in range(iterations):
+                launched = time.time()
+                output = subprocess.run([sys.executable, "-c", code, fleet.pipe_name_base], env=environment,
+                                        capture_output=True, text=True, check=True).stdout
+                report = json.loads(output.strip().splitlines()[-1])
+                if report["targets"] != target_count:
+                    raise RuntimeError(f"{kind} start-up reached {report['targets']} of {target_count} targets")
+                imported.append(report["imported"] - launched)
+                served.append(report["served"] - launched)
+            results.append(_summarize(f"{kind}_import", target_count, imported, 1))
+            results.append(_summarize(f"{kind}_call", target_count, served, 1))
+    for row in results:
+        row["ring"] = False
+    return results
+
+
+def _write_burst(controller: ProcessInputController, pid: int, frame: bytes, count: int):
+    for _ in range(count):
+        controller._write_to_pid(pid, frame, "menu")
+
+
+def print_table(results: list[dict]):
+    print(f"{'stage':<14} {'ring':>4} {'targets':>7} {'samples':>7} {'p50 ms':>9} {'p99 ms':>9} {'mean ms':>9} "
+          f"{'ops/s':>10} {'chars/s':>12}")
+    for row in results:
+        chars = f"{row['chars_per_s']:>12.0f}" if "chars_per_s" in row else f"{'':>12}"
+        print(f"{row['stage']:<14} {'yes' if row['ring'] else 'no':>4} {row['targets']:>7} {row['samples']:>7} {row['p50_ms']:>9.3f} "
+              f"{row['p99_ms']:>9.3f} {row['mean_ms']:>9.3f} {row['ops_per_s']:>10.1f} {chars}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ProcessInputController against simulated targets.")
+    parser.add_argument("--targets", default=DEFAULT_TARGET_COUNTS,
+                        help="comma-separated target counts, e.g. 1,10,100,500")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument("--payload-chars", type=int, default=DEFAULT_PAYLOAD_CHARS,
+                        help="size of the streamed payload per target")
+    parser.add_argument("--mode", choices=sorted(TEXT_MODES), default=TEXT_MODE_BULK)
+    parser.add_argument("--char-delay-us", type=float, default=0.0,
+                        help="simulated typing time per character in the fake DLL")
+    parser.add_argument("--max-workers", type=int, default=32)
+    parser.add_argument("--ring", action="store_true", help="also run every scenario with shared-memory rings")
+    parser.add_argument("--startup", action="store_true",
+                        help="measure cold start (launch to first served call) instead of the pipe stages")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    configure_logging("WARNING")
+    results = []
+    for target_count in (int(count) for count in args.targets.split(",")):
+        if args.startup:
+            results.extend(run_startup(target_count, args.iterations))
+            continue
+        for shared_ring in ((False, True) if args.ring else (False,)):
+            results.extend(run_scenario(target_count, args.iterations, args.payload_chars, args.mode,
+                                        args.char_delay_us / 1e6, args.max_workers, shared_ring))
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
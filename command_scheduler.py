@@ -0,0 +1,269 @@
+import collections
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+# --- Priority Classes ---
+# 数值越小越先执行; 同一优先级内按提交顺序执行
+PRIORITY_CONTROL = 0      # 查询、心跳等只读操作
+PRIORITY_INTERACTIVE = 1  # 菜单命令等需要及时响应的操作
+PRIORITY_BULK = 2         # 大段文本输入
+PRIORITY_NAMES = {PRIORITY_CONTROL: "control", PRIORITY_INTERACTIVE: "interactive", PRIORITY_BULK: "bulk"}
+
+# --- Limits ---
+# 每个 PID 排队命令的上限, 超出时 submit() 抛出 QueueFullError
+DEFAULT_QUEUE_DEPTH = 256
+# 每个 PID 的默认速率限制 (命令/秒) 和突发容量; 速率为 0 表示不限速
+DEFAULT_RATE_LIMIT_PER_S = 20.0
+DEFAULT_RATE_BURST = 5
+
+
+class QueueFullError(Exception):
+    """Raised by CommandScheduler.submit() when a PID's queue is at its depth limit."""
+
+
+class TokenBucket:
+    """Classic token bucket: `rate_per_s` tokens per second, holding at most `burst` tokens."""
+
+    def __init__(self, rate_per_s: float, burst: int):
+        self.rate_per_s = rate_per_s
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate_per_s)
+        self._updated = now
+
+    def try_take(self, now: float) -> bool:
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def time_until_token(self, now: float) -> float:
+        self._refill(now)
+        return max(0.0, (1 - self._tokens) / self.rate_per_s)
+
+
+class _TargetQueue:
+    """Pending jobs, rate limit and statistics of one PID."""
+
+    def __init__(self, rate_per_s: float, burst: int):
+        self.queues = {priority: collections.deque() for priority in PRIORITY_NAMES}
+        self.bucket = TokenBucket(rate_per_s, burst) if rate_per_s > 0 else None
+        self.busy = False
+        # forget() 时仍有任务在运行: 保留的空队列占住 busy, 任务结束后再移除
+        self.forgotten = False
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        # priority -> [dispatched, total wait s, max wait s]
+        self.waits = {priority: [0, 0.0, 0.0] for priority in PRIORITY_NAMES}
+
+    def depth(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    def pop(self):
+        for priority in sorted(self.queues):
+            if self.queues[priority]:
+                return priority, self.queues[priority].popleft()
+        return None
+
+
+class CommandScheduler:
+    """
+    Per-PID bounded command queues with priorities, rate limits and round-robin dispatch.
+
+    Jobs are callables that perform one command against one PID. At most one
+    job per PID runs at a time, so commands reach a target in priority order
+    instead of piling up in its pipe buffer: a MENU or QUERY_INFO submitted
+    behind a burst of text runs as soon as the current text job finishes.
+    Ready PIDs are served round-robin, so a busy target cannot starve the
+    others, and each PID's token bucket caps its command rate.
+    """
+
+    def __init__(self, executor_factory: Callable[[], ThreadPoolExecutor],
+                 max_queue_depth: int = DEFAULT_QUEUE_DEPTH,
+                 rate_limit_per_s: float = DEFAULT_RATE_LIMIT_PER_S, rate_burst: int = DEFAULT_RATE_BURST):
+        """
+        Args:
+            executor_factory: Returns the worker pool that runs the jobs. Jobs may block until a
+                target acknowledges them, so the pool should not be shared with latency-sensitive work.
+            max_queue_depth: Maximum pending jobs per PID.
+            rate_limit_per_s: Default commands per second per PID; 0 disables rate limiting.
+            rate_burst: Commands a PID may send back to back before the rate limit applies.
+        """
+        self._executor_factory = executor_factory
+        self.max_queue_depth = max_queue_depth
+        self.rate_limit_per_s = rate_limit_per_s
+        self.rate_burst = rate_burst
+        self._targets = {}
+        self._round_robin = collections.deque()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def _target(self, pid: int) -> _TargetQueue:
+        target = self._targets.get(pid)
+        if target is None:
+            target = self._targets[pid] = _TargetQueue(self.rate_limit_per_s, self.rate_burst)
+            self._round_robin.append(pid)
+        return target
+
+    def submit(self, pid: int, priority: int, fn: Callable, *args) -> Future:
+        """
+        Queues fn(*args) for a PID and returns a Future for its result.
+
+        Raises:
+            QueueFullError: If the PID already has max_queue_depth pending jobs.
+            RuntimeError: If the scheduler has been shut down.
+        """
+        if priority not in PRIORITY_NAMES:
+            raise ValueError(f"Unknown priority: {priority}")
+        future = Future()
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("Scheduler has been shut down")
+            target = self._target(pid)
+            if target.depth() >= self.max_queue_depth:
+                target.rejected += 1
+                raise QueueFullError(f"Queue of PID {pid} is full ({self.max_queue_depth} pending commands)")
+            target.queues[priority].append((future, fn, args, time.monotonic()))
+            target.submitted += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._dispatch_loop, name="CommandScheduler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def set_rate_limit(self, pid: int, rate_per_s: float, burst: int = DEFAULT_RATE_BURST):
+        """Overrides the rate limit of one PID; 0 disables it."""
+        with self._cond:
+            self._target(pid).bucket = TokenBucket(rate_per_s, burst) if rate_per_s > 0 else None
+            self._cond.notify()
+
+    def forget(self, pid: int):
+        """
+        Cancels the pending jobs of a PID and drops its queue.
+
+        A job that is already running keeps the PID busy until it finishes, so
+        a job submitted after forget() never runs alongside it.
+        """
+        with self._cond:
+            target = self._targets.pop(pid, None)
+            if target is None:
+                return
+            if target.busy:
+                placeholder = self._targets[pid] = _TargetQueue(self.rate_limit_per_s, self.rate_burst)
+                placeholder.busy = placeholder.forgotten = True
+            else:
+                self._round_robin.remove(pid)
+        for queue in target.queues.values():
+            for future, _, _, _ in queue:
+                future.cancel()
+
+    def _next_job(self, now: float):
+        """Picks the next runnable job round-robin; returns (pid, priority, job) or the seconds to wait."""
+        wait_s = None
+        for _ in range(len(self._round_robin)):
+            pid = self._round_robin[0]
+            self._round_robin.rotate(-1)
+            target = self._targets[pid]
+            if target.busy or not target.depth():
+                continue
+            if target.bucket and not target.bucket.try_take(now):
+                delay = target.bucket.time_until_token(now)
+                wait_s = delay if wait_s is None else min(wait_s, delay)
+                continue
+            priority, job = target.pop()
+            return pid, priority, job
+        return wait_s
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    picked = self._next_job(time.monotonic())
+                    if isinstance(picked, tuple):
+                        break
+                    self._cond.wait(picked)
+                pid, priority, (future, fn, args, enqueued_at) = picked
+                target = self._targets[pid]
+                waited = time.monotonic() - enqueued_at
+                stats = target.waits[priority]
+                stats[0] += 1
+                stats[1] += waited
+                stats[2] = max(stats[2], waited)
+                target.busy = True
+            try:
+                self._executor_factory().submit(self._run_job, pid, future, fn, args)
+            except RuntimeError as e:
+                # 工作线程池已关闭
+                future.set_exception(e)
+                self._job_done(pid)
+
+    def _run_job(self, pid: int, future: Future, fn: Callable, args: tuple):
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args))
+                except BaseException as e:
+                    future.set_exception(e)
+        finally:
+            self._job_done(pid)
+
+    def _job_done(self, pid: int):
+        with self._cond:
+            target = self._targets.get(pid)
+            if target is not None:
+                target.busy = False
+                if not target.forgotten:
+                    target.completed += 1
+                elif target.submitted:
+                    target.forgotten = False
+                else:
+                    del self._targets[pid]
+                    self._round_robin.remove(pid)
+            self._cond.notify()
+
+    def stats(self) -> dict[int, dict]:
+        """
+        Returns per-PID queue statistics.
+
+        Each entry holds the pending "depth" per priority class, whether a job
+        is "running", the "submitted", "completed" and "rejected" counts, and
+        the average and maximum queue wait in milliseconds per priority class.
+        """
+        with self._cond:
+            return {
+                pid: {
+                    "depth": {PRIORITY_NAMES[p]: len(queue) for p, queue in target.queues.items()},
+                    "running": target.busy,
+                    "submitted": target.submitted,
+                    "completed": target.completed,
+                    "rejected": target.rejected,
+                    "wait_ms": {
+                        PRIORITY_NAMES[p]: {"avg": round(total / count * 1000, 3) if count else None,
+                                            "max": round(longest * 1000, 3)}
+                        for p, (count, total, longest) in target.waits.items()
+                    },
+                }
+                for pid, target in self._targets.items()
+            }
+
+    def shutdown(self):
+        """Stops dispatching and cancels every pending job; running jobs finish on their own."""
+        with self._cond:
+            self._stopped = True
+            targets, self._targets = self._targets, {}
+            self._round_robin.clear()
+            self._cond.notify_all()
+        for target in targets.values():
+            for queue in target.queues.values():
+                for future, _, _, _ in queue:
+                    future.cancel()
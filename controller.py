@@ -0,0 +1,1549 @@
+"""
+ProcessInputController and its connection pool, shared by the MCP server
+(main.py), the controller agent (agent.py), scripts and benchmarks.
+
+The module does not import FastMCP, and psutil and pywin32 are only
+imported when discovery or the first connection needs them, so scripts
+that only drive targets start quickly.
+"""
+import time
+import os
+import threading
+import asyncio
+import itertools
+import logging
+import re
+import collections
+from typing import Callable, Iterable
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
+
+from log_config import get_logger
+from transport import (Transport, TransportError, TransportBrokenError, default_transport,
+                       CONNECT_CONNECTED, CONNECT_TIMED_OUT, CONNECT_BUSY, CONNECT_ERROR)
+from process_discovery import DiscoveryStrategy, DISCOVERY_AUTO, create_discovery
+from process_info_cache import ProcessInfoCache, DEFAULT_INFO_TTL_S
+from window_snapshot import SnapshotCache, parse_snapshot, encode_snapshot_request, DEFAULT_SNAPSHOT_TTL_S
+from target_index import TargetIndex
+from health_monitor import HealthMonitor, HEARTBEAT_INTERVAL_S, PING_TIMEOUT_MS, HEALTH_REDISCOVER_INTERVAL_S
+from metrics import MetricsRegistry
+from shared_ring import SharedRing, DEFAULT_RING_SLOTS, DEFAULT_RING_SLOT_SIZE
+from command_scheduler import (CommandScheduler, QueueFullError, DEFAULT_QUEUE_DEPTH, DEFAULT_RATE_LIMIT_PER_S,
+                               PRIORITY_CONTROL, PRIORITY_INTERACTIVE, PRIORITY_BULK)
+from wire_protocol import (Frame, FrameDecoder, ProtocolError, encode_frame, legacy_to_frame, parse_kv,
+                           encode_batch, decode_batch_response, encode_menu_payload, encode_type_ex_payload,
+                           iter_text_chunks, parse_exec_us, OPCODE_NAMES,
+                           PROTOCOL_VERSION, OP_HELLO, OP_TYPE, OP_MENU, OP_QUERY_INFO, OP_BATCH, OP_TYPE_EX, OP_PING,
+                           OP_RING_ATTACH, OP_SNAPSHOT,
+                           FLAG_NO_REPLY, TEXT_MODES, TEXT_MODE_LEGACY, TEXT_MODE_BULK, TEXT_MODE_PASTE)
+
+
+logger = get_logger("controller")
+
+# --- Configuration Constants ---
+PIPE_NAME_BASE = r'\\.\pipe\GenericInputPipe_'
+COMMAND_TYPE_PREFIX = "TYPE:"
+COMMAND_MENU_PREFIX = "MENU:"
+# *** 新增: 查询命令 ***
+COMMAND_QUERY_INFO = "QUERY_INFO"
+INJECTED_DLL_NAME = "MCP_Tool.dll"  # 确保这是你实际的 DLL 文件名
+
+# --- Connection Pool Settings ---
+# 单个已知 PID 的重连超时 (远小于首次发现时的 connect_timeout_ms)
+POOL_RECONNECT_TIMEOUT_MS = 200
+
+# --- Connect Phase ---
+# 并发连接/写入管道的工作线程上限
+MAX_IO_WORKERS = 16
+# 调度器任务 (schedule_*) 使用独立的线程池: 等待输入确认的长任务不会占满上面的 I/O 线程, 拖住心跳和重连
+MAX_SCHEDULER_WORKERS = 8
+
+# --- Broadcast Delivery ---
+# 单个目标的写入超时; 超时的目标不会拖慢其他目标
+DEFAULT_WRITE_TIMEOUT_MS = 2000
+DELIVERY_DELIVERED = "delivered"
+DELIVERY_TIMED_OUT = "timed_out"
+DELIVERY_BROKEN = "broken"
+DELIVERY_ERROR = "error"
+DELIVERY_REJECTED = "rejected"  # 命令无法用目标的协议编码, 句柄保持连接
+
+# --- Wire Protocol ---
+# legacy: 原始字符串命令; framed: 带长度前缀和请求ID的帧; auto: 连接时用 HELLO 协商
+PROTOCOL_LEGACY = "legacy"
+PROTOCOL_FRAMED = "framed"
+PROTOCOL_AUTO = "auto"
+HELLO_TIMEOUT_MS = 250
+DEFAULT_RESPONSE_TIMEOUT_MS = 5000
+# 每个 PID 最多暂存的未被认领的响应帧数
+MAX_STASHED_FRAMES = 1024
+# 不会改变目标窗口状态的操作码; 其他请求都会使该 PID 的 QUERY_INFO 缓存失效
+READ_ONLY_OPCODES = frozenset({OP_HELLO, OP_PING, OP_QUERY_INFO, OP_SNAPSHOT})
+# close() 等待某个 PID 上正在进行的调用结束的最长时间, 超时后强制关闭句柄
+CLOSE_LOCK_TIMEOUT_S = 2.0
+
+# --- Shared-Memory Command Ring ---
+# 帧协议目标可以协商一个共享内存环形缓冲区来接收命令; 响应仍然通过管道返回
+RING_ATTACH_TIMEOUT_MS = 250
+# 环满 (DLL 没有及时取走命令) 时写入的最长等待时间
+RING_WRITE_TIMEOUT_MS = DEFAULT_WRITE_TIMEOUT_MS
+
+# --- Batch Operations ---
+BATCH_OP_TYPE = "type"
+BATCH_OP_MENU = "menu"
+BATCH_OP_QUERY = "query"
+
+# --- Typing Acknowledgements ---
+# DLL 输入完成后才确认 OP_TYPE_EX, 等待时间 = 基础超时 + 字符数 × 每字符预算
+# legacy 模式每个字符 Sleep(25); bulk 模式每批字符与目标 UI 线程同步一次; paste 只有一次 WM_PASTE
+TYPE_ACK_MS_PER_CHAR = {TEXT_MODE_LEGACY: 30, TEXT_MODE_BULK: 1, TEXT_MODE_PASTE: 0}
+
+# --- Streaming ---
+DEFAULT_STREAM_CHUNK_CHARS = 512
+# 每个目标最多允许的未确认块数 (背压窗口)
+DEFAULT_STREAM_WINDOW = 4
+
+
+def get_broadcast_message(message):
+    return f"{message}"
+
+
+def typing_timeout_ms(text: str, mode: str, base_ms: int = DEFAULT_RESPONSE_TIMEOUT_MS) -> int:
+    """Deadline for the DLL to acknowledge typed text: base_ms plus the time the mode needs per character."""
+    return base_ms + len(text) * TYPE_ACK_MS_PER_CHAR[mode]
+
+
+def find_injected_processes(dll_name: str = INJECTED_DLL_NAME) -> list[int]:
+    import psutil  # 首次扫描时才导入
+    injected_pids = []
+    dll_name_lower = dll_name.lower()
+    logger.debug("Scanning processes for DLL: %s", dll_name)
+    for proc in psutil.process_iter(['pid', 'name']):
+        try:
+            pinfo = proc.as_dict(attrs=['pid', 'name'])
+            pid = pinfo['pid']
+            for mapping in proc.memory_maps():
+                if mapping.path and os.path.basename(mapping.path).lower() == dll_name_lower:
+                    logger.info("Found injected process: PID=%s, Name='%s'", pid, pinfo['name'])
+                    injected_pids.append(pid)
+                    break
+        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+            continue
+        except Exception as e:
+            logger.warning("Error accessing process %s: %s", proc.pid, e)
+            continue
+    logger.debug("Scan complete. Found %s potential target processes.", len(injected_pids))
+    return injected_pids
+
+
+class ProcessInputController:
+    def __init__(self, dll_name: str = INJECTED_DLL_NAME, pipe_name_base: str = PIPE_NAME_BASE,
+                 connect_timeout_ms: int = 5000, auto_connect: bool = True,
+                 discovery: DiscoveryStrategy | str = DISCOVERY_AUTO, max_workers: int = MAX_IO_WORKERS,
+                 protocol: str = PROTOCOL_AUTO, info_ttl_s: float = DEFAULT_INFO_TTL_S,
+                 queue_depth: int = DEFAULT_QUEUE_DEPTH, rate_limit_per_s: float = DEFAULT_RATE_LIMIT_PER_S,
+                 metrics: MetricsRegistry | None = None, transport: Transport | None = None,
+                 shared_ring: bool = False, snapshot_ttl_s: float = DEFAULT_SNAPSHOT_TTL_S,
+                 scheduler_workers: int = MAX_SCHEDULER_WORKERS):
+        self.dll_name = dll_name
+        self.pipe_name_base = pipe_name_base
+        self.connect_timeout_ms = connect_timeout_ms
+        self.max_workers = max_workers
+        self.scheduler_workers = scheduler_workers
+        self.protocol = protocol
+        # 命名管道 (Windows) 或 Unix 套接字 (测试/基准); pipe_handles 中保存的是传输层的连接对象
+        self.transport = transport if transport is not None else default_transport()
+        # 为帧协议目标协商共享内存命令环; 不支持的目标继续使用管道
+        self.shared_ring = shared_ring
+        self.pipe_handles = {}
+        # Negotiated protocol (PROTOCOL_LEGACY / PROTOCOL_FRAMED) of each connected PID.
+        self.pipe_protocols = {}
+        self._decoders = {}
+        # Shared-memory command rings (SharedRing) of the PIDs that accepted OP_RING_ATTACH.
+        self._rings = {}
+        # Response frames read while waiting for a different request ID.
+        self._stashed_frames = {}
+        # _state_lock guards the per-PID dicts above; a PID's lock serializes all I/O on its handle,
+        # so calls against different PIDs run in parallel while a request and its response stay paired.
+        # Lock order: PID lock first, then _state_lock.
+        self._state_lock = threading.RLock()
+        self._pid_locks = {}
+        # Cached QUERY_INFO results; typing, menu commands and broken handles invalidate a PID's entry.
+        self.info_cache = ProcessInfoCache(info_ttl_s)
+        # Window trees and menu tables (OP_SNAPSHOT), refreshed with diffs; invalidated like info_cache.
+        self.snapshots = SnapshotCache(snapshot_ttl_s)
+        # Connected PIDs by executable name and last known window title, for select_targets().
+        self.target_index = TargetIndex()
+        # Per-PID priority queues used by the schedule_* methods.
+        self.scheduler = CommandScheduler(self._get_scheduler_executor, queue_depth, rate_limit_per_s)
+        # Stage timings (discover, connect, write, read, DLL execution), failure counters and
+        # per-PID/per-command latency histograms; exposed through the metrics:// resources.
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self._request_ids = itertools.count(1)
+        # Per-PID outcome of the most recent connect phase (CONNECT_* values).
+        self.last_connect_report = {}
+        self._executor = None
+        self._scheduler_executor = None
+        # 发现策略: 默认列出管道命名空间, 失败时退回到增量 memory_maps 扫描
+        if isinstance(discovery, str):
+            discovery = create_discovery(discovery, dll_name, pipe_name_base)
+        self.discovery = discovery
+        # PIDs seen during discovery; the health monitor reconnects evicted handles from it.
+        self.known_pids = set()
+        logger.info("Initializing ProcessInputController...")
+        if auto_connect:
+            self._discover_and_connect()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._state_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="PipeIO")
+            return self._executor
+
+    def _get_scheduler_executor(self) -> ThreadPoolExecutor:
+        with self._state_lock:
+            if self._scheduler_executor is None:
+                self._scheduler_executor = ThreadPoolExecutor(max_workers=self.scheduler_workers,
+                                                              thread_name_prefix="Scheduler")
+            return self._scheduler_executor
+
+    def _pid_lock(self, pid: int) -> threading.RLock:
+        """Returns the lock serializing I/O on a PID's handle; it outlives reconnects of the PID."""
+        with self._state_lock:
+            lock = self._pid_locks.get(pid)
+            if lock is None:
+                lock = self._pid_locks[pid] = threading.RLock()
+            return lock
+
+    def _write_to_pid(self, pid: int, data: bytes, command: str) -> str:
+        """Writes a command that may change the target's window to a PID and returns a DELIVERY_* status."""
+        with self._pid_lock(pid):
+            start = time.perf_counter()
+            status = self._write_pid_data(pid, data)
+            self.metrics.observe("command_seconds", time.perf_counter() - start, pid=pid, command=command)
+            self.info_cache.invalidate(pid)
+            self.snapshots.invalidate(pid)
+            return status
+
+    def _try_connect_pipe(self, pipe_name: str, deadline: float) -> tuple[str, object | None]:
+        """
+        Tries to open a pipe until the given deadline (time.monotonic() based).
+
+        Returns:
+            A (status, handle) tuple; handle is None unless status is CONNECT_CONNECTED.
+        """
+        return self.transport.connect(pipe_name, deadline)
+
+    def _read_available(self, handle: object, deadline: float) -> bytes:
+        """
+        Reads whatever is available on a pipe, waiting until data arrives or the deadline passes.
+
+        Returns:
+            The bytes read, or b"" on timeout. Raises TransportError if the pipe is broken.
+        """
+        return self.transport.read(handle, deadline)
+
+    def _negotiate_protocol(self, handle: object) -> tuple[str, FrameDecoder]:
+        """Sends HELLO and waits briefly for a framed answer; DLLs that ignore it speak the legacy protocol."""
+        decoder = FrameDecoder()
+        if self.protocol != PROTOCOL_AUTO:
+            return self.protocol, decoder
+        if self._write_command(handle, encode_frame(OP_HELLO, 0, bytes([PROTOCOL_VERSION]))) != DELIVERY_DELIVERED:
+            return PROTOCOL_LEGACY, decoder
+        frame = self._await_opcode(handle, decoder, OP_HELLO, HELLO_TIMEOUT_MS)
+        if frame is not None and not frame.is_error:
+            return PROTOCOL_FRAMED, decoder
+        return PROTOCOL_LEGACY, FrameDecoder()
+
+    def _await_opcode(self, handle: object, decoder: FrameDecoder, opcode: int, timeout_ms: int) -> Frame | None:
+        """Reads from a handle during negotiation until a frame with opcode arrives; None on timeout or error."""
+        deadline = time.monotonic() + timeout_ms / 1000
+        try:
+            while time.monotonic() < deadline:
+                for frame in decoder.feed(self._read_available(handle, deadline)):
+                    if frame.opcode == opcode:
+                        return frame
+        except (TransportError, ProtocolError):
+            pass
+        return None
+
+    def _attach_ring(self, address: str, handle: object, decoder: FrameDecoder) -> SharedRing | None:
+        """
+        Offers a shared-memory command ring to a framed target.
+
+        Returns:
+            The attached ring, or None if the transport cannot create one or the
+            DLL does not accept it (older DLLs answer OP_RING_ATTACH with an error).
+        """
+        try:
+            ring = self.transport.open_ring(address, DEFAULT_RING_SLOTS, DEFAULT_RING_SLOT_SIZE)
+        except (OSError, ValueError, TransportError) as e:
+            logger.warning("Could not create a shared ring for %s: %s", address, e)
+            self.metrics.inc("ring_attach_total", result="error")
+            return None
+        if ring is None:
+            return None
+        if self._write_command(handle, encode_frame(OP_RING_ATTACH, 0, ring.attach_payload())) == DELIVERY_DELIVERED:
+            frame = self._await_opcode(handle, decoder, OP_RING_ATTACH, RING_ATTACH_TIMEOUT_MS)
+            if frame is not None and not frame.is_error:
+                self.metrics.inc("ring_attach_total", result="attached")
+                return ring
+        ring.close()
+        self.metrics.inc("ring_attach_total", result="rejected")
+        return None
+
+    def _connect_and_negotiate(self, pipe_name: str, deadline: float
+                               ) -> tuple[str, object | None, tuple[str, FrameDecoder, SharedRing | None] | None]:
+        start = time.perf_counter()
+        status, handle = self._try_connect_pipe(pipe_name, deadline)
+        self.metrics.inc("connects_total", status=status)
+        if not handle:
+            self.metrics.observe("connect_seconds", time.perf_counter() - start, status=status)
+            return status, None, None
+        protocol, decoder = self._negotiate_protocol(handle)
+        ring = None
+        if self.shared_ring and protocol == PROTOCOL_FRAMED:
+            ring = self._attach_ring(pipe_name, handle, decoder)
+        self.metrics.observe("connect_seconds", time.perf_counter() - start, status=status)
+        return status, handle, (protocol, decoder, ring)
+
+    def _connect_single_pipe(self, pipe_name: str, timeout_ms: int) -> object | None:
+        logger.debug("Attempting to connect to pipe: %s...", pipe_name)
+        _, handle = self._try_connect_pipe(pipe_name, time.monotonic() + timeout_ms / 1000)
+        return handle
+
+    def _connect_pids(self, pids: list[int], timeout_ms: int) -> dict[int, str]:
+        """
+        Connects to several PIDs in parallel under one overall deadline.
+
+        Every attempt runs on the bounded worker pool and shares the same
+        deadline, so the phase takes as long as the slowest reachable target
+        instead of the sum of all per-PID timeouts.
+
+        Args:
+            pids: PIDs to connect; PIDs that are already connected are skipped.
+            timeout_ms: Deadline for the whole phase.
+
+        Returns:
+            A mapping of PID to one of the CONNECT_* status values.
+        """
+        with self._state_lock:
+            pending = [pid for pid in pids if pid not in self.pipe_handles]
+        if not pending:
+            return {}
+        deadline = time.monotonic() + timeout_ms / 1000
+        executor = self._get_executor()
+        futures = {executor.submit(self._connect_and_negotiate, f"{self.pipe_name_base}{pid}", deadline): pid
+                   for pid in pending}
+        report = {}
+        for future in as_completed(futures):
+            pid = futures[future]
+            try:
+                status, handle, negotiated = future.result()
+            except Exception as e:
+                logger.error("Unexpected error during connection for PID %s: %s", pid, e)
+                status, handle, negotiated = CONNECT_ERROR, None, None
+            if handle:
+                protocol, decoder, ring = negotiated
+                with self._state_lock:
+                    duplicate = pid in self.pipe_handles
+                    if not duplicate:
+                        self.pipe_handles[pid] = handle
+                        self.pipe_protocols[pid], self._decoders[pid] = protocol, decoder
+                        if ring is not None:
+                            self._rings[pid] = ring
+                if duplicate:
+                    # 另一个线程已经连接了同一个 PID, 保留先建立的句柄
+                    self._close_handle(handle)
+                    if ring is not None:
+                        ring.close()
+                else:
+                    self.target_index.add(pid)
+            report[pid] = status
+        return report
+
+    def _discover_and_connect(self) -> dict[int, str]:
+        with self.metrics.span("discover_seconds"):
+            injected_pids = self.discovery.discover()
+        with self._state_lock:
+            self.known_pids.update(injected_pids)
+        with self.metrics.span("connect_phase_seconds"):
+            report = self._connect_pids(injected_pids, self.connect_timeout_ms)
+        self.last_connect_report = report
+        if report:
+            counts = {}
+            for status in report.values():
+                counts[status] = counts.get(status, 0) + 1
+            logger.info("Connection phase complete. Results: %s. %s process(es) connected.",
+                        counts, len(self.pipe_handles))
+        return report
+
+    def rediscover(self) -> dict[int, str]:
+        """Rescans processes and connects to any injected PID that is not connected yet."""
+        return self._discover_and_connect()
+
+    def reconnect_missing(self, timeout_ms: int = POOL_RECONNECT_TIMEOUT_MS) -> int:
+        """
+        Reconnects known PIDs whose handles were evicted, without a full process scan.
+
+        PIDs that cannot be reached within timeout_ms are forgotten; the next
+        rediscover() will pick them up again if they are still injected.
+
+        Args:
+            timeout_ms: Deadline for reconnecting all missing PIDs.
+
+        Returns:
+            The number of handles that were re-established.
+        """
+        with self._state_lock:
+            missing = list(self.known_pids - self.pipe_handles.keys())
+        report = self._connect_pids(missing, timeout_ms)
+        self.metrics.inc("reconnects_total", sum(1 for status in report.values() if status == CONNECT_CONNECTED))
+        for pid, status in report.items():
+            if status != CONNECT_CONNECTED:
+                with self._state_lock:
+                    self.known_pids.discard(pid)
+                self.discovery.forget(pid)
+        return sum(1 for status in report.values() if status == CONNECT_CONNECTED)
+
+    def reconnect(self, pids: list[int], timeout_ms: int = POOL_RECONNECT_TIMEOUT_MS) -> dict[int, str]:
+        """Tries once to reconnect the given PIDs; unlike reconnect_missing() nothing is forgotten on failure."""
+        report = self._connect_pids(pids, timeout_ms)
+        self.metrics.inc("reconnects_total", sum(1 for status in report.values() if status == CONNECT_CONNECTED))
+        return report
+
+    def get_missing_pids(self) -> list[int]:
+        """Returns the known PIDs that currently have no open handle."""
+        with self._state_lock:
+            return list(self.known_pids - self.pipe_handles.keys())
+
+    def forget_pid(self, pid: int):
+        """Closes a PID's handle and drops it from known_pids, e.g. after its process exited."""
+        self.close_single_pipe(pid)
+        with self._state_lock:
+            self.known_pids.discard(pid)
+        self.discovery.forget(pid)
+        self.scheduler.forget(pid)
+        self.snapshots.discard(pid)
+
+    def ping(self, pid: int, timeout_ms: int = PING_TIMEOUT_MS) -> bool | None:
+        """
+        Checks a PID's handle without disturbing the target and evicts it if it is dead.
+
+        Framed targets must answer OP_PING within timeout_ms (DLLs that
+        predate OP_PING answer with an error frame, which still counts as
+        alive); for legacy targets PeekNamedPipe detects a closed pipe.
+
+        Returns:
+            True if the handle is alive, False if it was evicted, None if
+            another call is using the PID and the check was skipped.
+        """
+        lock = self._pid_lock(pid)
+        if not lock.acquire(blocking=False):
+            return None  # 正在进行的调用会自己发现断开的管道
+        try:
+            handle = self.pipe_handles.get(pid)
+            if handle is None:
+                return False
+            if self.pipe_protocols.get(pid) == PROTOCOL_FRAMED:
+                alive = self.send_request(pid, OP_PING, b"", timeout_ms) is not None
+            else:
+                try:
+                    self.transport.probe(handle)
+                    alive = True
+                except TransportError:
+                    alive = False
+            if not alive:
+                self.close_single_pipe(pid)
+            return alive
+        finally:
+            lock.release()
+
+    def heartbeat(self, timeout_ms: int = PING_TIMEOUT_MS) -> dict[int, bool | None]:
+        """Pings every connected PID in parallel; see ping() for the values."""
+        pids = self.get_connected_pids()
+        if not pids:
+            return {}
+        executor = self._get_executor()
+        futures = {executor.submit(self.ping, pid, timeout_ms): pid for pid in pids}
+        results = {}
+        for future in as_completed(futures):
+            pid = futures[future]
+            try:
+                results[pid] = future.result()
+            except Exception as e:
+                logger.error("Unexpected error pinging PID %s: %s", pid, e)
+                results[pid] = None
+        return results
+
+    def _write_command(self, handle: object, command: str | bytes) -> str:
+        """Writes one command (a legacy string or encoded frames) to a handle and returns a DELIVERY_* status."""
+        start = time.perf_counter()
+        status = self._write_handle(handle, command)
+        self.metrics.observe("write_seconds", time.perf_counter() - start)
+        if status != DELIVERY_DELIVERED:
+            self.metrics.inc("write_failures_total", status=status)
+        return status
+
+    def _write_handle(self, handle: object, command: str | bytes) -> str:
+        if handle is None:
+            return DELIVERY_BROKEN
+        try:
+            command_bytes = command.encode('utf-8') if isinstance(command, str) else command  # Send as UTF-8
+            self.transport.write(handle, command_bytes)
+            return DELIVERY_DELIVERED
+        except TransportBrokenError:
+            return DELIVERY_BROKEN
+        except TransportError as e:
+            logger.warning("Error sending command via handle %s: %s", handle, e)
+            return DELIVERY_ERROR
+        except Exception as e:
+            logger.error("An unexpected error occurred while sending command via handle %s: %s", handle, e)
+            return DELIVERY_ERROR
+
+    def _write_pid_data(self, pid: int, data: bytes, use_ring: bool = True) -> str:
+        """
+        Writes encoded commands to a PID, through its shared ring when one is attached.
+
+        Messages larger than a ring slot go through the pipe once the DLL has
+        taken everything already in the ring, so commands still execute in the
+        order they were sent. The caller must hold the PID's lock.
+
+        Args:
+            use_ring: False sends through the pipe; used for read-only requests,
+                which the DLL answers inline and which gain nothing from the ring.
+
+        Returns:
+            One of the DELIVERY_* status values.
+        """
+        ring = self._rings.get(pid) if use_ring else None
+        if ring is None:
+            return self._write_command(self.pipe_handles.get(pid), data)
+        deadline = time.monotonic() + RING_WRITE_TIMEOUT_MS / 1000
+        if len(data) <= ring.max_message_size:
+            if ring.push_wait(data, deadline):
+                return DELIVERY_DELIVERED
+        elif ring.wait_drained(deadline):
+            return self._write_command(self.pipe_handles.get(pid), data)
+        logger.warning("Shared ring of PID %s is full; the DLL is not consuming commands.", pid)
+        self.metrics.inc("write_failures_total", status=DELIVERY_TIMED_OUT)
+        return DELIVERY_TIMED_OUT
+
+    def _send_command_to_handle(self, handle: object, command: str | bytes) -> bool:
+        return self._write_command(handle, command) == DELIVERY_DELIVERED
+
+    def _next_request_id(self) -> int:
+        return next(self._request_ids) & 0xFFFFFFFF
+
+    def _encode_command(self, pid: int, command: str) -> bytes:
+        """Encodes a legacy string command for the protocol negotiated with the PID."""
+        if self.pipe_protocols.get(pid) == PROTOCOL_FRAMED:
+            return legacy_to_frame(command, self._next_request_id(), FLAG_NO_REPLY)
+        return command.encode('utf-8')
+
+    def _encode_text(self, pid: int, text: str, mode: str) -> bytes:
+        """Encodes a TYPE command; targets on the legacy protocol always get the paced TYPE: string."""
+        if mode != TEXT_MODE_LEGACY and self.pipe_protocols.get(pid) == PROTOCOL_FRAMED:
+            return encode_frame(OP_TYPE_EX, self._next_request_id(), encode_type_ex_payload(text, mode), FLAG_NO_REPLY)
+        return self._encode_command(pid, f"{COMMAND_TYPE_PREFIX}{text}")
+
+    def _await_response(self, pid: int, request_id: int, deadline: float) -> Frame | None:
+        """
+        Reads frames from a PID until the response with request_id arrives; other frames are stashed.
+
+        The caller must hold the PID's lock.
+        """
+        with self._state_lock:
+            handle = self.pipe_handles.get(pid)
+            decoder = self._decoders.get(pid)
+            if handle is None or decoder is None:
+                return None
+            stash = self._stashed_frames.setdefault(pid, {})
+        start = time.perf_counter()
+        try:
+            while request_id not in stash:
+                data = self._read_available(handle, deadline)
+                if not data:
+                    logger.warning("Timed out waiting for response %s from PID %s.", request_id, pid)
+                    self.metrics.inc("read_timeouts_total", pid=pid)
+                    return None
+                for frame in decoder.feed(data):
+                    stash[frame.request_id] = frame
+                while len(stash) > MAX_STASHED_FRAMES:
+                    del stash[next(iter(stash))]
+        except (TransportError, ProtocolError) as e:
+            logger.warning("Error reading response from PID %s: %s", pid, e)
+            self.metrics.inc("read_errors_total", pid=pid)
+            self.close_single_pipe(pid)
+            return None
+        self.metrics.observe("read_seconds", time.perf_counter() - start, pid=pid)
+        return stash.pop(request_id)
+
+    def _record_response(self, pid: int, opcode: int, frame: Frame | None, elapsed_s: float):
+        """Records the round trip of one framed request and the DLL execution time it reports."""
+        command = OPCODE_NAMES.get(opcode, str(opcode))
+        self.metrics.observe("command_seconds", elapsed_s, pid=pid, command=command)
+        if frame is None or frame.is_error:
+            self.metrics.inc("command_failures_total", pid=pid, command=command,
+                             reason="no_response" if frame is None else "error")
+            return
+        frames = [frame]
+        if opcode == OP_BATCH:
+            try:
+                frames = decode_batch_response(frame.payload)
+            except ProtocolError:
+                return
+        for sub in frames:
+            exec_us = parse_exec_us(sub.payload)
+            if exec_us is not None:
+                self.metrics.observe("dll_exec_seconds", exec_us / 1e6, pid=pid,
+                                     command=OPCODE_NAMES.get(sub.opcode, str(sub.opcode)))
+
+    def pipeline(self, pid: int, requests: list[tuple[int, bytes]],
+                 timeout_ms: int = DEFAULT_RESPONSE_TIMEOUT_MS) -> list[Frame | None]:
+        """
+        Sends several framed requests to one PID in a single write and collects their responses.
+
+        Responses are matched to requests by request ID, so no round trip is
+        needed between commands. The PID's lock is held from the write until
+        the last response is read, so concurrent callers never interleave on
+        one handle; callers on other PIDs are not blocked.
+
+        Args:
+            pid: A PID connected with the framed protocol.
+            requests: (opcode, payload) pairs, sent in order.
+            timeout_ms: Deadline for receiving all responses.
+
+        Returns:
+            The response frame for each request, or None where none arrived.
+        """
+        request_ids = [self._next_request_id() for _ in requests]
+        data = b"".join(encode_frame(opcode, request_id, payload)
+                        for (opcode, payload), request_id in zip(requests, request_ids))
+        with self._pid_lock(pid):
+            if pid not in self.pipe_handles or self.pipe_protocols.get(pid) != PROTOCOL_FRAMED:
+                logger.warning("Cannot pipeline to PID %s: Not connected with framed protocol.", pid)
+                return [None] * len(requests)
+            sent_at = time.perf_counter()
+            mutating = any(opcode not in READ_ONLY_OPCODES for opcode, _ in requests)
+            status = self._write_pid_data(pid, data, use_ring=mutating)
+            if mutating:
+                self.info_cache.invalidate(pid)
+                self.snapshots.invalidate(pid)
+            if status != DELIVERY_DELIVERED:
+                logger.warning("Failed to send requests to PID %s (%s).", pid, status)
+                if status in (DELIVERY_BROKEN, DELIVERY_ERROR):
+                    self.close_single_pipe(pid)
+                return [None] * len(requests)
+            deadline = time.monotonic() + timeout_ms / 1000
+            responses = []
+            for (opcode, _), request_id in zip(requests, request_ids):
+                frame = self._await_response(pid, request_id, deadline)
+                self._record_response(pid, opcode, frame, time.perf_counter() - sent_at)
+                responses.append(frame)
+            return responses
+
+    def send_request(self, pid: int, opcode: int, payload: bytes = b"",
+                     timeout_ms: int = DEFAULT_RESPONSE_TIMEOUT_MS) -> Frame | None:
+        """Sends one framed request and waits for its response."""
+        return self.pipeline(pid, [(opcode, payload)], timeout_ms)[0]
+
+    def query_process_info(self, pid: int, max_age_s: float | None = None) -> dict | None:
+        """
+        Sends a query command to a specific process and reads the response.
+
+        Results are served from info_cache while they are fresh. The write and
+        the read happen under the PID's lock, so a concurrent call on the same
+        PID cannot consume this response.
+
+        Args:
+            pid: The process ID to query.
+            max_age_s: Oldest cached result to accept; defaults to the cache
+                TTL, 0 always queries the process.
+
+        Returns:
+            A dictionary with process info if successful, None otherwise.
+        """
+        info = self.info_cache.get(pid, max_age_s)
+        if info is not None:
+            self.metrics.inc("info_cache_total", result="hit")
+            return info
+        self.metrics.inc("info_cache_total", result="miss")
+        with self._pid_lock(pid):
+            # 等待锁期间另一个调用可能已经刷新了缓存
+            info = self.info_cache.get(pid, max_age_s)
+            if info is None:
+                info = self._query_process_info_locked(pid)
+                if info is not None:
+                    self.info_cache.put(pid, info)
+                    self.target_index.update_title(pid, info.get('Title', ''))
+            return info
+
+    def query_snapshot(self, pid: int, since: int | None = None, max_age_s: float | None = None,
+                       timeout_ms: int = DEFAULT_RESPONSE_TIMEOUT_MS) -> dict | None:
+        """
+        Returns the window tree and menu table of a framed target.
+
+        A stale or missing snapshot is refreshed with OP_SNAPSHOT, sending the
+        cached version so the DLL only returns the nodes that changed since.
+
+        Args:
+            pid: The process ID.
+            since: Return only the nodes changed or removed after this version
+                (see WindowSnapshot.changes_since()); None returns the whole snapshot.
+            max_age_s: Oldest cached snapshot to accept; defaults to the cache TTL.
+            timeout_ms: Deadline for the DLL's response.
+
+        Returns:
+            The snapshot as a dict, or None if the PID is not connected with the
+            framed protocol or its DLL does not support snapshots.
+        """
+        snapshot = self.snapshots.get(pid, max_age_s, since)
+        if snapshot is not None:
+            self.metrics.inc("snapshot_cache_total", result="hit")
+            return snapshot
+        self.metrics.inc("snapshot_cache_total", result="miss")
+        with self._pid_lock(pid):
+            snapshot = self.snapshots.get(pid, max_age_s, since)
+            if snapshot is None and self.pipe_protocols.get(pid) == PROTOCOL_FRAMED:
+                if self._refresh_snapshot_locked(pid, timeout_ms):
+                    snapshot = self.snapshots.get(pid, float("inf"), since)
+            return snapshot
+
+    def _refresh_snapshot_locked(self, pid: int, timeout_ms: int) -> bool:
+        """Fetches a diff (or a full snapshot) from the DLL and applies it; the caller holds the PID's lock."""
+        for since in dict.fromkeys((self.snapshots.version(pid), 0)):
+            frame = self.send_request(pid, OP_SNAPSHOT, encode_snapshot_request(since), timeout_ms)
+            if frame is None:
+                return False
+            if frame.is_error:
+                logger.warning("PID %s cannot take window snapshots: %s", pid, parse_kv(frame.payload).get('Error'))
+                return False
+            try:
+                delta = parse_snapshot(frame.payload)
+                self.snapshots.apply(pid, delta)
+            except ValueError as e:
+                # 本地副本与 DLL 不一致时, 丢弃并请求一次完整快照
+                logger.warning("Discarding window snapshot of PID %s: %s", pid, e)
+                self.snapshots.discard(pid)
+                continue
+            self.metrics.inc("snapshot_total", kind="full" if delta.full else "diff")
+            self.metrics.inc("snapshot_bytes_total", len(frame.payload), kind="full" if delta.full else "diff")
+            return True
+        return False
+
+    def get_process_infos(self, pids: list[int] | None = None,
+                          max_age_s: float | None = None) -> dict[int, dict | None]:
+        """
+        Returns process info for several PIDs, querying only those without a fresh cache entry.
+
+        Cache misses are queried in parallel on the worker pool.
+
+        Args:
+            pids: PIDs to look up; defaults to every connected PID.
+            max_age_s: Oldest cached result to accept; defaults to the cache TTL.
+        """
+        targets = pids if pids is not None else self.get_connected_pids()
+        infos = {pid: self.info_cache.get(pid, max_age_s) for pid in targets}
+        missing = [pid for pid, info in infos.items() if info is None]
+        if missing:
+            executor = self._get_executor()
+            futures = {executor.submit(self.query_process_info, pid, max_age_s): pid for pid in missing}
+            for future in as_completed(futures):
+                pid = futures[future]
+                try:
+                    infos[pid] = future.result()
+                except Exception as e:
+                    logger.error("Unexpected error querying PID %s: %s", pid, e)
+        return infos
+
+    def select_targets(self, pids: list[int] | None = None, exe: str | None = None,
+                       title: str | None = None) -> list[int]:
+        """
+        Returns the connected PIDs matching every given criterion; no criteria selects all of them.
+
+        Matching runs against target_index, so no pipe is touched except to
+        learn the title of PIDs that have never been queried when a title
+        pattern is given. A title pattern is searched in every candidate's
+        title, i.e. in every connected PID unless pids or exe narrow the set.
+
+        Args:
+            pids: Explicit PIDs.
+            exe: Executable name, case-insensitive, with or without ".exe".
+            title: Regular expression searched in the window title.
+
+        Raises:
+            re.error: If title is not a valid regular expression.
+        """
+        if title is not None:
+            re.compile(title)  # 先校验, 避免为无效的表达式查询进程
+            # 只为通过 PID/exe 过滤的候选查询标题
+            unknown = self.target_index.pids_without_title(self.target_index.select(pids, exe))
+            if unknown:
+                self.get_process_infos(unknown)
+        return self.target_index.select(pids, exe, title)
+
+    def _query_process_info_locked(self, pid: int) -> dict | None:
+        if pid not in self.pipe_handles:
+            logger.warning("Cannot query PID %s: Not connected.", pid)
+            return None
+
+        handle = self.pipe_handles[pid]
+        logger.debug("Querying info from PID %s...", pid)
+
+        if self.pipe_protocols.get(pid) == PROTOCOL_FRAMED:
+            response = self.send_request(pid, OP_QUERY_INFO)
+            if response is None or response.is_error:
+                logger.warning("Failed to query PID %s.", pid)
+                return None
+            info = parse_kv(response.payload)
+            info.pop("ExecUs", None)  # 已由 _record_response 记入指标, 不属于进程信息
+            return info
+
+        # 1. Send the query command
+        start = time.perf_counter()
+        if not self._send_command_to_handle(handle, COMMAND_QUERY_INFO):
+            logger.warning("Failed to send query to PID %s.", pid)
+            return None
+
+        # 2. Read the response from the pipe
+        try:
+            # 旧协议没有请求 ID, 迟到的响应会被下一次查询读到; 超时后只能断开连接, 之后由重连恢复
+            deadline = time.monotonic() + DEFAULT_RESPONSE_TIMEOUT_MS / 1000
+            with self.metrics.span("read_seconds", pid=pid):
+                data = self.transport.read(handle, deadline)
+            if not data:
+                logger.warning("Timed out waiting for the query response from PID %s.", pid)
+                self.metrics.inc("read_timeouts_total", pid=pid)
+                self.close_single_pipe(pid)
+                return None
+            self.metrics.observe("command_seconds", time.perf_counter() - start, pid=pid, command="query")
+
+            # 3. Decode (UTF-8, trailing nulls removed) and parse the response into a dictionary
+            return parse_kv(data)
+
+        except TransportError as e:
+            logger.warning("Error reading response from PID %s: %s", pid, e)
+            # The pipe might be broken, mark for removal
+            self.close_single_pipe(pid)
+            return None
+        except Exception as e:
+            logger.error("Unexpected error reading response from PID %s: %s", pid, e)
+            return None
+
+    def broadcast_command(self, command_string: str, write_timeout_ms: int = DEFAULT_WRITE_TIMEOUT_MS,
+                          pids: list[int] | None = None) -> dict[int, str]:
+        """
+        Writes a command to every connected process, or to the given PIDs, concurrently.
+
+        Each write runs on the worker pool. Every target's deadline is
+        write_timeout_ms after the broadcast starts, so the call returns within
+        that time even if a target has a full pipe buffer or is busy with
+        another call on its PID. A target whose lock is not free before the
+        deadline is skipped; writes that already started keep running in the
+        background. Both are reported as timed out and their handles stay
+        connected; broken handles are closed.
+
+        Args:
+            command_string: The raw command to send.
+            write_timeout_ms: Per-target write timeout.
+            pids: Target PIDs (see select_targets); defaults to every connected PID.
+
+        Returns:
+            A mapping of PID to one of the DELIVERY_* status values.
+        """
+        return self._broadcast(command_string, lambda pid: self._encode_command(pid, command_string),
+                               write_timeout_ms, pids, self._command_name(command_string))
+
+    @staticmethod
+    def _command_name(command_string: str) -> str:
+        """Metric label of a legacy string command."""
+        if command_string.startswith(COMMAND_TYPE_PREFIX):
+            return "type"
+        if command_string.startswith(COMMAND_MENU_PREFIX):
+            return "menu"
+        if command_string == COMMAND_QUERY_INFO:
+            return "query"
+        return "raw"
+
+    def _broadcast(self, description: str, encode, write_timeout_ms: int,
+                   pids: list[int] | None = None, command: str = "raw") -> dict[int, str]:
+        """Fans encode(pid) out to the target PIDs; see broadcast_command for the semantics."""
+        targets = self.get_connected_pids()
+        if pids is not None:
+            connected = set(targets)
+            targets = [pid for pid in pids if pid in connected]
+        if not targets:
+            logger.warning("No processes currently connected to broadcast command.")
+            return {}
+        logger.debug("Broadcasting command '%s' to %s process(es)...", description, len(targets))
+        # 所有目标共用一个从提交时刻算起的截止时间, 排队等待线程或 PID 锁的时间也计算在内
+        deadline = time.monotonic() + write_timeout_ms / 1000
+
+        def write(pid):
+            # 截止时间过后不再写入 (目标正忙于另一个调用, 或任务排队过久), 否则调用方已放弃的命令仍会执行
+            remaining = deadline - time.monotonic()
+            lock = self._pid_lock(pid)
+            if remaining <= 0 or not lock.acquire(timeout=remaining):
+                return None
+            try:
+                start = time.monotonic()
+                try:
+                    data = encode(pid)
+                except ProtocolError as e:
+                    logger.warning("Cannot encode command for PID %s: %s", pid, e)
+                    return DELIVERY_REJECTED
+                status = self._write_pid_data(pid, data)
+                self.metrics.observe("command_seconds", time.monotonic() - start, pid=pid, command=command)
+                self.info_cache.invalidate(pid)
+                self.snapshots.invalidate(pid)
+                return status
+            finally:
+                lock.release()
+
+        executor = self._get_executor()
+        pending = {executor.submit(write, pid): pid for pid in targets}
+        done, _ = wait(pending, timeout=max(0.0, deadline - time.monotonic()))
+        report = {}
+        for future, pid in pending.items():
+            status = None
+            if future in done:
+                try:
+                    status = future.result()
+                except Exception as e:
+                    logger.error("Unexpected error sending command to PID %s: %s", pid, e)
+                    status = DELIVERY_ERROR
+            report[pid] = status or DELIVERY_TIMED_OUT
+            if status is None:
+                self.metrics.inc("write_failures_total", status=DELIVERY_TIMED_OUT)
+                logger.warning("Write to PID %s timed out after %s ms.", pid, write_timeout_ms)
+
+        for pid, status in report.items():
+            if status in (DELIVERY_BROKEN, DELIVERY_ERROR):
+                logger.warning("Failed to send command to PID %s (%s). Removing.", pid, status)
+                self.close_single_pipe(pid)  # Use helper to close and remove
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Broadcast complete. %s processes remain connected.", len(self.get_connected_pids()))
+        return report
+
+    def send_text(self, text: str, mode: str = TEXT_MODE_LEGACY, write_timeout_ms: int = DEFAULT_WRITE_TIMEOUT_MS,
+                  pids: list[int] | None = None) -> dict[int, str]:
+        """
+        Types text into every connected process, or into the given PIDs.
+
+        Args:
+            text: The text to type.
+            mode: Injection mode in the DLL: "legacy" (one WM_CHAR every 25 ms),
+                "bulk" (quota-paced WM_CHAR bursts) or "paste" (clipboard and
+                WM_PASTE to the focused control). Targets on the legacy protocol always use "legacy".
+            write_timeout_ms: Per-target write timeout.
+            pids: Target PIDs (see select_targets); defaults to every connected PID.
+
+        Returns:
+            A mapping of PID to one of the DELIVERY_* status values.
+        """
+        if not isinstance(text, str):
+            logger.warning("Error: Input to send_text must be a string.")
+            return {}
+        if mode not in TEXT_MODES:
+            logger.warning("Error: Unknown text mode '%s'.", mode)
+            return {}
+        return self._broadcast(f"{COMMAND_TYPE_PREFIX}{text}", lambda pid: self._encode_text(pid, text, mode),
+                               write_timeout_ms, pids, "type")
+
+    def _type_text_on_pid(self, pid: int, text: str, mode: str, timeout_ms: int) -> dict:
+        if self.pipe_protocols.get(pid) != PROTOCOL_FRAMED:
+            ok = self._write_to_pid(pid, f"{COMMAND_TYPE_PREFIX}{text}".encode('utf-8'), "type") == DELIVERY_DELIVERED
+            return {"ok": ok, "mode": TEXT_MODE_LEGACY, "chars": len(text), "ms": None, "chars_per_sec": None}
+        response = self.send_request(pid, OP_TYPE_EX, encode_type_ex_payload(text, mode),
+                                     typing_timeout_ms(text, mode, timeout_ms))
+        if response is None or response.is_error:
+            return {"ok": False, "mode": mode, "chars": 0, "ms": None, "chars_per_sec": None}
+        fields = parse_kv(response.payload)
+        return {"ok": True, "mode": mode, "chars": int(fields.get("Chars", 0)),
+                "ms": float(fields.get("Ms", 0)), "chars_per_sec": float(fields.get("CharsPerSec", 0))}
+
+    def type_text(self, text: str, mode: str = TEXT_MODE_BULK, pids: list[int] | None = None,
+                  timeout_ms: int = DEFAULT_RESPONSE_TIMEOUT_MS) -> dict[int, dict]:
+        """
+        Types text and waits for each target to report its typing throughput.
+
+        Framed targets answer with the number of UTF-16 characters injected,
+        the time it took inside the DLL and the resulting characters per
+        second; legacy targets only report whether the command was written.
+        The wait for each acknowledgement is timeout_ms plus the typing time
+        the mode needs for the text (see typing_timeout_ms()).
+
+        Returns:
+            A mapping of PID to {"ok", "mode", "chars", "ms", "chars_per_sec"}.
+        """
+        if mode not in TEXT_MODES:
+            raise ValueError(f"Unknown text mode: {mode}")
+        targets = [pid for pid in (pids if pids is not None else self.get_connected_pids()) if pid in self.pipe_handles]
+        executor = self._get_executor()
+        futures = {executor.submit(self._type_text_on_pid, pid, text, mode, timeout_ms): pid for pid in targets}
+        results = {}
+        for future in as_completed(futures):
+            pid = futures[future]
+            try:
+                results[pid] = future.result()
+            except Exception as e:
+                logger.error("Unexpected error typing into PID %s: %s", pid, e)
+                results[pid] = {"ok": False, "mode": mode, "chars": 0, "ms": None, "chars_per_sec": None}
+        return results
+
+    def send_menu_command(self, command_id: int, pids: list[int] | None = None) -> dict[int, str]:
+        """
+        Sends a menu command ID to all connected processes, or to the given PIDs.
+
+        Args:
+            command_id: The integer ID of the menu item to trigger.
+            pids: Target PIDs (see select_targets); defaults to every connected PID.
+        """
+        if not isinstance(command_id, int):
+            logger.warning("Error: command_id must be an integer.")
+            return {}
+        return self.broadcast_command(f"{COMMAND_MENU_PREFIX}{command_id}", pids=pids)
+
+    @staticmethod
+    def _batch_request(operation: dict) -> tuple[int, bytes]:
+        """Validates one batch operation and returns its (opcode, payload)."""
+        kind = operation.get("op")
+        if kind == BATCH_OP_TYPE:
+            text = operation.get("text")
+            if not isinstance(text, str):
+                raise ValueError(f"'type' operation needs a string 'text': {operation}")
+            return OP_TYPE, text.encode('utf-8')
+        if kind == BATCH_OP_MENU:
+            command_id = operation.get("id")
+            if not isinstance(command_id, int):
+                raise ValueError(f"'menu' operation needs an integer 'id': {operation}")
+            return OP_MENU, encode_menu_payload(command_id)
+        if kind == BATCH_OP_QUERY:
+            return OP_QUERY_INFO, b""
+        raise ValueError(f"Unknown batch operation: {operation}")
+
+    @staticmethod
+    def _batch_result(operation: dict, frame: Frame | None) -> dict:
+        kind = operation["op"]
+        if frame is None:
+            return {"op": kind, "ok": False, "error": "no response"}
+        fields = parse_kv(frame.payload)
+        if frame.is_error:
+            return {"op": kind, "ok": False, "error": fields.get("Error", "unknown error")}
+        if kind == BATCH_OP_QUERY:
+            fields.pop("ExecUs", None)
+            return {"op": kind, "ok": True, "info": fields}
+        return {"op": kind, "ok": True}
+
+    def _execute_batch_on_pid(self, pid: int, operations: list[dict], requests: list[tuple[int, bytes]],
+                              timeout_ms: int) -> list[dict]:
+        if self.pipe_protocols.get(pid) == PROTOCOL_FRAMED:
+            # OP_TYPE 在 DLL 中按 legacy 模式逐字符输入
+            typed = "".join(operation["text"] for operation in operations if operation["op"] == BATCH_OP_TYPE)
+            response = self.send_request(pid, OP_BATCH, encode_batch(requests),
+                                         typing_timeout_ms(typed, TEXT_MODE_LEGACY, timeout_ms))
+            frames = [None] * len(requests)
+            if response is not None and not response.is_error:
+                by_index = {frame.request_id: frame for frame in decode_batch_response(response.payload)}
+                frames = [by_index.get(index) for index in range(len(requests))]
+            return [self._batch_result(operation, frame) for operation, frame in zip(operations, frames)]
+
+        # 旧协议目标: 逐条发送, 结果格式与帧协议保持一致
+        results = []
+        for operation in operations:
+            kind = operation["op"]
+            if kind == BATCH_OP_QUERY:
+                info = self.query_process_info(pid)
+                results.append({"op": kind, "ok": True, "info": info} if info is not None
+                               else {"op": kind, "ok": False, "error": "no response"})
+                continue
+            if kind == BATCH_OP_TYPE:
+                command = f"{COMMAND_TYPE_PREFIX}{operation['text']}"
+            else:
+                command = f"{COMMAND_MENU_PREFIX}{operation['id']}"
+            ok = self._write_to_pid(pid, command.encode('utf-8'), kind) == DELIVERY_DELIVERED
+            results.append({"op": kind, "ok": True} if ok else {"op": kind, "ok": False, "error": "send failed"})
+        return results
+
+    def execute_batch(self, operations: list[dict], pids: list[int] | None = None,
+                      timeout_ms: int = DEFAULT_RESPONSE_TIMEOUT_MS) -> dict[int, list[dict]]:
+        """
+        Runs an ordered list of operations on each target in one round trip.
+
+        Framed targets receive the whole list as a single OP_BATCH message and
+        answer with all results at once; legacy targets get the operations one
+        by one. Targets are processed in parallel.
+
+        Args:
+            operations: Dicts such as {"op": "type", "text": "..."},
+                {"op": "menu", "id": 302} or {"op": "query"}.
+            pids: Target PIDs; defaults to every connected PID.
+            timeout_ms: Response deadline per target, on top of the typing
+                time of the batch's "type" operations.
+
+        Returns:
+            A mapping of PID to the list of per-operation results.
+
+        Raises:
+            ValueError: If an operation is malformed.
+        """
+        requests = [self._batch_request(operation) for operation in operations]
+        targets = [pid for pid in (pids if pids is not None else self.get_connected_pids()) if pid in self.pipe_handles]
+        if not targets:
+            logger.warning("No processes currently connected to run batch.")
+            return {}
+        executor = self._get_executor()
+        futures = {executor.submit(self._execute_batch_on_pid, pid, operations, requests, timeout_ms): pid
+                   for pid in targets}
+        results = {}
+        for future in as_completed(futures):
+            pid = futures[future]
+            try:
+                results[pid] = future.result()
+            except Exception as e:
+                logger.error("Unexpected error running batch on PID %s: %s", pid, e)
+                results[pid] = [{"op": operation["op"], "ok": False, "error": str(e)} for operation in operations]
+        return results
+
+    def stream_text(self, source: str | Iterable[str], mode: str = TEXT_MODE_BULK, pids: list[int] | None = None,
+                    chunk_chars: int = DEFAULT_STREAM_CHUNK_CHARS, window: int = DEFAULT_STREAM_WINDOW,
+                    progress: Callable[[int, int, int], None] | None = None,
+                    timeout_ms: int = DEFAULT_RESPONSE_TIMEOUT_MS) -> dict[int, dict]:
+        """
+        Streams a large text, or an iterator/generator of text pieces, into the targets.
+
+        The text is cut into OP_TYPE_EX frames of at most chunk_chars characters.
+        Each target may have at most `window` unacknowledged chunks; the DLL
+        acknowledges a chunk after typing it, so a slow target throttles the
+        stream instead of piling data up in the pipe. Memory use is bounded by
+        window * chunk_chars regardless of the total length. Only targets on
+        the framed protocol can be streamed to.
+
+        Args:
+            source: A string or an iterable of strings.
+            mode: Text injection mode for every chunk.
+            pids: Target PIDs; defaults to every connected PID.
+            chunk_chars: Maximum characters per chunk.
+            window: Maximum unacknowledged chunks per target.
+            progress: Called as progress(pid, acked_chars, sent_chars) after each acknowledgement.
+            timeout_ms: Maximum wait for a single acknowledgement, on top of
+                the typing time of the chunk.
+
+        Returns:
+            A mapping of PID to {"ok", "chunks", "sent_chars", "acked_chars", "ms", "error"}.
+        """
+        if mode not in TEXT_MODES:
+            raise ValueError(f"Unknown text mode: {mode}")
+        start_time = time.monotonic()
+        results = {}
+        outstanding = {}
+        for pid in (pids if pids is not None else self.get_connected_pids()):
+            results[pid] = {"ok": True, "chunks": 0, "sent_chars": 0, "acked_chars": 0, "ms": None, "error": None}
+            if pid not in self.pipe_handles:
+                results[pid].update(ok=False, error="not connected")
+            elif self.pipe_protocols.get(pid) != PROTOCOL_FRAMED:
+                results[pid].update(ok=False, error="legacy protocol does not support streaming")
+            else:
+                outstanding[pid] = collections.deque()
+
+        def fail(pid, error):
+            results[pid].update(ok=False, error=error)
+            outstanding[pid].clear()
+
+        def await_oldest(pid):
+            request_id, chars = outstanding[pid].popleft()
+            deadline = time.monotonic() + (timeout_ms + chars * TYPE_ACK_MS_PER_CHAR[mode]) / 1000
+            with self._pid_lock(pid):
+                frame = self._await_response(pid, request_id, deadline)
+            if frame is not None:
+                exec_us = parse_exec_us(frame.payload)
+                if exec_us is not None:
+                    self.metrics.observe("dll_exec_seconds", exec_us / 1e6, pid=pid, command="stream")
+            if frame is None or frame.is_error:
+                fail(pid, "chunk was not acknowledged")
+                return
+            results[pid]["acked_chars"] += chars
+            if progress:
+                progress(pid, results[pid]["acked_chars"], results[pid]["sent_chars"])
+
+        for chunk in iter_text_chunks(source, chunk_chars):
+            active = [pid for pid in outstanding if results[pid]["ok"]]
+            if not active:
+                break
+            payload = encode_type_ex_payload(chunk, mode)
+            for pid in active:
+                while len(outstanding[pid]) >= window and results[pid]["ok"]:
+                    await_oldest(pid)
+                if not results[pid]["ok"]:
+                    continue
+                request_id = self._next_request_id()
+                status = self._write_to_pid(pid, encode_frame(OP_TYPE_EX, request_id, payload), "stream")
+                if status != DELIVERY_DELIVERED:
+                    fail(pid, f"write {status}")
+                    if status in (DELIVERY_BROKEN, DELIVERY_ERROR):
+                        self.close_single_pipe(pid)
+                    continue
+                outstanding[pid].append((request_id, len(chunk)))
+                results[pid]["chunks"] += 1
+                results[pid]["sent_chars"] += len(chunk)
+
+        for pid in outstanding:
+            while outstanding[pid] and results[pid]["ok"]:
+                await_oldest(pid)
+            results[pid]["ms"] = (time.monotonic() - start_time) * 1000
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Stream complete: %s/%s target(s) succeeded.",
+                         sum(1 for result in results.values() if result['ok']), len(results))
+        return results
+
+    def _menu_on_pid(self, pid: int, command_id: int, timeout_ms: int) -> bool:
+        """Runs a menu command on one PID; framed targets are waited on until the DLL has executed it."""
+        if self.pipe_protocols.get(pid) == PROTOCOL_FRAMED:
+            response = self.send_request(pid, OP_MENU, encode_menu_payload(command_id), timeout_ms)
+            return response is not None and not response.is_error
+        return self._write_to_pid(pid, f"{COMMAND_MENU_PREFIX}{command_id}".encode('utf-8'),
+                                  "menu") == DELIVERY_DELIVERED
+
+    def schedule(self, pid: int, priority: int, fn: Callable, *args) -> Future:
+        """
+        Queues fn(*args) on a PID's command queue; see CommandScheduler.
+
+        A full queue does not raise: the returned Future fails with QueueFullError.
+        """
+        try:
+            return self.scheduler.submit(pid, priority, fn, *args)
+        except (QueueFullError, RuntimeError) as e:
+            logger.warning("Cannot queue command for PID %s: %s", pid, e)
+            self.metrics.inc("queue_rejections_total", pid=pid)
+            future = Future()
+            future.set_exception(e)
+            return future
+
+    def schedule_text(self, text: str, mode: str = TEXT_MODE_BULK, pids: list[int] | None = None,
+                      priority: int = PRIORITY_BULK,
+                      timeout_ms: int = DEFAULT_RESPONSE_TIMEOUT_MS) -> dict[int, Future]:
+        """
+        Queues text for each target instead of writing it straight to the pipes.
+
+        A text job on a framed target lasts until the DLL acknowledges the
+        typed text, so queries and menu commands queued meanwhile run before
+        any further text. The futures resolve to the type_text() result dicts.
+
+        Args:
+            text: The text to type.
+            mode: Text injection mode.
+            pids: Target PIDs; defaults to every connected PID.
+            priority: Priority class; PRIORITY_BULK by default.
+            timeout_ms: Acknowledgement deadline per target, on top of the
+                typing time the mode needs (see typing_timeout_ms()).
+
+        Returns:
+            A mapping of PID to the Future of its job.
+        """
+        if mode not in TEXT_MODES:
+            raise ValueError(f"Unknown text mode: {mode}")
+        targets = self.get_connected_pids() if pids is None else pids
+        return {pid: self.schedule(pid, priority, self._type_text_on_pid, pid, text, mode, timeout_ms)
+                for pid in targets}
+
+    def schedule_menu(self, command_id: int, pids: list[int] | None = None,
+                      priority: int = PRIORITY_INTERACTIVE,
+                      timeout_ms: int = DEFAULT_RESPONSE_TIMEOUT_MS) -> dict[int, Future]:
+        """Queues a menu command ahead of pending text; the futures resolve to True if it was executed."""
+        targets = self.get_connected_pids() if pids is None else pids
+        return {pid: self.schedule(pid, priority, self._menu_on_pid, pid, command_id, timeout_ms)
+                for pid in targets}
+
+    def schedule_query(self, pid: int, max_age_s: float | None = None) -> Future:
+        """Queues a QUERY_INFO with the highest priority; fresh cached results resolve immediately."""
+        info = self.info_cache.get(pid, max_age_s)
+        if info is not None:
+            future = Future()
+            future.set_result(info)
+            return future
+        return self.schedule(pid, PRIORITY_CONTROL, self.query_process_info, pid, max_age_s)
+
+    def queue_stats(self) -> dict[int, dict]:
+        """Queue depth, running state, counters and wait times per PID; see CommandScheduler.stats()."""
+        return self.scheduler.stats()
+
+    def broadcast_single_message(self, message_to_send, mode: str = TEXT_MODE_LEGACY,
+                                 pids: list[int] | None = None):
+        message = get_broadcast_message(message_to_send)
+        if not (self.get_connected_pids() if pids is None else pids):
+            logger.warning("没有连接的进程，无法广播")
+            return False
+        logger.debug("准备广播消息: '%s'", message)
+        self.send_text(message, mode, pids=pids)
+        logger.debug("消息广播完成")
+        return True
+
+    def _close_handle(self, handle: object):
+        self.transport.close(handle)
+
+    def close_single_pipe(self, pid: int, lock_timeout_s: float = -1):
+        """
+        Helper to close and remove a single pipe handle.
+
+        Waits for any call in progress on the PID to finish first, so a handle
+        is never closed underneath another thread's request.
+
+        Args:
+            pid: The PID to disconnect.
+            lock_timeout_s: Maximum wait for the PID's lock (-1 waits forever);
+                after it expires the handle is closed anyway.
+        """
+        lock = self._pid_lock(pid)
+        acquired = lock.acquire(timeout=lock_timeout_s)
+        try:
+            with self._state_lock:
+                handle = self.pipe_handles.pop(pid, None)
+                if handle is None:
+                    return
+                self.pipe_protocols.pop(pid, None)
+                self._decoders.pop(pid, None)
+                self._stashed_frames.pop(pid, None)
+                ring = self._rings.pop(pid, None)
+            self.info_cache.invalidate(pid)
+            self.snapshots.invalidate(pid)
+            self.target_index.remove(pid)
+            self._close_handle(handle)
+            if ring is not None:
+                ring.close()
+            self.metrics.inc("evictions_total")
+            logger.info("Removed disconnected PID %s.", pid)
+        finally:
+            if acquired:
+                lock.release()
+
+    def close(self):
+        self.scheduler.shutdown()
+        with self._state_lock:
+            executors = [self._executor, self._scheduler_executor]
+            self._executor = self._scheduler_executor = None
+        for executor in executors:
+            if executor is not None:
+                executor.shutdown(wait=False)
+        pids = self.get_connected_pids()
+        if not pids:
+            return
+        logger.info("Closing all %s pipe connections...", len(pids))
+        for pid in pids:
+            self.close_single_pipe(pid, CLOSE_LOCK_TIMEOUT_S)
+        logger.info("All pipe handles closed.")
+
+    def get_connected_pids(self) -> list[int]:
+        with self._state_lock:
+            return list(self.pipe_handles.keys())
+
+
+class PipeConnectionPool:
+    """
+    Server-lifetime owner of a single ProcessInputController.
+
+    Discovery and connection happen on first use (or earlier, in the
+    background, after warm_up()); later acquisitions return the controller
+    as it is, without touching any pipe. Once the controller exists, a
+    HealthMonitor evicts dead handles, reconnects evicted PIDs with backoff
+    and rediscovers targets in the background. With the monitor disabled,
+    callers rediscover explicitly (ProcessInputController.rediscover()).
+    """
+
+    def __init__(self, dll_name: str = INJECTED_DLL_NAME, pipe_name_base: str = PIPE_NAME_BASE,
+                 connect_timeout_ms: int = 5000, reconnect_timeout_ms: int = POOL_RECONNECT_TIMEOUT_MS,
+                 rediscover_interval_s: float = HEALTH_REDISCOVER_INTERVAL_S,
+                 health_check_interval_s: float = HEARTBEAT_INTERVAL_S, shared_ring: bool = False,
+                 **controller_options):
+        """
+        Args:
+            reconnect_timeout_ms: Deadline of one reconnect attempt by the health monitor.
+            rediscover_interval_s: Time between two rediscoveries by the health monitor.
+            health_check_interval_s: Heartbeat interval of the background
+                health monitor; 0 disables the monitor.
+            shared_ring: Negotiate shared-memory command rings with framed targets.
+            controller_options: Further ProcessInputController keyword arguments
+                (e.g. transport and discovery for simulated targets).
+        """
+        self.dll_name = dll_name
+        self.pipe_name_base = pipe_name_base
+        self.connect_timeout_ms = connect_timeout_ms
+        self.reconnect_timeout_ms = reconnect_timeout_ms
+        self.rediscover_interval_s = rediscover_interval_s
+        self.health_check_interval_s = health_check_interval_s
+        self.shared_ring = shared_ring
+        self.controller_options = controller_options
+        self._controller = None
+        self._health_monitor = None
+        self._lock = threading.Lock()
+
+    def acquire(self) -> ProcessInputController:
+        """
+        Returns the shared controller, creating it (discovery and connect included) on first use.
+
+        Only the first call takes the pool lock for discovery; later calls
+        return immediately. Reconnects and rediscovery are left to the health
+        monitor, so a tool call never waits on them.
+        """
+        controller = self._controller
+        if controller is not None:
+            return controller
+        with self._lock:
+            if self._controller is None:
+                controller = ProcessInputController(dll_name=self.dll_name, pipe_name_base=self.pipe_name_base,
+                                                    connect_timeout_ms=self.connect_timeout_ms,
+                                                    shared_ring=self.shared_ring, **self.controller_options)
+                if self.health_check_interval_s > 0:
+                    self._health_monitor = HealthMonitor(controller, self.health_check_interval_s,
+                                                         reconnect_timeout_ms=self.reconnect_timeout_ms,
+                                                         rediscover_interval_s=self.rediscover_interval_s)
+                    self._health_monitor.start()
+                self._controller = controller
+            return self._controller
+
+    async def acquire_async(self) -> "AsyncProcessInputController":
+        """Awaitable acquire(); the first-time discovery runs off the event loop."""
+        controller = self._controller
+        if controller is None:
+            controller = await asyncio.to_thread(self.acquire)
+        return AsyncProcessInputController(controller)
+
+    def warm_up(self) -> threading.Thread:
+        """
+        Discovers and connects the targets on a background thread.
+
+        The server calls this right before it starts accepting connections, so
+        discovery overlaps with server start-up. A tool call that arrives
+        before the warm-up has finished waits for it in acquire() instead of
+        starting a second discovery.
+        """
+        thread = threading.Thread(target=self._warm_up, name="pool-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def _warm_up(self):
+        start = time.perf_counter()
+        try:
+            controller = self.acquire()
+        except Exception as e:
+            logger.warning("Connection pool warm-up failed: %s", e)
+            return
+        logger.info("Connection pool warmed up in %.0f ms, %s target(s) connected.",
+                    (time.perf_counter() - start) * 1000, len(controller.get_connected_pids()))
+
+    def close(self):
+        with self._lock:
+            if self._health_monitor:
+                self._health_monitor.stop()
+                self._health_monitor = None
+            if self._controller:
+                self._controller.close()
+                self._controller = None
+
+
+class AsyncProcessInputController:
+    """
+    Awaitable facade over ProcessInputController.
+
+    Every blocking pipe operation (discovery, CreateFile, WriteFile, ReadFile)
+    runs on a worker thread via asyncio.to_thread, so the event loop serving
+    MCP sessions never waits on a pipe.
+    """
+
+    def __init__(self, controller: ProcessInputController):
+        self.controller = controller
+
+    @classmethod
+    async def create(cls, **kwargs) -> "AsyncProcessInputController":
+        """Builds a ProcessInputController (discovery and connect included) off the event loop."""
+        controller = await asyncio.to_thread(ProcessInputController, **kwargs)
+        return cls(controller)
+
+    async def discover(self) -> dict[int, str]:
+        return await asyncio.to_thread(self.controller.rediscover)
+
+    async def reconnect_missing(self, timeout_ms: int = POOL_RECONNECT_TIMEOUT_MS) -> int:
+        return await asyncio.to_thread(self.controller.reconnect_missing, timeout_ms)
+
+    async def select_targets(self, pids: list[int] | None = None, exe: str | None = None,
+                             title: str | None = None) -> list[int]:
+        return await asyncio.to_thread(self.controller.select_targets, pids, exe, title)
+
+    async def broadcast_command(self, command_string: str, write_timeout_ms: int = DEFAULT_WRITE_TIMEOUT_MS,
+                                pids: list[int] | None = None) -> dict[int, str]:
+        return await asyncio.to_thread(self.controller.broadcast_command, command_string, write_timeout_ms, pids)
+
+    async def send_text(self, text: str, mode: str = TEXT_MODE_LEGACY,
+                        pids: list[int] | None = None) -> dict[int, str]:
+        return await asyncio.to_thread(self.controller.send_text, text, mode, DEFAULT_WRITE_TIMEOUT_MS, pids)
+
+    async def type_text(self, text: str, mode: str = TEXT_MODE_BULK, pids: list[int] | None = None,
+                        timeout_ms: int = DEFAULT_RESPONSE_TIMEOUT_MS) -> dict[int, dict]:
+        return await asyncio.to_thread(self.controller.type_text, text, mode, pids, timeout_ms)
+
+    async def send_menu_command(self, command_id: int, pids: list[int] | None = None) -> dict[int, str]:
+        return await asyncio.to_thread(self.controller.send_menu_command, command_id, pids)
+
+    async def execute_batch(self, operations: list[dict], pids: list[int] | None = None,
+                            timeout_ms: int = DEFAULT_RESPONSE_TIMEOUT_MS) -> dict[int, list[dict]]:
+        return await asyncio.to_thread(self.controller.execute_batch, operations, pids, timeout_ms)
+
+    async def stream_text(self, source: str | Iterable[str], mode: str = TEXT_MODE_BULK,
+                          pids: list[int] | None = None, chunk_chars: int = DEFAULT_STREAM_CHUNK_CHARS,
+                          window: int = DEFAULT_STREAM_WINDOW,
+                          progress: Callable[[int, int, int], None] | None = None,
+                          timeout_ms: int = DEFAULT_RESPONSE_TIMEOUT_MS) -> dict[int, dict]:
+        """Runs stream_text on a worker thread; a sync iterator source is consumed on that thread."""
+        return await asyncio.to_thread(self.controller.stream_text, source, mode, pids, chunk_chars, window, progress,
+                                       timeout_ms)
+
+    @staticmethod
+    async def _gather_futures(futures: dict[int, Future]) -> dict[int, object]:
+        """Awaits scheduler futures; a failed job yields its exception as the PID's result."""
+        results = await asyncio.gather(*(asyncio.wrap_future(future) for future in futures.values()),
+                                       return_exceptions=True)
+        return dict(zip(futures, results))
+
+    async def type_queued(self, text: str, mode: str = TEXT_MODE_BULK,
+                          pids: list[int] | None = None) -> dict[int, object]:
+        """Types text through the per-PID queues and waits until every target has handled it."""
+        return await self._gather_futures(self.controller.schedule_text(text, mode, pids))
+
+    async def menu_queued(self, command_id: int, pids: list[int] | None = None) -> dict[int, object]:
+        """Runs a menu command through the per-PID queues, ahead of any queued text."""
+        return await self._gather_futures(self.controller.schedule_menu(command_id, pids))
+
+    def queue_stats(self) -> dict[int, dict]:
+        return self.controller.queue_stats()
+
+    def metrics_snapshot(self) -> dict:
+        return self.controller.metrics.snapshot()
+
+    def metrics_prometheus(self) -> str:
+        return self.controller.metrics.render_prometheus()
+
+    async def broadcast_single_message(self, message_to_send, mode: str = TEXT_MODE_LEGACY,
+                                       pids: list[int] | None = None) -> bool:
+        return await asyncio.to_thread(self.controller.broadcast_single_message, message_to_send, mode, pids)
+
+    async def query_process_info(self, pid: int, max_age_s: float | None = None) -> dict | None:
+        return await asyncio.to_thread(self.controller.query_process_info, pid, max_age_s)
+
+    async def query_all(self, max_age_s: float | None = None,
+                        pids: list[int] | None = None) -> dict[int, dict | None]:
+        """Queries every connected PID (or the given ones) concurrently; fresh cached results are not re-queried."""
+        pids = self.get_connected_pids() if pids is None else pids
+        results = await asyncio.gather(*(self.query_process_info(pid, max_age_s) for pid in pids))
+        return dict(zip(pids, results))
+
+    async def query_snapshot(self, pid: int, since: int | None = None,
+                             max_age_s: float | None = None) -> dict | None:
+        return await asyncio.to_thread(self.controller.query_snapshot, pid, since, max_age_s)
+
+    def cached_process_infos(self) -> dict[int, dict]:
+        """Returns the fresh info_cache entries without touching any pipe."""
+        return self.controller.info_cache.snapshot()
+
+    def get_connected_pids(self) -> list[int]:
+        return self.controller.get_connected_pids()
+
+    async def close(self):
+        await asyncio.to_thread(self.controller.close)
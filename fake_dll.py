@@ -0,0 +1,532 @@
+"""
+Stand-in for MCP_Tool.dll injected into simulated processes.
+
+Every simulated target is a Unix domain socket server named <prefix><pid>,
+the same naming scheme the DLL uses for its pipes, so PipeNamespaceDiscovery
+and UnixSocketTransport work against it unchanged. Targets speak the legacy
+TYPE:/MENU:/QUERY_INFO strings and the framed protocol (HELLO, TYPE, TYPE_EX,
+MENU, QUERY_INFO, BATCH, PING, SNAPSHOT), execute commands one at a time
+like the DLL's executor thread, answer read-only opcodes inline, accept
+shared-memory command rings (OP_RING_ATTACH), and can inject typing delays,
+error responses and dropped connections. Each target has a small simulated
+window tree and menu table: typed text shows up in its edit control and
+menu commands toggle the check mark of their item.
+
+Usage: python fake_dll.py --count 10 --char-delay-ms 1
+"""
+import argparse
+import asyncio
+import itertools
+import mmap
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+from shared_ring import (SharedRing, ring_size, RING_FIELD_NAME, RING_FIELD_EVENT, RING_FIELD_SLOTS,
+                         RING_FIELD_SLOT_SIZE)
+from window_snapshot import (format_window_record, format_menu_record, record_key, SNAPSHOT_SINCE_FIELD,
+                             SNAPSHOT_REMOVED)
+from wire_protocol import (FrameDecoder, ProtocolError, encode_frame, parse_kv, PROTOCOL_MAGIC, PROTOCOL_VERSION,
+                           OP_HELLO, OP_TYPE, OP_MENU, OP_QUERY_INFO, OP_BATCH, OP_TYPE_EX, OP_PING, OP_RING_ATTACH,
+                           OP_SNAPSHOT,
+                           FLAG_RESPONSE, FLAG_NO_REPLY, FLAG_ERROR, TEXT_MODES,
+                           LEGACY_TYPE_PREFIX, LEGACY_MENU_PREFIX, LEGACY_QUERY_INFO)
+
+DEFAULT_SOCKET_PREFIX = "GenericInputPipe_"
+# 模拟 PID 从此值开始, 高于 Linux 的 pid_max 上限 (4194304), 不会与真实进程冲突
+FAKE_PID_BASE = 5_000_000
+READ_SIZE = 4096
+INLINE_OPCODES = (OP_HELLO, OP_PING, OP_QUERY_INFO)
+# 环变空后先轮询一段时间再宣布等待, 连续的命令流因此不需要唤醒 (对应 DLL 中的自旋)
+RING_IDLE_POLL_S = 0.0005
+RING_IDLE_POLLS = 10
+# 环形缓冲区消费者在没有收到唤醒时的最长睡眠时间, 兜底丢失的唤醒
+RING_WAIT_TIMEOUT_S = 0.05
+# 流式套接字没有消息边界, 连续发送的旧协议命令可能合并到一次读取中; 按已知前缀拆分
+LEGACY_COMMAND_SPLIT = re.compile(f"(?=(?:{re.escape(LEGACY_TYPE_PREFIX)}|{re.escape(LEGACY_MENU_PREFIX)}"
+                                  f"|{re.escape(LEGACY_QUERY_INFO)}))")
+
+# --- Simulated Window ---
+DEFAULT_CONTROLS = 8
+CONTROL_CLASSES = ("Edit", "Button", "Static", "ComboBox")
+# 编辑框快照中保留的文本长度 (对应 DLL 的 SNAPSHOT_MAX_TEXT_CHARS)
+SNAPSHOT_TEXT_CHARS = 512
+MENU_STATE_CHECKED = 0x8  # MFS_CHECKED
+# (path, command id, text); 没有命令 ID 的条目是子菜单
+FAKE_MENUS = (("0", 0, "&File"), ("0.0", 100, "&New\tCtrl+N"), ("0.1", 101, "&Open...\tCtrl+O"),
+              ("0.2", 102, "E&xit"), ("1", 0, "&Format"), ("1.0", 200, "&Word Wrap"), ("1.1", 302, "&Font..."))
+
+
+class FakeDll:
+    """One simulated injected process."""
+
+    def __init__(self, address: str, pid: int, title: str | None = None, framed: bool = True,
+                 shared_ring: bool = True, char_delay_s: float = 0.0, menu_delay_s: float = 0.0, error_rate: float = 0.0,
+                 drop_rate: float = 0.0, seed: int | None = None, controls: int = DEFAULT_CONTROLS,
+                 query_delay_s: float = 0.0):
+        """
+        Args:
+            address: Socket path to listen on.
+            pid: PID reported by QUERY_INFO.
+            title: Window title reported by QUERY_INFO.
+            framed: Answer HELLO and speak the framed protocol; False emulates
+                a DLL that only knows the legacy string commands.
+            shared_ring: Accept OP_RING_ATTACH; False emulates a DLL built
+                before shared-memory rings, which answers it with an error.
+            char_delay_s: Simulated typing time per character.
+            menu_delay_s: Simulated execution time of a menu command.
+            error_rate: Probability that a command fails with an error response.
+            drop_rate: Probability that a command closes the connection instead
+                of running, like a target that crashed.
+            seed: Seed for the failure injection.
+            controls: Number of child controls in the simulated window tree.
+            query_delay_s: Time QUERY_INFO takes to answer, like a target whose
+                window is hung.
+        """
+        self.address = address
+        self.pid = pid
+        self.title = title if title is not None else f"Fake Target {pid}"
+        self.framed = framed
+        self.shared_ring = shared_ring
+        self.char_delay_s = char_delay_s
+        self.menu_delay_s = menu_delay_s
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self._random = random.Random(seed)
+        self.controls = controls
+        self.query_delay_s = query_delay_s
+        # 模拟窗口状态: 编辑框中的文本 (仅保留末尾部分) 和已勾选的菜单命令
+        self._document = ""
+        self._checked_menus = set()
+        # 快照版本在所有连接间唯一, 不同连接的版本号不会被误认为基准
+        self._snapshot_versions = itertools.count(1)
+        # writer -> {"version": 上次发出的快照版本, "records": {key: line}}
+        self._snapshot_sessions = {}
+        self.stats = {"connections": 0, "rings": 0, "commands": 0, "typed_chars": 0, "menus": 0, "queries": 0,
+                      "errors": 0, "drops": 0}
+        self._server = None
+        self._queue = None
+        self._executor = None
+        self._writers = set()
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._executor = asyncio.create_task(self._execute_loop())
+        self._server = await asyncio.start_unix_server(self._serve, path=self.address)
+
+    async def stop(self):
+        self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+        await self._server.wait_closed()
+        self._executor.cancel()
+        while not self._queue.empty():
+            job, _ = self._queue.get_nowait()
+            job.close()
+        try:
+            os.unlink(self.address)
+        except FileNotFoundError:
+            pass
+
+    # --- Command execution (one at a time, like the DLL's executor thread) ---
+
+    async def _execute_loop(self):
+        while True:
+            job, on_done = await self._queue.get()
+            try:
+                result = await job
+            except Exception:
+                continue  # 与 DLL 一样, 失败的命令没有响应, 由控制端超时处理
+            if on_done is not None:
+                on_done(result)
+
+    def _submit(self, coroutine, on_done=None):
+        """
+        Queues a job for the executor without waiting for it, so the reader
+        keeps answering inline opcodes; on_done(result) runs when it finishes.
+        """
+        self._queue.put_nowait((coroutine, on_done))
+
+    async def _type(self, text: str) -> bytes:
+        start = time.perf_counter()
+        if self.char_delay_s:
+            await asyncio.sleep(len(text) * self.char_delay_s)
+        self.stats["typed_chars"] += len(text)
+        self._document = (self._document + text)[-SNAPSHOT_TEXT_CHARS:]
+        ms = (time.perf_counter() - start) * 1000
+        chars_per_sec = len(text) * 1000 / ms if ms > 0 else 0.0
+        return f"Status:OK;Chars:{len(text)};Ms:{ms:.3f};CharsPerSec:{chars_per_sec:.1f};".encode()
+
+    async def _menu(self, command_id: int) -> bytes:
+        if self.menu_delay_s:
+            await asyncio.sleep(self.menu_delay_s)
+        self.stats["menus"] += 1
+        self._checked_menus ^= {command_id}
+        return b"Status:OK;"
+
+    async def _query(self) -> bytes:
+        if self.query_delay_s:
+            await asyncio.sleep(self.query_delay_s)
+        self.stats["queries"] += 1
+        return f"PID:{self.pid};HWND:{self.pid * 16};Title:{self.title};".encode()
+
+    def _snapshot_records(self) -> dict[str, str]:
+        """The simulated window tree and menu table as snapshot record lines, keyed by node."""
+        main_hwnd = self.pid * 16
+        lines = [format_window_record(main_hwnd, 0, 0, "FakeMainWindow", 0x16CF0000, True, True,
+                                      (0, 0, 800, 600), self.title)]
+        for index in range(1, self.controls + 1):
+            class_name = CONTROL_CLASSES[(index - 1) % len(CONTROL_CLASSES)]
+            text = self._document if index == 1 else f"{class_name} {index}"
+            top = 30 * index
+            lines.append(format_window_record(main_hwnd * 65536 + index, main_hwnd, 1000 + index, class_name,
+                                              0x50010000, True, True, (10, top, 790, top + 24), text))
+        for path, command_id, text in FAKE_MENUS:
+            state = MENU_STATE_CHECKED if command_id in self._checked_menus else 0
+            lines.append(format_menu_record(path, command_id, state, not command_id, text))
+        return {record_key(line): line for line in lines}
+
+    def _snapshot(self, payload: bytes, session: dict) -> bytes:
+        """Answers OP_SNAPSHOT with the records changed since the version the client sent, like the DLL."""
+        records = self._snapshot_records()
+        try:
+            since = int(parse_kv(payload).get(SNAPSHOT_SINCE_FIELD) or 0)
+        except ValueError:
+            since = 0
+        previous = session.get("records")
+        full = previous is None or since == 0 or since != session.get("version")
+        if full:
+            lines = list(records.values())
+        else:
+            lines = [line for key, line in records.items() if previous.get(key) != line]
+            lines += [SNAPSHOT_REMOVED + key for key in previous.keys() - records.keys()]
+        version = next(self._snapshot_versions) if full or lines else since
+        session.update(version=version, records=records)
+        windows = sum(1 for key in records if key.startswith("W"))
+        header = (f"Version:{version};Base:{0 if full else since};Full:{int(full)};Windows:{windows};"
+                  f"Menus:{len(records) - windows};Truncated:0;")
+        return ("\n".join([header, *lines]) + "\n").encode('utf-8')
+
+    def _inject_failure(self) -> str | None:
+        """Returns "drop", "error" or None for the next command."""
+        if self.drop_rate and self._random.random() < self.drop_rate:
+            self.stats["drops"] += 1
+            return "drop"
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.stats["errors"] += 1
+            return "error"
+        return None
+
+    async def _execute_frame(self, opcode: int, payload: bytes, session: dict | None = None) -> tuple[int, bytes]:
+        """Runs one framed command and returns (flags, response payload); session is the connection's state."""
+        start = time.perf_counter()
+        flags = FLAG_RESPONSE
+        if opcode == OP_HELLO:
+            response = f"Version:{PROTOCOL_VERSION};".encode()
+        elif opcode == OP_PING:
+            response = b"Status:OK;Window:1;"
+        elif opcode == OP_QUERY_INFO:
+            response = await self._query()
+        elif opcode == OP_TYPE:
+            response = await self._type(payload.decode('utf-8', errors='replace'))
+        elif opcode == OP_TYPE_EX:
+            if not payload or payload[0] not in TEXT_MODES.values():
+                return flags | FLAG_ERROR, b"Status:ERROR;Error:unknown text mode;"
+            response = await self._type(payload[1:].decode('utf-8', errors='replace'))
+        elif opcode == OP_MENU and len(payload) == 4:
+            response = await self._menu(int.from_bytes(payload, "little", signed=True))
+        elif opcode == OP_SNAPSHOT and session is not None:
+            response = self._snapshot(payload, session)
+        elif opcode == OP_BATCH:
+            return flags, await self._execute_batch(payload, session)
+        else:
+            return flags | FLAG_ERROR, b"Status:ERROR;Error:unknown opcode;"
+        exec_us = int((time.perf_counter() - start) * 1e6)
+        return flags, response + f"ExecUs:{exec_us};".encode()
+
+    async def _execute_batch(self, payload: bytes, session: dict | None) -> bytes:
+        try:
+            frames = FrameDecoder().feed(payload)
+        except ProtocolError:
+            return encode_frame(OP_BATCH, 0xFFFFFFFF, b"Status:ERROR;Error:malformed batch;", FLAG_ERROR)
+        responses = []
+        for frame in frames:
+            if frame.opcode == OP_BATCH:
+                flags, response = FLAG_RESPONSE | FLAG_ERROR, b"Status:ERROR;Error:nested batch;"
+            else:
+                flags, response = await self._execute_frame(frame.opcode, frame.payload, session)
+            responses.append(encode_frame(frame.opcode, frame.request_id, response, flags))
+        return b"".join(responses)
+
+    # --- Connections ---
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.stats["connections"] += 1
+        self._writers.add(writer)
+        try:
+            first = await reader.read(READ_SIZE)
+            if not first:
+                return
+            if self.framed and first.startswith(PROTOCOL_MAGIC):
+                await self._serve_framed(reader, writer, first)
+            else:
+                await self._serve_legacy(reader, writer, first)
+        except (ConnectionError, ProtocolError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            self._snapshot_sessions.pop(writer, None)
+            writer.close()
+
+    async def _dispatch_frame(self, frame, writer) -> bool:
+        """
+        Answers an inline opcode right away or queues the frame for the executor.
+
+        Like the DLL's reader thread, this never waits for a queued command:
+        PING, HELLO and QUERY_INFO are answered while a long TYPE is still
+        running, and the queued command writes its own response when it
+        finishes. Returns False to drop the connection.
+        """
+        self.stats["commands"] += 1
+        if frame.opcode in INLINE_OPCODES:
+            self._reply(frame, writer, await self._execute_frame(frame.opcode, frame.payload))
+            return True
+        failure = self._inject_failure()
+        if failure == "drop":
+            return False
+        if failure == "error":
+            job = self._fail_frame()
+        else:
+            job = self._execute_frame(frame.opcode, frame.payload, self._snapshot_sessions.setdefault(writer, {}))
+        self._submit(job, lambda result: self._reply(frame, writer, result))
+        return True
+
+    @staticmethod
+    async def _fail_frame() -> tuple[int, bytes]:
+        return FLAG_RESPONSE | FLAG_ERROR, b"Status:ERROR;Error:injected failure;"
+
+    @staticmethod
+    def _reply(frame, writer, result: tuple[int, bytes]):
+        flags, response = result
+        if not frame.flags & FLAG_NO_REPLY and not writer.is_closing():
+            writer.write(encode_frame(frame.opcode, frame.request_id, response, flags))
+
+    async def _serve_framed(self, reader, writer, data: bytes):
+        decoder = FrameDecoder()
+        consumer = None
+        try:
+            while data:
+                for frame in decoder.feed(data):
+                    if frame.opcode == OP_RING_ATTACH and self.shared_ring:
+                        if consumer is None:
+                            consumer = self._attach_ring(frame.payload, writer)
+                        flags, response = ((FLAG_RESPONSE, b"Status:OK;") if consumer is not None
+                                           else (FLAG_RESPONSE | FLAG_ERROR, b"Status:ERROR;Error:cannot attach ring;"))
+                        writer.write(encode_frame(frame.opcode, frame.request_id, response, flags))
+                    elif not await self._dispatch_frame(frame, writer):
+                        return
+                await writer.drain()
+                data = await reader.read(READ_SIZE)
+        finally:
+            if consumer is not None:
+                consumer.cancel()
+
+    # --- Shared-memory command ring ---
+
+    def _attach_ring(self, payload: bytes, writer) -> asyncio.Task | None:
+        """Maps the ring named in an OP_RING_ATTACH payload and starts consuming it."""
+        fields = parse_kv(payload)
+        try:
+            slot_count, slot_size = int(fields[RING_FIELD_SLOTS]), int(fields[RING_FIELD_SLOT_SIZE])
+            fd = os.open(fields[RING_FIELD_NAME], os.O_RDWR)
+            try:
+                buffer = mmap.mmap(fd, ring_size(slot_count, slot_size))
+            finally:
+                os.close(fd)
+            try:
+                ring = SharedRing(buffer, slot_count, slot_size, fields, release=buffer.close, initialize=False)
+                bell = os.open(fields[RING_FIELD_EVENT], os.O_RDONLY | os.O_NONBLOCK)
+            except (ValueError, OSError):
+                buffer.close()
+                raise
+        except (KeyError, ValueError, OSError):
+            return None
+        self.stats["rings"] += 1
+        return asyncio.create_task(self._consume_ring(ring, bell, writer))
+
+    async def _consume_ring(self, ring: SharedRing, bell: int, writer):
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+
+        def on_bell():
+            try:
+                if not os.read(bell, READ_SIZE):
+                    loop.remove_reader(bell)  # 控制端已关闭 FIFO
+            except BlockingIOError:
+                pass
+            wakeup.set()
+
+        loop.add_reader(bell, on_bell)
+        idle_polls = 0
+        try:
+            while True:
+                data = ring.pop()
+                if data is None and idle_polls < RING_IDLE_POLLS:
+                    idle_polls += 1
+                    await asyncio.sleep(RING_IDLE_POLL_S)
+                    continue
+                if data is None:
+                    idle_polls = 0
+                    wakeup.clear()
+                    ring.set_waiting(True)
+                    if not ring.pending():
+                        try:
+                            await asyncio.wait_for(wakeup.wait(), RING_WAIT_TIMEOUT_S)
+                        except asyncio.TimeoutError:
+                            pass
+                    ring.set_waiting(False)
+                    continue
+                idle_polls = 0
+                try:
+                    frames = FrameDecoder().feed(data)
+                except ProtocolError:
+                    writer.close()
+                    return
+                for frame in frames:
+                    if not await self._dispatch_frame(frame, writer):
+                        writer.close()
+                        return
+                await writer.drain()
+        except ConnectionError:
+            writer.close()
+        finally:
+            loop.remove_reader(bell)
+            os.close(bell)
+            ring.close()
+
+    async def _serve_legacy(self, reader, writer, data: bytes):
+        while data:
+            for command in filter(None, LEGACY_COMMAND_SPLIT.split(data.decode('utf-8', errors='replace'))):
+                self.stats["commands"] += 1
+                if command == LEGACY_QUERY_INFO:
+                    writer.write(await self._query())
+                    await writer.drain()
+                elif self._inject_failure() == "drop":
+                    return
+                elif command.startswith(LEGACY_TYPE_PREFIX):
+                    self._submit(self._type(command[len(LEGACY_TYPE_PREFIX):]))
+                elif (command.startswith(LEGACY_MENU_PREFIX)
+                      and command[len(LEGACY_MENU_PREFIX):].lstrip("-").isdigit()):
+                    self._submit(self._menu(int(command[len(LEGACY_MENU_PREFIX):])))
+            data = await reader.read(READ_SIZE)
+
+
+class FakeDllFleet:
+    """
+    Runs simulated targets on one event loop in a background thread.
+
+    The sockets live in one directory, so the controller finds them with
+    PipeNamespaceDiscovery(directory, prefix) and connects through
+    UnixSocketTransport using pipe_name_base.
+    """
+
+    def __init__(self, directory: str | None = None, prefix: str = DEFAULT_SOCKET_PREFIX, **target_options):
+        """
+        Args:
+            directory: Directory for the sockets; a temporary one is created and removed if omitted.
+            prefix: Socket name prefix, followed by the simulated PID.
+            target_options: Default FakeDll keyword arguments for spawned targets.
+        """
+        self._owns_directory = directory is None
+        self.directory = directory or tempfile.mkdtemp(prefix="mcp_fake_dll_")
+        self.prefix = prefix
+        self.target_options = target_options
+        self.targets = {}
+        self._pids = itertools.count(FAKE_PID_BASE)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="FakeDllFleet", daemon=True)
+        self._thread.start()
+
+    @property
+    def pipe_name_base(self) -> str:
+        return os.path.join(self.directory, self.prefix)
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def spawn(self, count: int = 1, **overrides) -> list[int]:
+        """Starts count new targets and returns their simulated PIDs."""
+        pids = []
+        for _ in range(count):
+            pid = next(self._pids)
+            target = FakeDll(f"{self.pipe_name_base}{pid}", pid, **{**self.target_options, **overrides})
+            self._call(target.start())
+            self.targets[pid] = target
+            pids.append(pid)
+        return pids
+
+    def kill(self, pid: int):
+        """Stops one target and removes its socket, like a process that exited."""
+        target = self.targets.pop(pid, None)
+        if target:
+            self._call(target.stop())
+
+    def stats(self) -> dict[int, dict]:
+        return {pid: dict(target.stats) for pid, target in self.targets.items()}
+
+    @staticmethod
+    async def _cancel_tasks():
+        """Cancels the connection handlers and ring consumers that are still running."""
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self):
+        for pid in list(self.targets):
+            self.kill(pid)
+        self._call(self._cancel_tasks())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        if self._owns_directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self) -> "FakeDllFleet":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run simulated MCP_Tool.dll targets on Unix sockets.")
+    parser.add_argument("--count", type=int, default=1, help="number of simulated targets")
+    parser.add_argument("--dir", help="socket directory (default: a new temporary directory)")
+    parser.add_argument("--prefix", default=DEFAULT_SOCKET_PREFIX)
+    parser.add_argument("--legacy", action="store_true", help="only speak the legacy string protocol")
+    parser.add_argument("--no-ring", action="store_true", help="reject shared-memory command rings")
+    parser.add_argument("--char-delay-ms", type=float, default=0.0)
+    parser.add_argument("--menu-delay-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    with FakeDllFleet(args.dir, args.prefix, framed=not args.legacy, shared_ring=not args.no_ring,
+                      char_delay_s=args.char_delay_ms / 1000, menu_delay_s=args.menu_delay_ms / 1000,
+                      error_rate=args.error_rate, drop_rate=args.drop_rate) as fleet:
+        pids = fleet.spawn(args.count)
+        print(f"{len(pids)} simulated target(s) listening, pipe_name_base={fleet.pipe_name_base}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
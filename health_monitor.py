@@ -0,0 +1,132 @@
+import threading
+import time
+
+from log_config import get_logger
+
+logger = get_logger("health")
+
+# --- Heartbeat ---
+HEARTBEAT_INTERVAL_S = 5.0
+PING_TIMEOUT_MS = 1000
+# 重连失败后的指数退避: 0.5s, 1s, 2s ... 最长 60s
+RECONNECT_TIMEOUT_MS = 200
+RECONNECT_BACKOFF_INITIAL_S = 0.5
+RECONNECT_BACKOFF_MAX_S = 60.0
+# 定期重新发现, 以便找到重启后换了 PID 的目标
+HEALTH_REDISCOVER_INTERVAL_S = 15.0
+
+
+class HealthMonitor:
+    """
+    Background heartbeat for a ProcessInputController.
+
+    Every interval_s seconds the monitor pings each connected PID and evicts
+    handles that are dead, then tries to reconnect evicted PIDs whose process
+    still exists, backing off exponentially per PID. PIDs whose process has
+    exited are forgotten and trigger a rediscovery, which picks up targets
+    that were restarted under a new PID. Tool calls therefore find the pool
+    already warm and free of dead handles.
+    """
+
+    def __init__(self, controller, interval_s: float = HEARTBEAT_INTERVAL_S,
+                 ping_timeout_ms: int = PING_TIMEOUT_MS, reconnect_timeout_ms: int = RECONNECT_TIMEOUT_MS,
+                 backoff_initial_s: float = RECONNECT_BACKOFF_INITIAL_S,
+                 backoff_max_s: float = RECONNECT_BACKOFF_MAX_S,
+                 rediscover_interval_s: float = HEALTH_REDISCOVER_INTERVAL_S):
+        """
+        Args:
+            controller: The ProcessInputController to watch.
+            interval_s: Time between two health checks.
+            ping_timeout_ms: Deadline for a framed target to answer OP_PING.
+            reconnect_timeout_ms: Deadline for one reconnect attempt.
+            backoff_initial_s: Delay before retrying after the first failed reconnect.
+            backoff_max_s: Upper bound of the reconnect delay.
+            rediscover_interval_s: Time between two rediscoveries.
+        """
+        self.controller = controller
+        self.interval_s = interval_s
+        self.ping_timeout_ms = ping_timeout_ms
+        self.reconnect_timeout_ms = reconnect_timeout_ms
+        self.backoff_initial_s = backoff_initial_s
+        self.backoff_max_s = backoff_max_s
+        self.rediscover_interval_s = rediscover_interval_s
+        # pid -> (failed attempts, next attempt at)
+        self._backoff = {}
+        self._last_rediscover = time.monotonic()
+        self.last_check = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def check_once(self) -> dict:
+        """
+        Runs one heartbeat, reconnect and rediscovery round.
+
+        Returns:
+            Counts of "alive", "busy", "evicted", "reconnected" and "forgotten" PIDs.
+        """
+        summary = {"alive": 0, "busy": 0, "evicted": 0, "reconnected": 0, "forgotten": 0}
+        for pid, alive in self.controller.heartbeat(self.ping_timeout_ms).items():
+            if alive is None:
+                summary["busy"] += 1
+            elif alive:
+                summary["alive"] += 1
+            else:
+                summary["evicted"] += 1
+                logger.warning("Health check: PID %s did not answer, handle evicted.", pid)
+
+        import psutil  # 第一次检查时才导入
+        now = time.monotonic()
+        due = []
+        missing = self.controller.get_missing_pids()
+        for pid in missing:
+            if not psutil.pid_exists(pid):
+                self.controller.forget_pid(pid)
+                self._backoff.pop(pid, None)
+                summary["forgotten"] += 1
+            elif now >= self._backoff.get(pid, (0, 0.0))[1]:
+                due.append(pid)
+        for pid in list(self._backoff):
+            if pid not in missing:
+                del self._backoff[pid]
+
+        if due:
+            self.controller.reconnect(due, self.reconnect_timeout_ms)
+            connected = set(self.controller.get_connected_pids())
+            for pid in due:
+                if pid in connected:
+                    self._backoff.pop(pid, None)
+                    summary["reconnected"] += 1
+                    continue
+                attempts = self._backoff.get(pid, (0, 0.0))[0] + 1
+                delay = min(self.backoff_max_s, self.backoff_initial_s * 2 ** (attempts - 1))
+                self._backoff[pid] = (attempts, now + delay)
+
+        if summary["forgotten"] or now - self._last_rediscover >= self.rediscover_interval_s:
+            self.controller.rediscover()
+            self._last_rediscover = time.monotonic()
+
+        if summary["evicted"] or summary["reconnected"] or summary["forgotten"]:
+            logger.info("Health check: %s", summary)
+        self.last_check = summary
+        return summary
+
+    def start(self):
+        """Runs check_once() on a background thread every interval_s seconds."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="PipeHealthMonitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.check_once()
+            except Exception as e:
+                logger.warning("Health check error: %s", e)
@@ -0,0 +1,83 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+LOGGER_NAME = "mcp_injector"
+# 通过环境变量调整日志级别, 例如 MCP_INJECTOR_LOG_LEVEL=DEBUG 可以看到每条命令的日志
+LOG_LEVEL_ENV = "MCP_INJECTOR_LOG_LEVEL"
+DEFAULT_LOG_LEVEL = "INFO"
+LOG_FORMAT = "[%(asctime)s] %(levelname)s %(name)s: %(message)s"
+LOG_DATE_FORMAT = "%H:%M:%S"
+
+_listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Returns a child of the package logger, so one level setting controls every module."""
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread.
+
+    The stock QueueHandler renders the message in the logging thread; passing
+    the record through unchanged keeps string formatting and timestamp
+    rendering off the command path.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def configure_logging(level: str | int | None = None, queued: bool = True, stream=None) -> logging.Logger:
+    """
+    Configures the package logger; safe to call more than once.
+
+    Args:
+        level: Log level name or number; defaults to $MCP_INJECTOR_LOG_LEVEL or INFO.
+        queued: Hand records to a background thread through a queue, so a
+            slow console never blocks a pipe operation.
+        stream: Output stream; defaults to stderr, which stays free of MCP
+            protocol traffic.
+
+    Returns:
+        The package logger.
+    """
+    global _listener
+    if level is None:
+        level = os.environ.get(LOG_LEVEL_ENV, DEFAULT_LOG_LEVEL)
+    if isinstance(level, str):
+        level = level.upper()
+
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(level)
+    logger.propagate = False
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT))
+    if queued:
+        records = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(records, handler)
+        _listener.start()
+        logger.addHandler(_DeferredQueueHandler(records))
+    else:
+        logger.addHandler(handler)
+    return logger
+
+
+@atexit.register
+def _stop_listener():
+    """Flushes queued records on interpreter exit."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
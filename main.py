@@ -1,312 +1,352 @@
 # server.py
-import string
-
 from mcp.server.fastmcp import FastMCP
-import win32file
-import win32pipe
-import pywintypes
-import time
-import sys
-import psutil
 import os
+import atexit
+import asyncio
+import json
+import re
+from typing import Iterable
 
+from log_config import get_logger, configure_logging
+from agent_protocol import (AgentClient, AgentError, AGENT_METHOD_TARGETS, AGENT_METHOD_TYPE, AGENT_METHOD_MENU,
+                            AGENT_METHOD_BATCH, AGENT_CALL_TIMEOUT_S, AGENTS_ENV, AGENT_TOKEN_ENV)
+# 控制器位于 controller.py (不依赖 FastMCP); 这里重新导出, 旧的 "from main import ..." 继续可用
+from controller import (ProcessInputController, PipeConnectionPool, AsyncProcessInputController,
+                        find_injected_processes, get_broadcast_message, INJECTED_DLL_NAME, PIPE_NAME_BASE)
+from wire_protocol import TEXT_MODES, TEXT_MODE_BULK
 
 
-# --- Configuration Constants ---
-PIPE_NAME_BASE = r'\\.\pipe\GenericInputPipe_'
-COMMAND_TYPE_PREFIX = "TYPE:"
-# *** 新增: 查询命令 ***
-COMMAND_QUERY_INFO = "QUERY_INFO"
-INJECTED_DLL_NAME = "MCP_Tool.dll"  # 确保这是你实际的 DLL 文件名
-
-
-# ... (get_broadcast_message 和 find_injected_processes 函数保持不变) ...
-def get_broadcast_message(message):
-    return f"{message}"
-
-
-def find_injected_processes(dll_name: str = INJECTED_DLL_NAME) -> list[int]:
-    injected_pids = []
-    dll_name_lower = dll_name.lower()
-    print(f"[{time.strftime('%H:%M:%S')}] Scanning processes for DLL: {dll_name}")
-    for proc in psutil.process_iter(['pid', 'name']):
-        try:
-            pinfo = proc.as_dict(attrs=['pid', 'name'])
-            pid = pinfo['pid']
-            for mapping in proc.memory_maps():
-                if mapping.path and os.path.basename(mapping.path).lower() == dll_name_lower:
-                    print(f"[{time.strftime('%H:%M:%S')}] Found injected process: PID={pid}, Name='{pinfo['name']}'")
-                    injected_pids.append(pid)
-                    break
-        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-            continue
-        except Exception as e:
-            print(f"[{time.strftime('%H:%M:%S')}] Error accessing process {proc.pid}: {e}")
-            continue
-    print(f"[{time.strftime('%H:%M:%S')}] Scan complete. Found {len(injected_pids)} potential target processes.")
-    return injected_pids
-
-
-class ProcessInputController:
-    # ... (__init__, _connect_single_pipe, _discover_and_connect, _send_command_to_handle 保持不变) ...
-    def __init__(self, dll_name: str = INJECTED_DLL_NAME, pipe_name_base: str = PIPE_NAME_BASE,
-                 connect_timeout_ms: int = 5000):
-        self.dll_name = dll_name
-        self.pipe_name_base = pipe_name_base
-        self.connect_timeout_ms = connect_timeout_ms
-        self.pipe_handles = {}
-        print(f"[{time.strftime('%H:%M:%S')}] Initializing ProcessInputController...")
-        self._discover_and_connect()
-
-    def _connect_single_pipe(self, pipe_name: str, timeout_ms: int) -> object | None:
-        start_time = time.time()
-        print(f"[{time.strftime('%H:%M:%S')}] Attempting to connect to pipe: {pipe_name}...")
-        while True:
-            try:
-                handle = win32file.CreateFile(
-                    pipe_name,
-                    win32file.GENERIC_READ | win32file.GENERIC_WRITE,  # Read/Write access is crucial
-                    0, None, win32file.OPEN_EXISTING, 0, None
-                )
-                print(f"[{time.strftime('%H:%M:%S')}] Successfully connected to pipe: {pipe_name}")
-                return handle
-            except pywintypes.error as e:
-                error_code, _, _ = e.args
-                elapsed_ms = (time.time() - start_time) * 1000
-                if error_code == win32pipe.ERROR_PIPE_BUSY:
-                    remaining_timeout_ms = max(0, int(timeout_ms - elapsed_ms))
-                    if win32pipe.WaitNamedPipe(pipe_name, remaining_timeout_ms) == 0:
-                        return None
-                    continue
-                elif error_code == 2:  # ERROR_FILE_NOT_FOUND
-                    if elapsed_ms < timeout_ms:
-                        time.sleep(0.1)
-                        continue
-                    else:
-                        return None
-                else:
-                    print(f"[{time.strftime('%H:%M:%S')}] Error connecting to pipe {pipe_name}: {e}")
-                    return None
-            except Exception as e:
-                print(
-                    f"[{time.strftime('%H:%M:%S')}] An unexpected error occurred during pipe connection to {pipe_name}: {e}")
-                return None
-
-    def _discover_and_connect(self):
-        injected_pids = find_injected_processes(self.dll_name)
-        if not injected_pids:
-            return
-        successful_connections = 0
-        for pid in injected_pids:
-            dynamic_pipe_name = f"{self.pipe_name_base}{pid}"
-            try:
-                handle = self._connect_single_pipe(dynamic_pipe_name, self.connect_timeout_ms)
-                if handle:
-                    self.pipe_handles[pid] = handle
-                    successful_connections += 1
-            except Exception as e:
-                print(f"[{time.strftime('%H:%M:%S')}] Unexpected error during connection for PID {pid}: {e}")
-                continue
-        print(
-            f"[{time.strftime('%H:%M:%S')}] Connection phase complete. Successfully connected to {successful_connections} process(es).")
-
-    def _send_command_to_handle(self, handle: object, command: str) -> bool:
-        if not handle or handle == win32file.INVALID_HANDLE_VALUE:
-            return False
-        try:
-            command_bytes = command.encode('utf-8')  # Send as UTF-8
-            bytes_written, _ = win32file.WriteFile(handle, command_bytes)
-            return True
-        except pywintypes.error as e:
-            error_code, _, _ = e.args
-            if error_code == 109:  # ERROR_BROKEN_PIPE
-                pass
-            else:
-                print(f"[{time.strftime('%H:%M:%S')}] Error sending command via handle {handle}: {e}")
-            return False
-        except Exception as e:
-            print(
-                f"[{time.strftime('%H:%M:%M')}] An unexpected error occurred while sending command via handle {handle}: {e}")
-            return False
-
-    # *** START: NEW BIDIRECTIONAL METHOD ***
-    def query_process_info(self, pid: int) -> dict | None:
-        """
-        Sends a query command to a specific process and reads the response.
+logger = get_logger("server")
+
 
+class AgentAggregator:
+    """
+    Fans controller operations out to remote controller agents (see agent.py).
+
+    One AgentClient per configured address keeps a persistent, multiplexed
+    connection; every call goes to all selected nodes in parallel and the
+    per-node results are merged. A node that is down or times out only shows
+    up in the errors of that call.
+    """
+
+    def __init__(self, addresses: Iterable[str] = (), token: str | None = None,
+                 call_timeout_s: float = AGENT_CALL_TIMEOUT_S):
+        """
         Args:
-            pid: The process ID to query.
+            addresses: "host:port" of each agent; the address is also the node key in results.
+            token: Shared secret of the agents.
+            call_timeout_s: Deadline of a call on each node.
+        """
+        self.clients = {address: AgentClient(address, token, call_timeout_s=call_timeout_s)
+                        for address in dict.fromkeys(addresses)}
+
+    @classmethod
+    def from_env(cls) -> "AgentAggregator":
+        """Builds an aggregator from MCP_INJECTOR_AGENTS and MCP_INJECTOR_AGENT_TOKEN."""
+        addresses = [address.strip() for address in os.environ.get(AGENTS_ENV, "").split(",") if address.strip()]
+        return cls(addresses, os.environ.get(AGENT_TOKEN_ENV))
+
+    def __bool__(self) -> bool:
+        return bool(self.clients)
+
+    async def call_all(self, method: str, nodes: list[str] | None = None,
+                       **params) -> tuple[dict[str, object], dict[str, str]]:
+        """
+        Calls method on every agent (or the given nodes) concurrently.
 
         Returns:
-            A dictionary with process info if successful, None otherwise.
+            (results, errors), both keyed by node address.
         """
-        if pid not in self.pipe_handles:
-            print(f"[{time.strftime('%H:%M:%S')}] Cannot query PID {pid}: Not connected.")
-            return None
-
-        handle = self.pipe_handles[pid]
-        print(f"[{time.strftime('%H:%M:%S')}] Querying info from PID {pid}...")
-
-        # 1. Send the query command
-        if not self._send_command_to_handle(handle, COMMAND_QUERY_INFO):
-            print(f"[{time.strftime('%H:%M:%S')}] Failed to send query to PID {pid}.")
-            return None
-
-        # 2. Read the response from the pipe
-        try:
-            # ReadFile will block until data is received from the server (C++ DLL)
-            result_code, data = win32file.ReadFile(handle, 4096)  # Read up to 4KB
-
-            if result_code == 0:  # Success
-                # Decode from bytes to string (using UTF-8) and remove trailing nulls
-                response_str = data.decode('utf-8').strip('\x00')
-
-                # 3. Parse the response string into a dictionary
-                info_dict = {}
-                parts = response_str.strip(';').split(';')
-                for part in parts:
-                    if ':' in part:
-                        key, value = part.split(':', 1)
-                        info_dict[key] = value
-                return info_dict
+        clients = self.clients if nodes is None else {node: self.clients[node] for node in nodes
+                                                      if node in self.clients}
+        outcomes = await asyncio.gather(*(client.call(method, **params) for client in clients.values()),
+                                        return_exceptions=True)
+        results, errors = {}, {}
+        for node, outcome in zip(clients, outcomes):
+            if isinstance(outcome, AgentError):
+                errors[node] = str(outcome)
+            elif isinstance(outcome, BaseException):
+                logger.error("Agent call %s on %s failed: %s", method, node, outcome)
+                errors[node] = f"internal error: {outcome}"
             else:
-                print(f"[{time.strftime('%H:%M:%S')}] ReadFile failed for PID {pid} with code {result_code}.")
-                return None
-
-        except pywintypes.error as e:
-            print(f"[{time.strftime('%H:%M:%S')}] Error reading response from PID {pid}: {e}")
-            # The pipe might be broken, mark for removal
-            self.close_single_pipe(pid)
-            return None
-        except Exception as e:
-            print(f"[{time.strftime('%H:%M:%S')}] Unexpected error reading response from PID {pid}: {e}")
-            return None
-
-    # *** END: NEW BIDIRECTIONAL METHOD ***
-
-    def broadcast_command(self, command_string: str):
-        # ... (This method remains largely the same) ...
-        if not self.pipe_handles:
-            print(f"[{time.strftime('%H:%M:%S')}] No processes currently connected to broadcast command.")
-            return
-        print(
-            f"[{time.strftime('%H:%M:%S')}] Broadcasting command '{command_string}' to {len(self.pipe_handles)} process(es)...")
-        pids_to_remove = []
-        for pid, handle in list(self.pipe_handles.items()):
-            if not self._send_command_to_handle(handle, command_string):
-                print(f"[{time.strftime('%H:%M:%S')}] Failed to send command to PID {pid}. Marking for removal.")
-                pids_to_remove.append(pid)
-        for pid in pids_to_remove:
-            self.close_single_pipe(pid)  # Use helper to close and remove
-        print(f"[{time.strftime('%H:%M:%S')}] Broadcast complete. {len(self.pipe_handles)} processes remain connected.")
-
-    def send_text(self, text: str):
-        if not isinstance(text, str):
-            print(f"[{time.strftime('%H:%M:%S')}] Error: Input to send_text must be a string.")
-            return
-        command = f"{COMMAND_TYPE_PREFIX}{text}"
-        self.broadcast_command(command)
-
-    def broadcast_single_message(self, message_to_send):
-        message = get_broadcast_message(message_to_send)
-        if not self.get_connected_pids():
-            print(f"[{time.strftime('%H:%M:%S')}] 没有连接的进程，无法广播")
-            return False
-        print(f"[{time.strftime('%H:%M:%S')}] 准备广播消息: '{message}'")
-        self.send_text(message)
-        print(f"[{time.strftime('%H:%M:%S')}] 消息广播完成")
-        return True
-
-    def close_single_pipe(self, pid: int):
-        """Helper to close and remove a single pipe handle."""
-        if pid in self.pipe_handles:
-            handle = self.pipe_handles[pid]
-            try:
-                win32file.CloseHandle(handle)
-            except Exception:
-                pass  # Ignore errors on close
-            finally:
-                del self.pipe_handles[pid]
-                print(f"[{time.strftime('%H:%M:%S')}] Removed disconnected PID {pid}.")
-
-    def close(self):
-        if not self.pipe_handles:
-            return
-        print(f"[{time.strftime('%H:%M:%S')}] Closing all {len(self.pipe_handles)} pipe connections...")
-        for pid in list(self.pipe_handles.keys()):
-            self.close_single_pipe(pid)
-        print(f"[{time.strftime('%H:%M:%S')}] All pipe handles closed.")
-
-    def get_connected_pids(self) -> list[int]:
-        return list(self.pipe_handles.keys())
-
-
-# --- MODIFIED Main Execution Block ---
-def executeMCP(message):
-    BROADCAST_MESSAGE = f"{message}"
-    controller = None
-    try:
-        print("\n--- 初始化进程输入控制器 ---")
-        controller = ProcessInputController(dll_name=INJECTED_DLL_NAME, connect_timeout_ms=5000)
-
-        connected_pids = controller.get_connected_pids()
-        if not connected_pids:
-            print("\n--- 没有进程连接 ---")
-            print(f"无法连接到任何加载了 '{INJECTED_DLL_NAME}' DLL 的进程。")
-            sys.exit(1)
-
-        print(f"\n--- 成功连接到 {len(connected_pids)} 个进程, PID: {connected_pids} ---")
-
-        # --- 1. 演示单向广播 (原有功能) ---
-        print("\n--- 演示: 1. 单向广播消息 ---")
-        print(f"将要广播的消息: '{BROADCAST_MESSAGE}'")
-        controller.broadcast_single_message(BROADCAST_MESSAGE)
-        time.sleep(1)  # 等待一下，让窗口有时间处理输入
-
-        # --- 2. 演示双向通信 (新功能) ---
-        print("\n--- 演示: 2. 双向查询进程信息 ---")
-        for pid in connected_pids:
-            # 调用新的查询方法
-            info = controller.query_process_info(pid)
-            if info:
-                print(f"\n[PID: {pid}] 收到响应:")
-                print(f"  - 进程ID (来自DLL): {info.get('PID', 'N/A')}")
-                print(f"  - 窗口句柄 (HWND): {info.get('HWND', 'N/A')}")
-                print(f"  - 窗口标题: {info.get('Title', 'N/A')}")
-            else:
-                print(f"\n[PID: {pid}] 未能获取响应信息。")
+                results[node] = outcome
+        return results, errors
+
+    async def targets(self, max_age_s: float | None = None, nodes: list[str] | None = None,
+                      **selector) -> tuple[list[dict], dict[str, str]]:
+        """Returns the merged target list ({"node", "pid", ...info}) of every node, plus per-node errors."""
+        results, errors = await self.call_all(AGENT_METHOD_TARGETS, nodes, max_age_s=max_age_s, **selector)
+        merged = [dict(info, node=node, pid=int(pid))
+                  for node, infos in results.items() for pid, info in infos.items()]
+        return merged, errors
+
+    def nodes(self) -> dict[str, dict]:
+        """Connection state and last hello information of every configured agent."""
+        return {address: {"connected": client.connected, "node": client.info.get("node"),
+                          "targets": client.info.get("targets"), "last_error": client.last_error}
+                for address, client in self.clients.items()}
 
-    except KeyboardInterrupt:
-        print("\n检测到键盘中断，正在退出...")
-    except Exception as e:
-        print(f"\n--- 初始化或主循环期间发生致命错误 ---")
-        print(f"错误类型: {type(e).__name__}")
-        print(f"错误详情: {e}")
-    finally:
-        print("\n--- 清理连接 ---")
-        if controller:
-            controller.close()
-        print("脚本结束。")
+    async def close(self):
+        await asyncio.gather(*(client.close() for client in self.clients.values()))
 
 
 # Create an MCP server
 mcp = FastMCP("Demo")
 
+# 连接池与服务器同生命周期: 工具调用复用已打开的管道句柄
+connection_pool = PipeConnectionPool()
+atexit.register(connection_pool.close)
+
+# 配置了远程代理时, cluster_* 工具把命令分发到所有节点
+agent_aggregator = AgentAggregator.from_env()
+
+
+async def _select_targets(controller: AsyncProcessInputController, pid: int | None, exe: str | None,
+                          title: str | None) -> list[int] | None:
+    """Resolves the selector arguments of a tool; None means every connected target."""
+    if pid is None and exe is None and title is None:
+        return None
+    return await controller.select_targets([pid] if pid is not None else None, exe, title)
+
 
 # Add an addition tool
 @mcp.tool()
-def add_content(message: str) -> str:
-    """Input content to the target program 向目标程序输入内容"""
-    executeMCP(message)
+async def add_content(message: str, mode: str = TEXT_MODE_BULK, pid: int | None = None,
+                      exe: str | None = None, title: str | None = None) -> str:
+    """
+    Input content to the target program 向目标程序输入内容
+
+    mode selects how the DLL types: "bulk" (fast, default), "paste" (WM_PASTE
+    into the focused control; the clipboard is restored afterwards) or
+    "legacy" (one character every 25 ms).
+    pid, exe (executable name, e.g. "texworks") and title (regular expression
+    on the window title) restrict the targets; without them every connected
+    target receives the text.
+    """
+    if mode not in TEXT_MODES:
+        return f"未知的输入模式: {mode}"
+    controller = await connection_pool.acquire_async()
+    try:
+        pids = await _select_targets(controller, pid, exe, title)
+    except re.error as e:
+        return f"无效的标题正则表达式: {e}"
+    if not (controller.get_connected_pids() if pids is None else pids):
+        if pids is not None:
+            return "没有符合条件的目标进程"
+        return f"没有连接到任何加载了 '{INJECTED_DLL_NAME}' 的进程"
+    # 经由每个 PID 的命令队列输入, 菜单和查询命令不会排在大段文本之后
+    results = await controller.type_queued(message, mode, pids)
+    failed = [str(target) for target, result in results.items() if not (isinstance(result, dict) and result["ok"])]
+    if failed:
+        return f"以下进程输入失败: {', '.join(failed)}"
     return "已完成"
 
 
+@mcp.tool()
+async def send_menu(command_id: int, pid: int | None = None, exe: str | None = None,
+                    title: str | None = None) -> dict:
+    """
+    Trigger a menu item (WM_COMMAND id) in the targets 触发目标程序的菜单命令
+
+    Menu commands are queued ahead of any pending text. pid, exe and title
+    restrict the targets as in add_content.
+    """
+    controller = await connection_pool.acquire_async()
+    try:
+        pids = await _select_targets(controller, pid, exe, title)
+    except re.error as e:
+        return {"error": f"invalid title pattern: {e}"}
+    results = await controller.menu_queued(command_id, pids)
+    return {str(target): result if isinstance(result, bool) else str(result) for target, result in results.items()}
+
+
+@mcp.tool()
+async def query_targets(max_age_s: float | None = None, pid: int | None = None,
+                        exe: str | None = None, title: str | None = None) -> dict:
+    """
+    Query PID, window handle and title of every connected target 查询所有目标进程的窗口信息
+
+    Results younger than max_age_s seconds (default: the cache TTL) come from
+    the cache; pass 0 to query every process again. pid, exe and title
+    restrict the targets as in add_content.
+    """
+    controller = await connection_pool.acquire_async()
+    try:
+        pids = await _select_targets(controller, pid, exe, title)
+    except re.error as e:
+        return {"error": f"invalid title pattern: {e}"}
+    infos = await controller.query_all(max_age_s, pids)
+    return {str(pid): info for pid, info in infos.items()}
+
+
+@mcp.tool()
+async def run_batch(operations: list[dict], pid: int | None = None, exe: str | None = None,
+                    title: str | None = None) -> dict:
+    """
+    Run several operations on every target in one round trip 一次往返执行多个操作
+
+    Each operation is {"op": "type", "text": "..."}, {"op": "menu", "id": <menu id>}
+    or {"op": "query"}; they run in order and all results come back together.
+    pid, exe and title restrict the targets as in add_content.
+    """
+    controller = await connection_pool.acquire_async()
+    try:
+        pids = await _select_targets(controller, pid, exe, title)
+        results = await controller.execute_batch(operations, pids)
+    except (ValueError, re.error) as e:
+        return {"error": str(e)}
+    return {str(pid): result for pid, result in results.items()}
+
+
+def _node_selector(pids: list[int] | None, exe: str | None, title: str | None) -> dict:
+    """Selector arguments forwarded to the agents; unset ones are omitted."""
+    return {key: value for key, value in (("pids", pids), ("exe", exe), ("title", title)) if value is not None}
+
+
+def _cluster_response(results: dict[str, object], errors: dict[str, str]) -> dict:
+    response = {"results": results}
+    if errors:
+        response["errors"] = errors
+    return response
+
+
+@mcp.tool()
+async def cluster_targets(max_age_s: float | None = None, nodes: list[str] | None = None,
+                          exe: str | None = None, title: str | None = None) -> dict:
+    """
+    List the targets of every remote agent 查询所有节点上的目标进程
+
+    Each entry carries its node ("host:port" of the agent) and pid; use both
+    to address a target in the other cluster_* tools. nodes restricts the
+    agents queried; exe and title filter targets as in add_content.
+    """
+    if not agent_aggregator:
+        return {"error": f"no agents configured (set {AGENTS_ENV})"}
+    targets, errors = await agent_aggregator.targets(max_age_s, nodes, **_node_selector(None, exe, title))
+    response = {"targets": targets}
+    if errors:
+        response["errors"] = errors
+    return response
+
+
+@mcp.tool()
+async def cluster_add_content(message: str, mode: str = TEXT_MODE_BULK, nodes: list[str] | None = None,
+                              pids: list[int] | None = None, exe: str | None = None,
+                              title: str | None = None) -> dict:
+    """
+    Input content to the targets of every remote agent 向所有节点的目标程序输入内容
+
+    mode works as in add_content. nodes restricts the agents; pids, exe and
+    title restrict the targets on each of them (pids only make sense together
+    with a single node).
+    """
+    if not agent_aggregator:
+        return {"error": f"no agents configured (set {AGENTS_ENV})"}
+    if mode not in TEXT_MODES:
+        return {"error": f"unknown text mode: {mode}"}
+    return _cluster_response(*await agent_aggregator.call_all(AGENT_METHOD_TYPE, nodes, text=message, mode=mode,
+                                                              **_node_selector(pids, exe, title)))
+
+
+@mcp.tool()
+async def cluster_send_menu(command_id: int, nodes: list[str] | None = None, pids: list[int] | None = None,
+                            exe: str | None = None, title: str | None = None) -> dict:
+    """
+    Trigger a menu item in the targets of every remote agent 触发所有节点上目标程序的菜单命令
+
+    nodes, pids, exe and title restrict the targets as in cluster_add_content.
+    """
+    if not agent_aggregator:
+        return {"error": f"no agents configured (set {AGENTS_ENV})"}
+    return _cluster_response(*await agent_aggregator.call_all(AGENT_METHOD_MENU, nodes, command_id=command_id,
+                                                              **_node_selector(pids, exe, title)))
+
+
+@mcp.tool()
+async def cluster_run_batch(operations: list[dict], nodes: list[str] | None = None, pids: list[int] | None = None,
+                            exe: str | None = None, title: str | None = None) -> dict:
+    """
+    Run several operations on the targets of every remote agent 在所有节点上批量执行操作
+
+    operations use the format of run_batch; nodes, pids, exe and title
+    restrict the targets as in cluster_add_content.
+    """
+    if not agent_aggregator:
+        return {"error": f"no agents configured (set {AGENTS_ENV})"}
+    return _cluster_response(*await agent_aggregator.call_all(AGENT_METHOD_BATCH, nodes, operations=operations,
+                                                              **_node_selector(pids, exe, title)))
+
+
+@mcp.resource("targets://info")
+async def get_targets_info() -> str:
+    """Cached PID, window handle and title of every connected target; only stale entries are re-queried"""
+    controller = await connection_pool.acquire_async()
+    await controller.query_all()
+    return json.dumps({str(pid): info for pid, info in controller.cached_process_infos().items()},
+                      ensure_ascii=False)
+
+
+@mcp.resource("snapshot://{pid}")
+async def get_window_snapshot(pid: int) -> str:
+    """
+    Window tree (class, control id, text, style, position of every window) and menu table of one target
+
+    Menu entries carry the command id to pass to send_menu. The result has a
+    version; read snapshot://{pid}/since/{version} later to get only what
+    changed. Only the changed nodes are fetched from the target.
+    """
+    controller = await connection_pool.acquire_async()
+    snapshot = await controller.query_snapshot(pid)
+    if snapshot is None:
+        return json.dumps({"error": f"no window snapshot for PID {pid}"})
+    return json.dumps(snapshot, ensure_ascii=False)
+
+
+@mcp.resource("snapshot://{pid}/since/{version}")
+async def get_window_snapshot_changes(pid: int, version: int) -> str:
+    """Windows and menu items of one target changed or removed after version (the whole snapshot if too old)"""
+    controller = await connection_pool.acquire_async()
+    snapshot = await controller.query_snapshot(pid, version)
+    if snapshot is None:
+        return json.dumps({"error": f"no window snapshot for PID {pid}"})
+    return json.dumps(snapshot, ensure_ascii=False)
+
+
+@mcp.resource("targets://queues")
+async def get_queue_stats() -> str:
+    """Per-target command queue depth, counters and queue wait times"""
+    controller = await connection_pool.acquire_async()
+    return json.dumps({str(pid): stats for pid, stats in controller.queue_stats().items()})
+
+
+@mcp.resource("metrics://summary")
+async def get_metrics_summary() -> str:
+    """Stage latencies (p50/p90/p99), per-PID and per-command histograms and failure counters"""
+    controller = await connection_pool.acquire_async()
+    return json.dumps(controller.metrics_snapshot())
+
+
+@mcp.resource("metrics://prometheus")
+async def get_metrics_prometheus() -> str:
+    """The same metrics in the Prometheus text exposition format"""
+    controller = await connection_pool.acquire_async()
+    return controller.metrics_prometheus()
+
+
+@mcp.resource("cluster://nodes")
+async def get_cluster_nodes() -> str:
+    """Connection state, node name and target count of every configured remote agent"""
+    return json.dumps(agent_aggregator.nodes())
+
 
 # Add a dynamic greeting resource
 @mcp.resource("greeting://{name}")
-def get_greeting(name: str) -> str:
+async def get_greeting(name: str) -> str:
     """Get a personalized greeting"""
     return f"Hello, {name}!"
 
 if __name__ == "__main__":
+    configure_logging()
+    # 发现和连接在后台进行, SSE 服务器无需等待即可开始接受连接
+    connection_pool.warm_up()
     mcp.run(transport='sse')
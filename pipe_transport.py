@@ -0,0 +1,128 @@
+import itertools
+import mmap
+import os
+import time
+
+import pywintypes
+import win32event
+import win32file
+import win32pipe
+
+from log_config import get_logger
+from shared_ring import SharedRing, ring_size, RING_FIELD_NAME, RING_FIELD_EVENT
+from transport import (Transport, TransportBrokenError, TransportError, CONNECT_CONNECTED, CONNECT_TIMED_OUT,
+                       CONNECT_BUSY, CONNECT_ERROR, CONNECT_RETRY_INTERVAL_S, LEGACY_READ_SIZE)
+
+logger = get_logger("pipe_transport")
+
+ERROR_FILE_NOT_FOUND = 2
+ERROR_BROKEN_PIPE = 109
+ERROR_NO_DATA = 232  # 管道正在关闭
+# PeekNamedPipe 轮询间隔
+READ_POLL_INTERVAL_S = 0.001
+# 共享内存和唤醒事件位于当前会话的 Local\ 命名空间, 与目标进程相同
+RING_MAPPING_PREFIX = "Local\\MCPInjectorRing_"
+RING_EVENT_PREFIX = "Local\\MCPInjectorRingEvent_"
+
+_ring_ids = itertools.count(1)
+
+
+class NamedPipeTransport(Transport):
+    """Transport over the Windows named pipes created by MCP_Tool.dll."""
+
+    name = "pipe"
+
+    def connect(self, address: str, deadline: float) -> tuple[str, object | None]:
+        while True:
+            try:
+                handle = win32file.CreateFile(
+                    address,
+                    win32file.GENERIC_READ | win32file.GENERIC_WRITE,  # Read/Write access is crucial
+                    0, None, win32file.OPEN_EXISTING, 0, None
+                )
+                logger.debug("Successfully connected to pipe: %s", address)
+                return CONNECT_CONNECTED, handle
+            except pywintypes.error as e:
+                error_code, _, _ = e.args
+                remaining_ms = int((deadline - time.monotonic()) * 1000)
+                if error_code == win32pipe.ERROR_PIPE_BUSY:
+                    if remaining_ms <= 0:
+                        return CONNECT_BUSY, None
+                    try:
+                        win32pipe.WaitNamedPipe(address, remaining_ms)
+                    except pywintypes.error:
+                        return CONNECT_BUSY, None
+                    continue
+                elif error_code == ERROR_FILE_NOT_FOUND:
+                    if remaining_ms > 0:
+                        time.sleep(min(CONNECT_RETRY_INTERVAL_S, remaining_ms / 1000))
+                        continue
+                    else:
+                        return CONNECT_TIMED_OUT, None
+                else:
+                    logger.warning("Error connecting to pipe %s: %s", address, e)
+                    return CONNECT_ERROR, None
+            except Exception as e:
+                logger.error("An unexpected error occurred during pipe connection to %s: %s", address, e)
+                return CONNECT_ERROR, None
+
+    @staticmethod
+    def _raise(e: pywintypes.error):
+        if e.args[0] in (ERROR_BROKEN_PIPE, ERROR_NO_DATA):
+            raise TransportBrokenError(str(e)) from e
+        raise TransportError(str(e)) from e
+
+    def write(self, connection: object, data: bytes):
+        if not connection or connection == win32file.INVALID_HANDLE_VALUE:
+            raise TransportBrokenError("Invalid handle")
+        try:
+            win32file.WriteFile(connection, data)
+        except pywintypes.error as e:
+            self._raise(e)
+
+    def read(self, connection: object, deadline: float | None) -> bytes:
+        try:
+            if deadline is None:
+                # ReadFile blocks until the DLL answers
+                _, data = win32file.ReadFile(connection, LEGACY_READ_SIZE)
+                return data
+            while True:
+                _, available, _ = win32pipe.PeekNamedPipe(connection, 0)
+                if available:
+                    _, data = win32file.ReadFile(connection, available)
+                    return data
+                if time.monotonic() >= deadline:
+                    return b""
+                time.sleep(READ_POLL_INTERVAL_S)
+        except pywintypes.error as e:
+            self._raise(e)
+
+    def probe(self, connection: object):
+        try:
+            win32pipe.PeekNamedPipe(connection, 0)
+        except pywintypes.error as e:
+            raise TransportBrokenError(str(e)) from e
+
+    def close(self, connection: object):
+        try:
+            win32file.CloseHandle(connection)
+        except Exception:
+            pass  # Ignore errors on close
+
+    def open_ring(self, address: str, slot_count: int, slot_size: int) -> SharedRing | None:
+        """Creates a named file mapping and an auto-reset event the DLL opens by name."""
+        suffix = f"{address.rsplit(chr(92), 1)[-1]}_{os.getpid()}_{next(_ring_ids)}"
+        mapping_name, event_name = f"{RING_MAPPING_PREFIX}{suffix}", f"{RING_EVENT_PREFIX}{suffix}"
+        buffer = mmap.mmap(-1, ring_size(slot_count, slot_size), tagname=mapping_name)
+        try:
+            event = win32event.CreateEvent(None, False, False, event_name)
+        except pywintypes.error as e:
+            buffer.close()
+            raise TransportError(str(e)) from e
+
+        def release():
+            buffer.close()
+            event.Close()
+
+        return SharedRing(buffer, slot_count, slot_size, {RING_FIELD_NAME: mapping_name, RING_FIELD_EVENT: event_name},
+                          lambda: win32event.SetEvent(event), release)
@@ -0,0 +1,230 @@
+import os
+import threading
+import time
+
+from log_config import get_logger
+
+logger = get_logger("discovery")
+
+INJECTED_DLL_NAME = "MCP_Tool.dll"
+PIPE_NAME_BASE = r'\\.\pipe\GenericInputPipe_'
+
+# --- Discovery Modes ---
+DISCOVERY_PIPES = "pipes"
+DISCOVERY_MEMORY_MAPS = "memory_maps"
+DISCOVERY_AUTO = "auto"
+
+# 未注入进程的检查结果在此时间后过期, 以便发现之后才被注入的进程
+NEGATIVE_RESULT_TTL_S = 60.0
+
+
+class DiscoveryStrategy:
+    """Interface for finding the PIDs of processes that run the injected pipe server."""
+
+    name = "base"
+
+    def discover(self) -> list[int]:
+        raise NotImplementedError
+
+    def forget(self, pid: int):
+        """Hint that a PID is no longer reachable; strategies without state ignore it."""
+        pass
+
+
+class PipeNamespaceDiscovery(DiscoveryStrategy):
+    """
+    Finds targets by listing the pipe namespace instead of scanning modules.
+
+    The injected DLL creates a pipe named <prefix><pid>, so the PIDs can be
+    parsed from a directory listing. On Windows the directory is the pipe
+    namespace (\\\\.\\pipe\\); any other directory (e.g. one holding Unix
+    sockets named the same way) works as a stand-in for testing and
+    benchmarking.
+    """
+
+    name = DISCOVERY_PIPES
+
+    def __init__(self, directory: str, prefix: str):
+        self.directory = directory
+        self.prefix = prefix
+
+    @classmethod
+    def from_pipe_name_base(cls, pipe_name_base: str = PIPE_NAME_BASE) -> "PipeNamespaceDiscovery":
+        sep = "\\" if "\\" in pipe_name_base else "/"
+        directory, prefix = pipe_name_base.rsplit(sep, 1)
+        return cls(directory + sep, prefix)
+
+    def discover(self) -> list[int]:
+        """Raises OSError if the namespace cannot be listed."""
+        pids = []
+        for entry in os.listdir(self.directory):
+            if entry.startswith(self.prefix):
+                suffix = entry[len(self.prefix):]
+                if suffix.isdigit():
+                    pids.append(int(suffix))
+        return pids
+
+
+class FallbackDiscovery(DiscoveryStrategy):
+    """Uses the primary strategy and falls back to the secondary one if it raises OSError."""
+
+    name = DISCOVERY_AUTO
+
+    def __init__(self, primary: DiscoveryStrategy, fallback: DiscoveryStrategy):
+        self.primary = primary
+        self.fallback = fallback
+
+    def discover(self) -> list[int]:
+        try:
+            return self.primary.discover()
+        except OSError as e:
+            logger.warning("%s discovery failed (%s), falling back to %s.", self.primary.name, e, self.fallback.name)
+            return self.fallback.discover()
+
+    def forget(self, pid: int):
+        self.primary.forget(pid)
+        self.fallback.forget(pid)
+
+
+class InjectedProcessRegistry(DiscoveryStrategy):
+    """
+    Incremental registry of processes that have the injected DLL loaded.
+
+    Every process is identified by (pid, create_time), so a reused PID is
+    treated as a new process. A refresh only walks memory_maps() of processes
+    that appeared since the previous refresh (or whose negative result has
+    expired) and drops PIDs that have exited, so the cost of discovery follows
+    process churn instead of the total number of processes.
+    """
+
+    name = DISCOVERY_MEMORY_MAPS
+
+    def __init__(self, dll_name: str = INJECTED_DLL_NAME, refresh_interval_s: float = 0.0,
+                 negative_ttl_s: float = NEGATIVE_RESULT_TTL_S):
+        """
+        Args:
+            dll_name: File name of the injected DLL to look for.
+            refresh_interval_s: Minimum time between two refreshes; calls to
+                refresh() inside this window return the cached result.
+            negative_ttl_s: How long a "not injected" result is trusted before
+                the process is inspected again.
+        """
+        self.dll_name = dll_name
+        self.refresh_interval_s = refresh_interval_s
+        self.negative_ttl_s = negative_ttl_s
+        # pid -> (create_time, injected, checked_at)
+        self._entries = {}
+        self._last_refresh = None
+        self._lock = threading.Lock()
+        self._watch_thread = None
+        self._watch_stop = threading.Event()
+
+    def _has_dll(self, proc) -> bool:
+        dll_name_lower = self.dll_name.lower()
+        for mapping in proc.memory_maps():
+            if mapping.path and os.path.basename(mapping.path).lower() == dll_name_lower:
+                return True
+        return False
+
+    def refresh(self, force: bool = False) -> list[int]:
+        """
+        Updates the registry and returns the PIDs of injected processes.
+
+        Args:
+            force: Ignore refresh_interval_s and refresh immediately.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if (not force and self._last_refresh is not None
+                    and now - self._last_refresh < self.refresh_interval_s):
+                return self._injected_pids()
+
+            import psutil  # 只有进程模块扫描需要, 首次刷新时才导入
+            entries = {}
+            inspected = 0
+            for proc in psutil.process_iter(['pid', 'name', 'create_time']):
+                pid = proc.info['pid']
+                create_time = proc.info['create_time']
+                known = self._entries.get(pid)
+                if known and known[0] == create_time and (known[1] or now - known[2] < self.negative_ttl_s):
+                    entries[pid] = known
+                    continue
+                inspected += 1
+                try:
+                    injected = self._has_dll(proc)
+                except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                    continue
+                except psutil.AccessDenied:
+                    injected = False
+                except Exception as e:
+                    logger.warning("Error accessing process %s: %s", pid, e)
+                    injected = False
+                if injected:
+                    logger.info("Found injected process: PID=%s, Name='%s'", pid, proc.info['name'])
+                entries[pid] = (create_time, injected, now)
+
+            self._entries = entries
+            self._last_refresh = now
+            injected_pids = self._injected_pids()
+            logger.debug("Discovery refresh: inspected %s of %s process(es), %s injected.",
+                         inspected, len(entries), len(injected_pids))
+            return injected_pids
+
+    def discover(self) -> list[int]:
+        return self.refresh()
+
+    def _injected_pids(self) -> list[int]:
+        return [pid for pid, (_, injected, _) in self._entries.items() if injected]
+
+    def get_injected_pids(self) -> list[int]:
+        """Returns the injected PIDs from the last refresh without rescanning."""
+        with self._lock:
+            return self._injected_pids()
+
+    def forget(self, pid: int):
+        """Drops a PID so that it is inspected again on the next refresh."""
+        with self._lock:
+            self._entries.pop(pid, None)
+
+    def start_watch(self, interval_s: float = 5.0):
+        """Refreshes the registry on a background thread every interval_s seconds."""
+        if self._watch_thread and self._watch_thread.is_alive():
+            return
+        self._watch_stop.clear()
+        self._watch_thread = threading.Thread(target=self._watch_loop, args=(interval_s,),
+                                              name="InjectedProcessWatch", daemon=True)
+        self._watch_thread.start()
+
+    def stop_watch(self):
+        self._watch_stop.set()
+        if self._watch_thread:
+            self._watch_thread.join()
+            self._watch_thread = None
+
+    def _watch_loop(self, interval_s: float):
+        while not self._watch_stop.wait(interval_s):
+            try:
+                self.refresh(force=True)
+            except Exception as e:
+                logger.warning("Discovery watch error: %s", e)
+
+
+def create_discovery(mode: str = DISCOVERY_AUTO, dll_name: str = INJECTED_DLL_NAME,
+                     pipe_name_base: str = PIPE_NAME_BASE) -> DiscoveryStrategy:
+    """
+    Builds a discovery strategy by name.
+
+    Args:
+        mode: "pipes" lists the pipe namespace, "memory_maps" scans process
+            modules, "auto" lists pipes and falls back to the module scan.
+        dll_name: DLL file name used by the memory_maps scan.
+        pipe_name_base: Pipe name prefix used by the pipe namespace listing.
+    """
+    if mode == DISCOVERY_PIPES:
+        return PipeNamespaceDiscovery.from_pipe_name_base(pipe_name_base)
+    if mode == DISCOVERY_MEMORY_MAPS:
+        return InjectedProcessRegistry(dll_name)
+    if mode == DISCOVERY_AUTO:
+        return FallbackDiscovery(PipeNamespaceDiscovery.from_pipe_name_base(pipe_name_base),
+                                 InjectedProcessRegistry(dll_name))
+    raise ValueError(f"Unknown discovery mode: {mode}")
@@ -0,0 +1,63 @@
+import threading
+import time
+
+# QUERY_INFO 结果的默认有效期; 窗口标题变化不频繁, 几秒的过期时间足以避免重复的管道往返
+DEFAULT_INFO_TTL_S = 5.0
+
+
+class ProcessInfoCache:
+    """
+    Per-PID cache of QUERY_INFO results (PID, HWND, Title).
+
+    Entries expire after ttl_s seconds and are dropped explicitly when a
+    handle breaks or a command that may change the window (typing, menu
+    commands) is sent to the PID. A ttl_s of 0 disables caching.
+    """
+
+    def __init__(self, ttl_s: float = DEFAULT_INFO_TTL_S):
+        self.ttl_s = ttl_s
+        # pid -> (info, fetched_at)
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, pid: int, max_age_s: float | None = None) -> dict | None:
+        """
+        Returns a copy of the cached info for a PID, or None if it is missing or stale.
+
+        Args:
+            pid: The process ID.
+            max_age_s: Overrides ttl_s for this lookup.
+        """
+        max_age_s = self.ttl_s if max_age_s is None else max_age_s
+        with self._lock:
+            entry = self._entries.get(pid)
+            if entry is None or time.monotonic() - entry[1] >= max_age_s:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return dict(entry[0])
+
+    def put(self, pid: int, info: dict):
+        if self.ttl_s <= 0:
+            return
+        with self._lock:
+            self._entries[pid] = (dict(info), time.monotonic())
+
+    def invalidate(self, pid: int | None = None):
+        """Drops the entry of one PID, or every entry if pid is None."""
+        with self._lock:
+            if pid is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(pid, None)
+
+    def snapshot(self) -> dict[int, dict]:
+        """
+        Returns every fresh entry as {pid: {**info, "age_s": seconds since it was fetched}}.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return {pid: {**info, "age_s": round(now - fetched_at, 3)}
+                    for pid, (info, fetched_at) in self._entries.items() if now - fetched_at < self.ttl_s}
@@ -0,0 +1,179 @@
+import struct
+import time
+from typing import Callable
+
+# --- Ring Layout ---
+# 头部: magic(2) | version(1) | reserved(1) | slot_count(4) | slot_size(4)
+# 生产者索引、消费者索引和等待标志各占一个 64 字节缓存行, 两端不会争用同一缓存行
+# 与 MCP_Tool.cpp 中的 RING_* 定义保持一致
+RING_MAGIC = b"MR"
+RING_VERSION = 1
+RING_HEADER = struct.Struct("<2sBxII")
+RING_HEAD_OFFSET = 64      # 生产者已发布的消息总数 (u32, 回绕)
+RING_TAIL_OFFSET = 128     # 消费者已取走的消息总数 (u32, 回绕)
+RING_WAITING_OFFSET = 192  # 消费者准备等待唤醒事件时置 1; 生产者只在此时发出唤醒
+RING_SLOTS_OFFSET = 256
+RING_INDEX_MASK = 0xFFFFFFFF
+# 每个槽位: 消息长度(4) + 消息字节 (一个或多个完整的帧)
+SLOT_LENGTH_SIZE = 4
+# 索引和槽位长度按本机字节序的 u32 访问 (DLL 支持的平台均为小端序), 省去每条消息的 struct 调用
+_HEAD_WORD = RING_HEAD_OFFSET // 4
+_TAIL_WORD = RING_TAIL_OFFSET // 4
+_WAITING_WORD = RING_WAITING_OFFSET // 4
+
+DEFAULT_RING_SLOTS = 256
+# 默认槽位可容纳一个 DEFAULT_STREAM_CHUNK_CHARS 字符的 OP_TYPE_EX 帧
+DEFAULT_RING_SLOT_SIZE = 1024
+# 环满或等待排空时的轮询间隔
+RING_POLL_INTERVAL_S = 0.0005
+
+# OP_RING_ATTACH payload 中的字段名
+RING_FIELD_NAME = "Ring"
+RING_FIELD_EVENT = "Event"
+RING_FIELD_SLOTS = "Slots"
+RING_FIELD_SLOT_SIZE = "SlotSize"
+
+
+def ring_size(slot_count: int, slot_size: int) -> int:
+    """Returns the number of bytes to map for a ring with the given geometry."""
+    return RING_SLOTS_OFFSET + slot_count * slot_size
+
+
+class SharedRing:
+    """
+    Single-producer/single-consumer ring of fixed-size message slots in shared memory.
+
+    The controller publishes whole frames into slots and advances the head
+    index; the DLL consumes them and advances the tail index. A message costs
+    a copy into the mapping instead of a WriteFile, and the wake-up event is
+    only signalled when the consumer has announced that it is about to sleep,
+    so a busy stream of small commands runs without any syscall on either
+    side. Responses still travel back over the pipe.
+
+    The platform-specific parts (the mapping and the wake-up primitive) are
+    created by Transport.open_ring() and passed in.
+    """
+
+    def __init__(self, buffer, slot_count: int, slot_size: int, fields: dict[str, str],
+                 wake: Callable[[], None] | None = None, release: Callable[[], None] | None = None,
+                 initialize: bool = True):
+        """
+        Args:
+            buffer: A writable buffer (mmap) of at least ring_size(slot_count, slot_size) bytes.
+            slot_count: Number of slots; must be a power of two.
+            slot_size: Bytes per slot, including the 4-byte length prefix.
+            fields: Names of the mapping and the wake-up event, sent to the DLL in OP_RING_ATTACH.
+            wake: Signals the consumer's wake-up event (producer side).
+            release: Unmaps the buffer and closes the event.
+            initialize: Write a fresh header (producer side); otherwise validate the existing one.
+        """
+        if slot_count <= 0 or slot_count & (slot_count - 1):
+            raise ValueError(f"Ring slot count must be a power of two, got {slot_count}")
+        if slot_size <= SLOT_LENGTH_SIZE or slot_size % 4:
+            raise ValueError(f"Ring slot size {slot_size} must be a multiple of 4 larger than 4")
+        self._buffer = buffer
+        self._words = memoryview(buffer).cast("I")
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+        self.fields = fields
+        self._wake = wake
+        self._release = release
+        if initialize:
+            RING_HEADER.pack_into(buffer, 0, RING_MAGIC, RING_VERSION, slot_count, slot_size)
+            self._words[_HEAD_WORD] = self._words[_TAIL_WORD] = self._words[_WAITING_WORD] = 0
+        elif RING_HEADER.unpack_from(buffer, 0) != (RING_MAGIC, RING_VERSION, slot_count, slot_size):
+            self._words.release()
+            raise ValueError("Shared ring header does not match the requested layout")
+        # 每一端只写自己的索引, 因此可以在本地缓存
+        self._head = self._words[_HEAD_WORD]
+        self._tail = self._words[_TAIL_WORD]
+        self.max_message_size = slot_size - SLOT_LENGTH_SIZE
+
+    def _slot_offset(self, index: int) -> int:
+        return RING_SLOTS_OFFSET + (index & (self.slot_count - 1)) * self.slot_size
+
+    def pending(self) -> int:
+        """Returns the number of messages published but not yet taken by the consumer."""
+        return (self._words[_HEAD_WORD] - self._words[_TAIL_WORD]) & RING_INDEX_MASK
+
+    def attach_payload(self) -> bytes:
+        """Encodes the OP_RING_ATTACH payload telling the DLL where to find the ring."""
+        fields = dict(self.fields)
+        fields[RING_FIELD_SLOTS] = self.slot_count
+        fields[RING_FIELD_SLOT_SIZE] = self.slot_size
+        return "".join(f"{key}:{value};" for key, value in fields.items()).encode('utf-8')
+
+    # --- Producer ---
+
+    def push(self, data: bytes) -> bool:
+        """
+        Publishes one message without blocking.
+
+        Returns:
+            False if every slot is still occupied.
+
+        Raises:
+            ValueError: If data does not fit into a slot.
+        """
+        if len(data) > self.max_message_size:
+            raise ValueError(f"Message of {len(data)} bytes exceeds the ring slot size")
+        words = self._words
+        if (self._head - words[_TAIL_WORD]) & RING_INDEX_MASK >= self.slot_count:
+            return False
+        offset = self._slot_offset(self._head)
+        words[offset >> 2] = len(data)
+        start = offset + SLOT_LENGTH_SIZE
+        self._buffer[start:start + len(data)] = data
+        self._head = (self._head + 1) & RING_INDEX_MASK
+        words[_HEAD_WORD] = self._head
+        # 写 head 和读等待标志之间没有内存屏障, CPU 可以重排这两步, 与消费者置标志的时刻交错时唤醒会丢失;
+        # 消费者的等待有超时 (DLL 的 RING_WAIT_TIMEOUT_MS), 所以丢失只会让这条消息延迟, 不会卡住
+        if self._wake is not None and words[_WAITING_WORD]:
+            self._wake()
+        return True
+
+    def push_wait(self, data: bytes, deadline: float) -> bool:
+        """Publishes one message, waiting for a free slot until deadline (time.monotonic() based)."""
+        while not self.push(data):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(RING_POLL_INTERVAL_S)
+        return True
+
+    def wait_drained(self, deadline: float) -> bool:
+        """Waits until the consumer has taken every published message; False if the deadline passed first."""
+        while self.pending():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(RING_POLL_INTERVAL_S)
+        return True
+
+    # --- Consumer ---
+
+    def pop(self) -> bytes | None:
+        """Takes the oldest message, or returns None if the ring is empty."""
+        if self._tail == self._words[_HEAD_WORD]:
+            return None
+        offset = self._slot_offset(self._tail)
+        length = min(self._words[offset >> 2], self.max_message_size)
+        start = offset + SLOT_LENGTH_SIZE
+        data = self._buffer[start:start + length]
+        self._tail = (self._tail + 1) & RING_INDEX_MASK
+        self._words[_TAIL_WORD] = self._tail
+        return data
+
+    def set_waiting(self, waiting: bool):
+        """
+        Announces that the consumer is about to sleep; re-check pending() afterwards.
+
+        The producer does not fence between publishing head and reading this
+        flag, so a wake-up can still be lost: the consumer must sleep with a
+        timeout.
+        """
+        self._words[_WAITING_WORD] = 1 if waiting else 0
+
+    def close(self):
+        if self._release is not None:
+            release, self._release = self._release, None
+            self._words.release()
+            release()
@@ -0,0 +1,98 @@
+import re
+import threading
+
+
+def normalize_exe_name(name: str) -> str:
+    """Lower-cases an executable name and drops a trailing ".exe", so "TeXworks.exe" matches "texworks"."""
+    name = name.lower()
+    return name[:-4] if name.endswith(".exe") else name
+
+
+class TargetIndex:
+    """
+    In-memory index of connected targets by executable name and window title.
+
+    Executable names are read from psutil once, when a PID is added; titles
+    are the last QUERY_INFO results reported by the controller. Selecting by
+    PID or executable name costs O(matches). A regular expression cannot be
+    looked up in an index, so a title pattern is searched in the title of
+    every candidate: O(matches) after a PID or exe filter, O(indexed targets)
+    on its own. Either way no pipe round trip is involved.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # pid -> normalized exe name
+        self._exe_by_pid = {}
+        # normalized exe name -> set of pids
+        self._pids_by_exe = {}
+        # pid -> last known window title
+        self._titles = {}
+
+    def add(self, pid: int):
+        import psutil  # 第一个目标连接时才导入
+        try:
+            exe = normalize_exe_name(psutil.Process(pid).name())
+        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+            exe = ""
+        with self._lock:
+            self._remove_locked(pid)
+            self._exe_by_pid[pid] = exe
+            self._pids_by_exe.setdefault(exe, set()).add(pid)
+
+    def remove(self, pid: int):
+        with self._lock:
+            self._remove_locked(pid)
+
+    def _remove_locked(self, pid: int):
+        exe = self._exe_by_pid.pop(pid, None)
+        if exe is not None:
+            pids = self._pids_by_exe.get(exe)
+            if pids is not None:
+                pids.discard(pid)
+                if not pids:
+                    del self._pids_by_exe[exe]
+        self._titles.pop(pid, None)
+
+    def update_title(self, pid: int, title: str):
+        with self._lock:
+            if pid in self._exe_by_pid:
+                self._titles[pid] = title
+
+    def pids_without_title(self, pids: list[int] | None = None) -> list[int]:
+        """Indexed PIDs (of pids, if given) whose title is not known yet."""
+        with self._lock:
+            return [pid for pid in (self._exe_by_pid if pids is None else pids)
+                    if pid in self._exe_by_pid and pid not in self._titles]
+
+    def exe_name(self, pid: int) -> str | None:
+        with self._lock:
+            return self._exe_by_pid.get(pid)
+
+    def select(self, pids: list[int] | None = None, exe: str | None = None,
+               title: str | re.Pattern | None = None) -> list[int]:
+        """
+        Returns the indexed PIDs matching every given criterion.
+
+        Args:
+            pids: Explicit PIDs.
+            exe: Executable name, case-insensitive, with or without ".exe".
+            title: Regular expression searched in the last known window title;
+                tested against every candidate left by pids and exe.
+
+        Raises:
+            re.error: If title is not a valid regular expression.
+        """
+        pattern = re.compile(title) if isinstance(title, str) else title
+        with self._lock:
+            if exe is not None:
+                candidates = self._pids_by_exe.get(normalize_exe_name(exe), set())
+                if pids is not None:
+                    candidates = candidates.intersection(pids)
+            elif pids is not None:
+                candidates = [pid for pid in pids if pid in self._exe_by_pid]
+            else:
+                candidates = self._exe_by_pid.keys()
+            if pattern is not None:
+                return [pid for pid in candidates if pattern.search(self._titles.get(pid, ""))]
+            return list(candidates)
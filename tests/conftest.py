@@ -0,0 +1,61 @@
+"""
+Shared fixtures: simulated targets (fake_dll.py) served over Unix domain
+sockets, and controllers connected to them through UnixSocketTransport.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from controller import ProcessInputController, PipeConnectionPool  # noqa: E402
+from fake_dll import FakeDllFleet  # noqa: E402
+from process_discovery import PipeNamespaceDiscovery  # noqa: E402
+from transport import UnixSocketTransport  # noqa: E402
+
+
+def fleet_options(fleet: FakeDllFleet) -> dict:
+    """Controller keyword arguments that point discovery and the transport at a fleet."""
+    return {"pipe_name_base": fleet.pipe_name_base, "transport": UnixSocketTransport(),
+            "discovery": PipeNamespaceDiscovery(fleet.directory + os.sep, fleet.prefix)}
+
+
+@pytest.fixture
+def fleet():
+    if sys.platform == "win32":
+        pytest.skip("simulated targets listen on Unix domain sockets")
+    with FakeDllFleet() as fleet:
+        yield fleet
+
+
+@pytest.fixture
+def make_controller(fleet):
+    """Builds ProcessInputControllers against the fleet; they are closed after the test."""
+    controllers = []
+
+    def make(**options) -> ProcessInputController:
+        options.setdefault("connect_timeout_ms", 2000)
+        controller = ProcessInputController(**{**fleet_options(fleet), **options})
+        controllers.append(controller)
+        return controller
+
+    yield make
+    for controller in controllers:
+        controller.close()
+
+
+@pytest.fixture
+def make_pool(fleet):
+    """Builds PipeConnectionPools against the fleet; they are closed after the test."""
+    pools = []
+
+    def make(**options) -> PipeConnectionPool:
+        options.setdefault("connect_timeout_ms", 2000)
+        pool = PipeConnectionPool(**{**fleet_options(fleet), **options})
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.close()
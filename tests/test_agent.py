@@ -0,0 +1,89 @@
+"""Agent authentication: tokens on non-loopback hosts and the hello check."""
+import asyncio
+import socket
+
+import pytest
+
+from agent import ControllerAgent, is_loopback_host
+from agent_protocol import AgentClient, AgentError
+from conftest import fleet_options
+from fake_dll import FakeDllFleet
+from main import AgentAggregator
+
+
+@pytest.mark.parametrize("host, expected", [("127.0.0.1", True), ("::1", True), ("localhost", True),
+                                            ("0.0.0.0", False), ("", False), ("192.168.1.5", False),
+                                            ("example.com", False)])
+def test_is_loopback_host(host, expected):
+    assert is_loopback_host(host) == expected
+
+
+def test_non_loopback_host_requires_token(make_pool):
+    pool = make_pool()
+    with pytest.raises(ValueError):
+        ControllerAgent(pool, "0.0.0.0", 0)
+    assert ControllerAgent(pool, "0.0.0.0", 0, token="secret").token == "secret"
+    assert ControllerAgent(pool, "0.0.0.0", 0, insecure=True).token is None
+    assert ControllerAgent(pool, "127.0.0.1", 0).token is None
+
+
+def test_hello_checks_token(fleet, make_pool):
+    fleet.spawn(1)
+    pool = make_pool()
+
+    async def scenario():
+        agent = ControllerAgent(pool, "127.0.0.1", 0, node="test", token="secret")
+        await agent.start()
+        address = f"127.0.0.1:{agent.port}"
+        wrong, missing, right = AgentClient(address, "wrong"), AgentClient(address), AgentClient(address, "secret")
+        try:
+            for client in (wrong, missing):
+                with pytest.raises(AgentError, match="invalid token"):
+                    await client.call("targets")
+            targets = await right.call("targets")
+            assert right.info["node"] == "test"
+            return targets
+        finally:
+            for client in (wrong, missing, right):
+                await client.close()
+            await agent.stop()
+
+    assert len(asyncio.run(scenario())) == 1
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_aggregator_merges_nodes_and_reports_unreachable_ones(fleet, make_pool):
+    with FakeDllFleet() as other:
+        first = fleet.spawn(2, title="first")
+        second = other.spawn(1, title="second")
+        pools = [make_pool(), make_pool(**fleet_options(other))]
+        unreachable = f"127.0.0.1:{free_port()}"
+
+        async def scenario():
+            agents = [ControllerAgent(pool, "127.0.0.1", 0, token="secret") for pool in pools]
+            for agent in agents:
+                await agent.start()
+            addresses = [f"127.0.0.1:{agent.port}" for agent in agents]
+            aggregator = AgentAggregator(addresses + [unreachable], "secret", call_timeout_s=2)
+            try:
+                targets, errors = await aggregator.targets()
+                typed, type_errors = await aggregator.call_all("type", nodes=addresses[1:], text="hi")
+                return addresses, targets, errors, typed, type_errors, aggregator.nodes()
+            finally:
+                await aggregator.close()
+                for agent in agents:
+                    await agent.stop()
+
+        addresses, targets, errors, typed, type_errors, nodes = asyncio.run(scenario())
+        assert sorted((target["node"], target["pid"], target["Title"]) for target in targets) == sorted(
+            [(addresses[0], pid, "first") for pid in first] + [(addresses[1], second[0], "second")])
+        assert list(errors) == [unreachable] and "unreachable" in errors[unreachable]
+        assert list(typed) == [addresses[1]] and not type_errors
+        assert typed[addresses[1]][str(second[0])]["ok"]
+        assert other.targets[second[0]].stats["typed_chars"] == 2
+        assert nodes[addresses[0]]["connected"] and not nodes[unreachable]["connected"]
@@ -0,0 +1,53 @@
+import threading
+import time
+
+from controller import DELIVERY_DELIVERED, DELIVERY_TIMED_OUT
+from wire_protocol import TEXT_MODE_BULK
+
+
+def test_busy_target_times_out_without_delaying_the_others(fleet, make_controller):
+    busy, free = fleet.spawn(2)
+    controller = make_controller()
+    locked, release = threading.Event(), threading.Event()
+
+    def hold_lock():
+        # 模拟另一个调用长时间占用该 PID
+        with controller._pid_lock(busy):
+            locked.set()
+            release.wait(5)
+
+    holder = threading.Thread(target=hold_lock)
+    holder.start()
+    try:
+        locked.wait(1)
+        start = time.monotonic()
+        report = controller.send_text("abc", TEXT_MODE_BULK, write_timeout_ms=200)
+        elapsed = time.monotonic() - start
+    finally:
+        release.set()
+        holder.join()
+    assert report == {busy: DELIVERY_TIMED_OUT, free: DELIVERY_DELIVERED}
+    assert elapsed < 0.5
+    # 超时的目标保持连接, 且截止时间之后不会再收到这条命令
+    assert sorted(controller.get_connected_pids()) == sorted([busy, free])
+    assert controller.query_process_info(busy, max_age_s=0) is not None
+    assert fleet.targets[busy].stats["typed_chars"] == 0
+    assert fleet.targets[free].stats["typed_chars"] == 3
+
+
+def test_deadline_covers_targets_waiting_for_a_worker(fleet, make_controller):
+    pids = fleet.spawn(4)
+    controller = make_controller(max_workers=1)
+    release = threading.Event()
+    controller._get_executor().submit(release.wait, 5)  # 唯一的工作线程被占用
+    try:
+        start = time.monotonic()
+        report = controller.broadcast_command("TYPE:x", write_timeout_ms=200)
+        assert time.monotonic() - start < 0.5
+    finally:
+        release.set()
+    assert report == {pid: DELIVERY_TIMED_OUT for pid in pids}
+    # 排队的写入在截止时间之后才轮到, 不会再发出
+    controller._get_executor().submit(time.sleep, 0).result()
+    assert controller.get_process_infos(pids, max_age_s=0)
+    assert sum(fleet.targets[pid].stats["typed_chars"] for pid in pids) == 0
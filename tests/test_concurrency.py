@@ -0,0 +1,63 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import controller as controller_module
+from controller import AsyncProcessInputController
+from wire_protocol import OP_QUERY_INFO, OP_PING, OP_HELLO
+
+
+def test_concurrent_queries_keep_responses_paired(fleet, make_controller):
+    pids = fleet.spawn(3)
+    controller = make_controller(info_ttl_s=0)
+    calls = [pid for pid in pids for _ in range(40)]
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        infos = list(executor.map(controller.query_process_info, calls))
+    assert [int(info["PID"]) for info in infos] == calls
+
+
+def test_concurrent_pipelines_on_one_pid(fleet, make_controller):
+    pid, = fleet.spawn(1)
+    controller = make_controller()
+    requests = [(OP_PING, b""), (OP_QUERY_INFO, b""), (OP_HELLO, b"\x01")]
+
+    def run(_):
+        return [frame.opcode if frame is not None else None for frame in controller.pipeline(pid, requests)]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(run, range(50)))
+    assert results == [[OP_PING, OP_QUERY_INFO, OP_HELLO]] * 50
+
+
+def test_acquire_async_shares_one_controller(fleet, make_pool):
+    fleet.spawn(2)
+    pool = make_pool(health_check_interval_s=0)
+
+    async def acquire_many():
+        return await asyncio.gather(*(pool.acquire_async() for _ in range(10)))
+
+    controllers = asyncio.run(acquire_many())
+    assert all(isinstance(controller, AsyncProcessInputController) for controller in controllers)
+    assert len({id(controller.controller) for controller in controllers}) == 1
+    assert len(controllers[0].get_connected_pids()) == 2
+
+
+def test_async_queries_run_concurrently(fleet, make_controller):
+    pids = fleet.spawn(5)
+    controller = AsyncProcessInputController(make_controller(info_ttl_s=0))
+    infos = asyncio.run(controller.query_all())
+    assert {pid: int(info["PID"]) for pid, info in infos.items()} == {pid: pid for pid in pids}
+
+
+def test_hung_legacy_query_times_out_and_frees_the_pid(fleet, make_controller, monkeypatch):
+    pid, = fleet.spawn(1, framed=False, query_delay_s=5)
+    controller = make_controller(info_ttl_s=0)
+    monkeypatch.setattr(controller_module, "DEFAULT_RESPONSE_TIMEOUT_MS", 200)
+    start = time.monotonic()
+    assert controller.query_process_info(pid) is None
+    assert time.monotonic() - start < 1
+    # 连接已断开, 之后对该 PID 的调用不会卡在 PID 锁上
+    assert pid not in controller.get_connected_pids()
+    controller.close_single_pipe(pid)
+    assert controller.query_process_info(pid) is None
+    assert time.monotonic() - start < 1
@@ -0,0 +1,53 @@
+import socket
+import time
+
+from controller import CONNECT_BUSY, CONNECT_CONNECTED, CONNECT_ERROR, CONNECT_TIMED_OUT
+from transport import UnixSocketTransport
+
+
+def stale_socket(fleet, pid: int):
+    """Leaves a socket file nobody listens on, like a pipe name left behind by a crashed target."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(f"{fleet.pipe_name_base}{pid}")
+    sock.close()
+
+
+class FlakyTransport(UnixSocketTransport):
+    """Reports every instance busy for some addresses and fails others outright."""
+
+    def __init__(self, busy: set[str], failing: set[str]):
+        self.busy = busy
+        self.failing = failing
+
+    def connect(self, address: str, deadline: float):
+        if address in self.failing:
+            return CONNECT_ERROR, None
+        if address in self.busy:
+            time.sleep(max(0.0, deadline - time.monotonic()))
+            return CONNECT_BUSY, None
+        return super().connect(address, deadline)
+
+
+def test_stale_sockets_time_out_within_one_phase_deadline(fleet, make_controller):
+    live = fleet.spawn(2)
+    stale = [4_900_001, 4_900_002, 4_900_003, 4_900_004]
+    for pid in stale:
+        stale_socket(fleet, pid)
+    start = time.monotonic()
+    # 两个工作线程要处理六个 PID: 逐个计时的话需要 4 × 300 ms
+    controller = make_controller(connect_timeout_ms=300, max_workers=2)
+    elapsed = time.monotonic() - start
+    assert sorted(controller.get_connected_pids()) == live
+    assert controller.last_connect_report == {**{pid: CONNECT_CONNECTED for pid in live},
+                                              **{pid: CONNECT_TIMED_OUT for pid in stale}}
+    assert elapsed < 0.6
+
+
+def test_busy_and_failing_pipes_are_reported(fleet, make_controller):
+    live, busy, failing = fleet.spawn(3)
+    transport = FlakyTransport({f"{fleet.pipe_name_base}{busy}"}, {f"{fleet.pipe_name_base}{failing}"})
+    start = time.monotonic()
+    controller = make_controller(connect_timeout_ms=300, transport=transport)
+    assert time.monotonic() - start < 0.6
+    assert controller.last_connect_report == {live: CONNECT_CONNECTED, busy: CONNECT_BUSY, failing: CONNECT_ERROR}
+    assert controller.get_connected_pids() == [live]
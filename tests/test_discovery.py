@@ -0,0 +1,118 @@
+import os
+from types import SimpleNamespace
+
+import psutil
+import pytest
+
+from process_discovery import InjectedProcessRegistry, PipeNamespaceDiscovery, create_discovery, DISCOVERY_AUTO
+from transport import CONNECT_CONNECTED
+
+
+class FakeProcess:
+    """psutil.Process stand-in that counts memory_maps() calls."""
+
+    def __init__(self, pid: int, create_time: float, modules: list[str]):
+        self.info = {"pid": pid, "name": f"proc{pid}.exe", "create_time": create_time}
+        self.modules = modules
+        self.inspections = 0
+
+    def memory_maps(self):
+        self.inspections += 1
+        return [SimpleNamespace(path=path) for path in self.modules]
+
+
+@pytest.fixture
+def processes(monkeypatch):
+    """The process table seen by InjectedProcessRegistry; tests edit it in place."""
+    table = {}
+    monkeypatch.setattr(psutil, "process_iter", lambda attrs=None: list(table.values()))
+    return table
+
+
+def test_registry_finds_injected_processes(processes):
+    processes[10] = FakeProcess(10, 1.0, ["/opt/target/kernel32.dll", "/opt/target/MCP_Tool.dll"])
+    processes[11] = FakeProcess(11, 1.0, ["/opt/target/kernel32.dll"])
+    registry = InjectedProcessRegistry("mcp_tool.dll")
+    assert registry.refresh() == [10]
+    assert registry.get_injected_pids() == [10]
+
+
+def test_registry_only_inspects_new_processes(processes):
+    processes[10] = FakeProcess(10, 1.0, ["MCP_Tool.dll"])
+    processes[11] = FakeProcess(11, 1.0, [])
+    registry = InjectedProcessRegistry()
+    registry.refresh()
+    processes[12] = FakeProcess(12, 2.0, ["MCP_Tool.dll"])
+    assert sorted(registry.refresh()) == [10, 12]
+    assert [processes[pid].inspections for pid in (10, 11, 12)] == [1, 1, 1]
+
+
+def test_registry_drops_exited_processes_and_rechecks_reused_pids(processes):
+    processes[10] = FakeProcess(10, 1.0, ["MCP_Tool.dll"])
+    processes[11] = FakeProcess(11, 1.0, ["MCP_Tool.dll"])
+    registry = InjectedProcessRegistry()
+    registry.refresh()
+    del processes[11]
+    processes[10] = FakeProcess(10, 5.0, [])  # 同一 PID 被新进程复用
+    assert registry.refresh() == []
+    assert processes[10].inspections == 1
+
+
+def test_registry_negative_results_expire(processes):
+    processes[10] = FakeProcess(10, 1.0, [])
+    registry = InjectedProcessRegistry(negative_ttl_s=0.0)
+    assert registry.refresh() == []
+    processes[10].modules = ["MCP_Tool.dll"]  # 之后才被注入
+    assert registry.refresh() == [10]
+
+
+def test_registry_refresh_interval_and_forget(processes):
+    processes[10] = FakeProcess(10, 1.0, ["MCP_Tool.dll"])
+    registry = InjectedProcessRegistry(refresh_interval_s=60.0)
+    registry.refresh()
+    processes[11] = FakeProcess(11, 1.0, ["MCP_Tool.dll"])
+    assert registry.refresh() == [10]
+    assert sorted(registry.refresh(force=True)) == [10, 11]
+    registry.forget(10)
+    registry.refresh(force=True)
+    assert processes[10].inspections == 2
+
+
+def test_registry_treats_access_denied_as_not_injected(processes):
+    class DeniedProcess(FakeProcess):
+        def memory_maps(self):
+            raise psutil.AccessDenied(self.info["pid"])
+
+    processes[10] = DeniedProcess(10, 1.0, [])
+    processes[11] = FakeProcess(11, 1.0, ["MCP_Tool.dll"])
+    assert InjectedProcessRegistry().refresh() == [11]
+
+
+def test_pipe_namespace_lists_fleet_pids(fleet):
+    pids = fleet.spawn(3)
+    open(os.path.join(fleet.directory, f"{fleet.prefix}notapid"), "w").close()
+    open(os.path.join(fleet.directory, "OtherPipe_123"), "w").close()
+    discovery = PipeNamespaceDiscovery(fleet.directory + os.sep, fleet.prefix)
+    assert sorted(discovery.discover()) == pids
+    fleet.kill(pids[0])
+    assert sorted(discovery.discover()) == pids[1:]
+
+
+def test_pipe_namespace_from_pipe_name_base():
+    discovery = PipeNamespaceDiscovery.from_pipe_name_base(r"\\.\pipe\GenericInputPipe_")
+    assert (discovery.directory, discovery.prefix) == ("\\\\.\\pipe\\", "GenericInputPipe_")
+    discovery = PipeNamespaceDiscovery.from_pipe_name_base("/tmp/sockets/GenericInputPipe_")
+    assert (discovery.directory, discovery.prefix) == ("/tmp/sockets/", "GenericInputPipe_")
+
+
+def test_auto_discovery_falls_back_when_namespace_is_unavailable(processes, tmp_path):
+    processes[10] = FakeProcess(10, 1.0, ["MCP_Tool.dll"])
+    discovery = create_discovery(DISCOVERY_AUTO, pipe_name_base=str(tmp_path / "missing" / "GenericInputPipe_"))
+    assert discovery.discover() == [10]
+
+
+def test_controller_connects_to_discovered_pipes(fleet, make_controller):
+    pids = fleet.spawn(4)
+    controller = make_controller()
+    assert sorted(controller.get_connected_pids()) == pids
+    assert set(controller.last_connect_report.values()) == {CONNECT_CONNECTED}
@@ -0,0 +1,44 @@
+import time
+
+from controller import PROTOCOL_LEGACY
+from wire_protocol import OP_PING, OP_HELLO, TEXT_MODE_BULK
+
+
+def test_inline_opcodes_are_not_queued_behind_typing(fleet, make_controller):
+    pid, = fleet.spawn(1, char_delay_s=0.01)
+    controller = make_controller(info_ttl_s=0)
+    controller.send_text("x" * 100, TEXT_MODE_BULK)  # 约 1 秒, 不等待确认
+    start = time.monotonic()
+    assert controller.heartbeat(timeout_ms=300) == {pid: True}
+    assert controller.query_process_info(pid)["PID"] == str(pid)
+    assert controller.send_request(pid, OP_HELLO, b"\x01", timeout_ms=300) is not None
+    assert time.monotonic() - start < 0.5
+    assert fleet.targets[pid].stats["typed_chars"] < 100
+
+
+def test_queued_commands_answer_in_order_when_done(fleet, make_controller):
+    pid, = fleet.spawn(1, char_delay_s=0.002)
+    controller = make_controller()
+    results = controller.execute_batch([{"op": "type", "text": "a" * 50}, {"op": "menu", "id": 302},
+                                        {"op": "query"}])[pid]
+    assert [result["ok"] for result in results] == [True, True, True]
+    assert controller.send_request(pid, OP_PING) is not None
+    assert fleet.targets[pid].stats["typed_chars"] == 50
+
+
+def test_legacy_queries_are_answered_while_typing(fleet, make_controller):
+    pid, = fleet.spawn(1, framed=False, char_delay_s=0.01)
+    controller = make_controller(info_ttl_s=0)
+    assert controller.pipe_protocols[pid] == PROTOCOL_LEGACY
+    controller.send_text("x" * 100)
+    start = time.monotonic()
+    assert controller.query_process_info(pid)["PID"] == str(pid)
+    assert time.monotonic() - start < 0.5
+
+
+def test_injected_failures(fleet, make_controller):
+    failing, dropping = fleet.spawn(1, error_rate=1.0) + fleet.spawn(1, drop_rate=1.0)
+    controller = make_controller()
+    results = controller.type_text("abc", pids=[failing, dropping], timeout_ms=300)
+    assert not results[failing]["ok"] and not results[dropping]["ok"]
+    assert controller.get_connected_pids() == [failing]
@@ -0,0 +1,83 @@
+import psutil
+import pytest
+
+from health_monitor import HealthMonitor
+
+
+@pytest.fixture
+def live_pids(fleet, monkeypatch):
+    """PIDs psutil reports as running; simulated PIDs only exist while listed here."""
+    pids = set()
+    monkeypatch.setattr(psutil, "pid_exists", lambda pid: pid in pids)
+    return pids
+
+
+def connections(fleet, pid: int) -> int:
+    return fleet.targets[pid].stats["connections"]
+
+
+def test_acquire_returns_the_controller_without_touching_pipes(fleet, make_pool):
+    pids = fleet.spawn(2)
+    pool = make_pool(health_check_interval_s=0, rediscover_interval_s=0)
+    controller = pool.acquire()
+    controller.close_single_pipe(pids[0])
+    late, = fleet.spawn(1)
+    for _ in range(5):
+        assert pool.acquire() is controller
+    assert controller.get_connected_pids() == [pids[1]]
+    assert controller.get_missing_pids() == [pids[0]]
+    assert [connections(fleet, pid) for pid in (*pids, late)] == [1, 1, 0]
+
+
+def test_monitor_reconnects_evicted_pids(fleet, make_controller, live_pids):
+    pids = fleet.spawn(2)
+    live_pids.update(pids)
+    controller = make_controller()
+    monitor = HealthMonitor(controller, interval_s=60)
+    controller.close_single_pipe(pids[0])
+    summary = monitor.check_once()
+    assert summary["reconnected"] == 1 and summary["alive"] == 1
+    assert sorted(controller.get_connected_pids()) == pids
+
+
+def test_monitor_evicts_dead_handles(fleet, make_controller, live_pids):
+    pids = fleet.spawn(2)
+    live_pids.update(pids)
+    controller = make_controller()
+    monitor = HealthMonitor(controller, interval_s=60, reconnect_timeout_ms=50)
+    fleet.kill(pids[0])
+    summary = monitor.check_once()
+    assert summary["evicted"] == 1
+    assert controller.get_connected_pids() == [pids[1]]
+
+
+def test_unreachable_pid_backs_off_and_stays_known(fleet, make_pool, live_pids):
+    pids = fleet.spawn(2)
+    live_pids.update(pids)
+    pool = make_pool(health_check_interval_s=0)
+    controller = pool.acquire()
+    monitor = HealthMonitor(controller, interval_s=60, reconnect_timeout_ms=50, backoff_initial_s=30)
+    fleet.kill(pids[0])  # 进程仍在, 但管道服务端已停止
+    controller.close_single_pipe(pids[0])
+    monitor.check_once()
+    assert monitor._backoff[pids[0]][0] == 1
+    monitor.check_once()
+    assert monitor._backoff[pids[0]][0] == 1  # 退避期内不重试
+    pool.acquire()
+    assert controller.get_missing_pids() == [pids[0]]
+
+
+def test_exited_pids_are_forgotten_and_restarts_discovered(fleet, make_controller, live_pids):
+    pids = fleet.spawn(2)
+    live_pids.update(pids)
+    controller = make_controller()
+    monitor = HealthMonitor(controller, interval_s=60)
+    fleet.kill(pids[0])
+    live_pids.discard(pids[0])
+    controller.close_single_pipe(pids[0])
+    restarted, = fleet.spawn(1)
+    live_pids.add(restarted)
+    summary = monitor.check_once()
+    assert summary["forgotten"] == 1
+    assert controller.get_missing_pids() == []
+    assert sorted(controller.get_connected_pids()) == [pids[1], restarted]
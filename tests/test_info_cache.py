@@ -0,0 +1,76 @@
+import time
+
+from process_info_cache import ProcessInfoCache
+
+
+def queries(fleet, pid: int) -> int:
+    return fleet.targets[pid].stats["queries"]
+
+
+def test_fresh_results_are_served_from_cache(fleet, make_controller):
+    pid, = fleet.spawn(1)
+    controller = make_controller(info_ttl_s=60)
+    first = controller.query_process_info(pid)
+    assert controller.query_process_info(pid) == first
+    assert controller.get_process_infos([pid]) == {pid: first}
+    assert queries(fleet, pid) == 1
+    controller.query_process_info(pid, max_age_s=0)
+    assert queries(fleet, pid) == 2
+
+
+def test_entries_expire_after_ttl(fleet, make_controller):
+    pid, = fleet.spawn(1)
+    controller = make_controller(info_ttl_s=0.05)
+    controller.query_process_info(pid)
+    time.sleep(0.1)
+    controller.query_process_info(pid)
+    assert queries(fleet, pid) == 2
+
+
+def test_commands_invalidate_the_target(fleet, make_controller):
+    pids = fleet.spawn(2)
+    controller = make_controller(info_ttl_s=60)
+    controller.get_process_infos()
+    controller.type_text("abc", pids=[pids[0]])
+    controller.get_process_infos()
+    assert [queries(fleet, pid) for pid in pids] == [2, 1]
+    controller.send_menu_command(302, pids=[pids[1]])
+    controller.get_process_infos()
+    assert [queries(fleet, pid) for pid in pids] == [2, 2]
+
+
+def test_read_only_requests_keep_the_entry(fleet, make_controller):
+    pid, = fleet.spawn(1)
+    controller = make_controller(info_ttl_s=60)
+    controller.query_process_info(pid)
+    controller.heartbeat()
+    controller.query_process_info(pid)
+    assert queries(fleet, pid) == 1
+
+
+def test_evicted_pid_is_not_served_from_cache(fleet, make_controller):
+    pid, = fleet.spawn(1)
+    controller = make_controller(info_ttl_s=60)
+    controller.query_process_info(pid)
+    controller.close_single_pipe(pid)
+    assert controller.info_cache.get(pid) is None
+    assert controller.query_process_info(pid) is None
+
+
+def test_cache_ttl_zero_disables_caching():
+    cache = ProcessInfoCache(ttl_s=0)
+    cache.put(1, {"Title": "a"})
+    assert cache.get(1) is None
+    assert cache.snapshot() == {}
+
+
+def test_cache_returns_copies_and_reports_age():
+    cache = ProcessInfoCache(ttl_s=60)
+    cache.put(1, {"Title": "a"})
+    cache.get(1)["Title"] = "changed"
+    assert cache.get(1) == {"Title": "a"}
+    assert cache.snapshot()[1]["Title"] == "a"
+    assert cache.snapshot()[1]["age_s"] >= 0
+    cache.invalidate()
+    assert cache.get(1) is None
+    assert (cache.hits, cache.misses) == (2, 1)
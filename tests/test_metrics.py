@@ -0,0 +1,23 @@
+from controller import BATCH_OP_QUERY, BATCH_OP_TYPE
+
+
+def test_exec_time_is_recorded_but_not_part_of_process_info(fleet, make_controller):
+    pid, = fleet.spawn(1)
+    controller = make_controller(info_ttl_s=60)
+    info = controller.query_process_info(pid)
+    assert set(info) == {"PID", "HWND", "Title"}
+    assert controller.info_cache.snapshot()[pid].keys() == {"PID", "HWND", "Title", "age_s"}
+    batch = controller.execute_batch([{"op": BATCH_OP_TYPE, "text": "a"}, {"op": BATCH_OP_QUERY}])[pid]
+    assert set(batch[1]["info"]) == {"PID", "HWND", "Title"}
+    exec_times = {entry["labels"]["command"]: entry["count"] for entry in controller.metrics.snapshot()["histograms"]
+                  if entry["name"] == "dll_exec_seconds"}
+    assert exec_times == {"query": 2, "type": 1}
+
+
+def test_failures_and_stage_timings_are_counted(fleet, make_controller):
+    pid, = fleet.spawn(1, error_rate=1.0)
+    controller = make_controller()
+    assert controller.type_text("abc")[pid]["ok"] is False
+    rendered = controller.metrics.render_prometheus()
+    for name in ("connect_seconds", "write_seconds", "read_seconds", "command_failures_total"):
+        assert name in rendered
@@ -0,0 +1,164 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from command_scheduler import (CommandScheduler, QueueFullError, PRIORITY_CONTROL, PRIORITY_INTERACTIVE,
+                               PRIORITY_BULK)
+from controller import typing_timeout_ms, DEFAULT_RESPONSE_TIMEOUT_MS
+from wire_protocol import TEXT_MODE_LEGACY, TEXT_MODE_BULK, TEXT_MODE_PASTE
+
+
+@pytest.fixture
+def make_scheduler():
+    executors, schedulers = [], []
+
+    def make(max_workers: int = 4, **options) -> CommandScheduler:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        scheduler = CommandScheduler(lambda: executor, **options)
+        executors.append(executor)
+        schedulers.append(scheduler)
+        return scheduler
+
+    yield make
+    for scheduler in schedulers:
+        scheduler.shutdown()
+    for executor in executors:
+        executor.shutdown(wait=False)
+
+
+def test_higher_priorities_run_first(make_scheduler):
+    scheduler = make_scheduler(rate_limit_per_s=0)
+    gate, order = threading.Event(), []
+    scheduler.submit(1, PRIORITY_BULK, gate.wait, 5)
+    futures = [scheduler.submit(1, priority, order.append, name) for priority, name in
+               ((PRIORITY_BULK, "text 1"), (PRIORITY_BULK, "text 2"), (PRIORITY_INTERACTIVE, "menu"),
+                (PRIORITY_CONTROL, "query"))]
+    gate.set()
+    for future in futures:
+        future.result(timeout=5)
+    assert order == ["query", "menu", "text 1", "text 2"]
+
+
+def test_rate_limit_spaces_commands(make_scheduler):
+    scheduler = make_scheduler(rate_limit_per_s=50, rate_burst=1)
+    start = time.monotonic()
+    futures = [scheduler.submit(1, PRIORITY_BULK, time.monotonic) for _ in range(6)]
+    times = [future.result(timeout=5) - start for future in futures]
+    assert times[-1] >= 5 / 50 * 0.9
+    stats = scheduler.stats()[1]
+    assert stats["completed"] == 6 and stats["wait_ms"]["bulk"]["max"] > 0
+
+
+def test_ready_pids_are_served_round_robin(make_scheduler):
+    scheduler = make_scheduler(max_workers=1, rate_limit_per_s=0)
+    gate, order = threading.Event(), []
+    blocker = scheduler.submit(0, PRIORITY_BULK, gate.wait, 5)
+    futures = [scheduler.submit(pid, PRIORITY_BULK, order.append, pid) for pid in (1, 1, 1, 2, 2, 2)]
+    gate.set()
+    blocker.result(timeout=5)
+    for future in futures:
+        future.result(timeout=5)
+    assert order == [1, 2, 1, 2, 1, 2]
+
+
+def test_queue_depth_is_bounded(make_scheduler):
+    scheduler = make_scheduler(max_queue_depth=2, rate_limit_per_s=0)
+    gate = threading.Event()
+    scheduler.submit(1, PRIORITY_BULK, gate.wait, 5)
+    time.sleep(0.05)  # 第一个任务已开始运行, 不再占用队列
+    scheduler.submit(1, PRIORITY_BULK, gate.wait, 5)
+    scheduler.submit(1, PRIORITY_BULK, gate.wait, 5)
+    with pytest.raises(QueueFullError):
+        scheduler.submit(1, PRIORITY_BULK, gate.wait, 5)
+    scheduler.submit(2, PRIORITY_BULK, gate.wait, 5)  # 其他 PID 不受影响
+    assert scheduler.stats()[1]["rejected"] == 1
+    gate.set()
+
+
+def test_forget_cancels_pending_jobs(make_scheduler):
+    scheduler = make_scheduler(rate_limit_per_s=0)
+    gate = threading.Event()
+    scheduler.submit(1, PRIORITY_BULK, gate.wait, 5)
+    time.sleep(0.05)
+    pending = scheduler.submit(1, PRIORITY_BULK, gate.wait, 5)
+    scheduler.forget(1)
+    assert pending.cancelled()
+    gate.set()
+
+
+def test_job_after_forget_waits_for_the_running_one(make_scheduler):
+    scheduler = make_scheduler(rate_limit_per_s=0)
+    gate, running, overlaps = threading.Event(), [], []
+
+    def job(name):
+        overlaps.append(len(running))
+        running.append(name)
+        if name == "old":
+            gate.wait(5)
+        running.remove(name)
+
+    old = scheduler.submit(1, PRIORITY_BULK, job, "old")
+    time.sleep(0.05)
+    scheduler.forget(1)
+    new = scheduler.submit(1, PRIORITY_BULK, job, "new")
+    time.sleep(0.05)
+    assert not new.done() and scheduler.stats()[1]["running"]
+    gate.set()
+    old.result(timeout=5)
+    new.result(timeout=5)
+    assert overlaps == [0, 0]
+    assert scheduler.stats()[1]["completed"] == 1
+
+
+def test_forgotten_pid_is_dropped_when_its_job_finishes(make_scheduler):
+    scheduler = make_scheduler(rate_limit_per_s=0)
+    gate = threading.Event()
+    running = scheduler.submit(1, PRIORITY_BULK, gate.wait, 5)
+    time.sleep(0.05)
+    scheduler.forget(1)
+    gate.set()
+    running.result(timeout=5)
+    time.sleep(0.05)
+    assert 1 not in scheduler.stats()
+
+
+def test_scheduler_jobs_do_not_starve_io_workers(fleet, make_controller):
+    pid, = fleet.spawn(1)
+    controller = make_controller(max_workers=1, rate_limit_per_s=0)
+    gate = threading.Event()
+    blocked = controller.scheduler.submit(pid, PRIORITY_BULK, gate.wait, 5)
+    time.sleep(0.05)
+    try:
+        # 调度器任务占用自己的线程池, 心跳仍能使用唯一的 I/O 线程
+        assert controller.heartbeat(timeout_ms=500) == {pid: True}
+    finally:
+        gate.set()
+    assert blocked.result(timeout=5) is True
+
+
+def test_typing_timeout_grows_with_text_and_mode():
+    assert typing_timeout_ms("", TEXT_MODE_LEGACY) == DEFAULT_RESPONSE_TIMEOUT_MS
+    assert typing_timeout_ms("x" * 300, TEXT_MODE_LEGACY) > DEFAULT_RESPONSE_TIMEOUT_MS + 300 * 25
+    assert typing_timeout_ms("x" * 300, TEXT_MODE_BULK) < typing_timeout_ms("x" * 300, TEXT_MODE_LEGACY)
+    assert typing_timeout_ms("x" * 300, TEXT_MODE_PASTE, 100) == 100
+
+
+def test_queued_menu_overtakes_queued_text(fleet, make_controller):
+    pid, = fleet.spawn(1, char_delay_s=0.002)
+    controller = make_controller(rate_limit_per_s=0)
+    texts = controller.schedule_text("x" * 100, pids=[pid])
+    more = controller.schedule_text("y" * 100, pids=[pid])
+    menu = controller.schedule_menu(302, pids=[pid])
+    assert menu[pid].result(timeout=5) is True
+    assert not more[pid].done()
+    assert texts[pid].result(timeout=5)["ok"] and more[pid].result(timeout=5)["ok"]
+
+
+def test_slow_typing_is_not_reported_as_failed(fleet, make_controller):
+    pid, = fleet.spawn(1, char_delay_s=0.02)
+    controller = make_controller(rate_limit_per_s=0)
+    result = controller.schedule_text("x" * 40, TEXT_MODE_LEGACY, pids=[pid], timeout_ms=200)[pid].result(timeout=10)
+    assert result["ok"] and result["chars"] == 40
+    assert controller.type_text("x" * 40, TEXT_MODE_LEGACY, timeout_ms=200)[pid]["ok"]
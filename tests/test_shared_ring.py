@@ -0,0 +1,96 @@
+import pytest
+
+from shared_ring import SharedRing, ring_size, RING_INDEX_MASK, _HEAD_WORD, _TAIL_WORD
+from wire_protocol import TEXT_MODE_BULK
+
+
+def make_ring(slot_count: int = 4, slot_size: int = 16, start_index: int = 0):
+    """A producer and a consumer sharing one in-memory buffer; both indexes start at start_index."""
+    buffer = bytearray(ring_size(slot_count, slot_size))
+    wakes = []
+    producer = SharedRing(buffer, slot_count, slot_size, {}, wake=lambda: wakes.append(1))
+    if start_index:
+        words = memoryview(buffer).cast("I")
+        words[_HEAD_WORD] = words[_TAIL_WORD] = start_index
+        words.release()
+        producer = SharedRing(buffer, slot_count, slot_size, {}, wake=lambda: wakes.append(1), initialize=False)
+    consumer = SharedRing(buffer, slot_count, slot_size, {}, initialize=False)
+    return producer, consumer, wakes
+
+
+def test_messages_come_out_in_order_across_many_laps():
+    producer, consumer, _ = make_ring()
+    received = []
+    for lap in range(10):
+        for index in range(3):
+            assert producer.push(f"{lap}-{index}".encode())
+        while (message := consumer.pop()) is not None:
+            received.append(message.decode())
+    assert received == [f"{lap}-{index}" for lap in range(10) for index in range(3)]
+
+
+def test_full_ring_rejects_until_the_consumer_catches_up():
+    producer, consumer, _ = make_ring()
+    assert all(producer.push(bytes([index])) for index in range(4))
+    assert not producer.push(b"x")
+    assert producer.pending() == 4
+    assert consumer.pop() == b"\x00"
+    assert producer.push(b"x")
+    assert [consumer.pop() for _ in range(5)] == [b"\x01", b"\x02", b"\x03", b"x", None]
+
+
+def test_indexes_wrap_at_32_bits():
+    producer, consumer, _ = make_ring(start_index=RING_INDEX_MASK - 1)
+    for index in range(6):
+        assert producer.push(str(index).encode())
+        assert producer.pending() == 1
+        assert consumer.pop() == str(index).encode()
+    assert producer.pending() == 0 and consumer.pop() is None
+
+
+def test_wake_only_when_the_consumer_waits():
+    producer, consumer, wakes = make_ring()
+    producer.push(b"a")
+    assert wakes == []
+    consumer.set_waiting(True)
+    producer.push(b"b")
+    assert wakes == [1]
+
+
+def test_layout_is_validated():
+    with pytest.raises(ValueError):
+        make_ring(slot_count=3)
+    with pytest.raises(ValueError):
+        make_ring(slot_size=6)
+    producer, _, _ = make_ring()
+    with pytest.raises(ValueError):
+        producer.push(b"x" * 13)
+    buffer = bytearray(ring_size(4, 16))
+    SharedRing(buffer, 4, 16, {})
+    with pytest.raises(ValueError):
+        SharedRing(buffer, 8, 16, {}, initialize=False)
+
+
+def test_commands_reach_the_target_through_the_ring(fleet, make_controller):
+    pid, = fleet.spawn(1)
+    controller = make_controller(shared_ring=True, rate_limit_per_s=0)
+    assert pid in controller._rings
+    pieces = [f"{index:03d}," for index in range(600)]  # 超过槽位数, 环会多次回绕
+    for piece in pieces:
+        assert controller.send_text(piece, TEXT_MODE_BULK) == {pid: "delivered"}
+    assert controller.type_text("|", TEXT_MODE_BULK)[pid]["ok"]
+    assert fleet.targets[pid]._document.endswith("".join(pieces)[-400:] + "|")
+    large = "L" * 3000  # 大于一个槽位, 经管道发送但保持顺序
+    controller.send_text(large, TEXT_MODE_BULK)
+    assert controller.type_text("end", TEXT_MODE_BULK)[pid]["ok"]
+    target = fleet.targets[pid]
+    assert target.stats["typed_chars"] == len("".join(pieces)) + 1 + len(large) + 3
+    assert target._document.endswith("L" * 100 + "end")
+    assert target.stats["rings"] == 1
+
+
+def test_targets_without_ring_support_keep_the_pipe(fleet, make_controller):
+    pid, = fleet.spawn(1, shared_ring=False)
+    controller = make_controller(shared_ring=True)
+    assert pid not in controller._rings
+    assert controller.type_text("abc")[pid]["ok"]
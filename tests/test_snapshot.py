@@ -0,0 +1,94 @@
+import time
+
+import pytest
+
+from window_snapshot import (SnapshotCache, WindowSnapshot, escape_field, format_menu_record,
+                             format_window_record, parse_snapshot, unescape_field)
+
+
+def window(hwnd: int, text: str, parent: int = 0) -> str:
+    return format_window_record(hwnd, parent, hwnd, "Edit", 0x50010000, True, True, (0, 0, 10, 10), text)
+
+
+def delta_payload(version: int, base: int, full: bool, *lines: str) -> bytes:
+    header = f"Version:{version};Base:{base};Full:{int(full)};Windows:0;Menus:0;Truncated:0;"
+    return ("\n".join([header, *lines]) + "\n").encode('utf-8')
+
+
+def test_fields_round_trip_through_escaping():
+    text = "a\\b\tc\nd\re"
+    assert "\t" not in escape_field(text) and "\n" not in escape_field(text)
+    assert unescape_field(escape_field(text)) == text
+    menu = format_menu_record("0.1", 302, 0x8, False, "F\tx")
+    delta = parse_snapshot(delta_payload(1, 0, True, window(7, text), menu))
+    assert delta.full and delta.version == 1
+    assert delta.windows[7]["text"] == text and delta.windows[7]["rect"] == [0, 0, 10, 10]
+    assert delta.menus["0.1"] == {"path": "0.1", "id": 302, "state": 0x8, "submenu": False, "text": "F\tx"}
+
+
+def test_changes_since_lists_changed_and_removed_nodes():
+    snapshot = WindowSnapshot()
+    snapshot.apply(parse_snapshot(delta_payload(1, 0, True, window(1, "root"), window(2, "a", 1), window(3, "b", 1))))
+    snapshot.apply(parse_snapshot(delta_payload(2, 1, False, window(2, "changed", 1), "-W\t3")))
+    changes = snapshot.changes_since(1)
+    assert not changes["full"]
+    assert [node["hwnd"] for node in changes["windows"]] == [2]
+    assert changes["removed_windows"] == [3]
+    assert snapshot.changes_since(2)["windows"] == []
+    tree = snapshot.to_dict()
+    assert tree["full"] and [child["text"] for child in tree["windows"][0]["children"]] == ["changed"]
+
+
+def test_full_resync_keeps_change_history():
+    snapshot = WindowSnapshot()
+    snapshot.apply(parse_snapshot(delta_payload(1, 0, True, window(1, "root"), window(2, "a", 1), window(3, "b", 1))))
+    # 重连后 DLL 从新的版本号重新发送完整快照; 未变化的节点不应出现在增量中
+    snapshot.apply(parse_snapshot(delta_payload(5, 0, True, window(1, "root"), window(2, "a2", 1))))
+    changes = snapshot.changes_since(1)
+    assert [node["hwnd"] for node in changes["windows"]] == [2]
+    assert changes["removed_windows"] == [3]
+
+
+def test_partial_delta_on_wrong_base_is_rejected():
+    snapshot = WindowSnapshot()
+    snapshot.apply(parse_snapshot(delta_payload(1, 0, True, window(1, "root"))))
+    with pytest.raises(ValueError):
+        snapshot.apply(parse_snapshot(delta_payload(3, 2, False, window(1, "x"))))
+    assert snapshot.version == 1
+
+
+def test_cache_expires_and_invalidates_but_keeps_version():
+    cache = SnapshotCache(ttl_s=0.05)
+    cache.apply(1, parse_snapshot(delta_payload(4, 0, True, window(1, "root"))))
+    assert cache.get(1)["version"] == 4
+    time.sleep(0.1)
+    assert cache.get(1) is None
+    cache.apply(1, parse_snapshot(delta_payload(4, 4, False)))
+    cache.invalidate(1)
+    assert cache.get(1) is None
+    assert cache.version(1) == 4
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_query_snapshot_fetches_diffs(fleet, make_controller):
+    pid, = fleet.spawn(1)
+    controller = make_controller(snapshot_ttl_s=60)
+    full = controller.query_snapshot(pid)
+    assert full["full"] and full["windows"][0]["children"]
+    version = full["version"]
+    assert controller.query_snapshot(pid) == full
+
+    controller.type_text("hello", pids=[pid])
+    changes = controller.query_snapshot(pid, since=version)
+    assert not changes["full"] and changes["since"] == version
+    assert [node["text"] for node in changes["windows"]] == ["hello"]
+    assert changes["menus"] == [] and changes["removed_windows"] == []
+
+    version = changes["version"]
+    controller.send_menu_command(302, pids=[pid])
+    changes = controller.query_snapshot(pid, since=version)
+    assert changes["windows"] == []
+    assert [(menu["id"], menu["state"]) for menu in changes["menus"]] == [(302, 0x8)]
+    fetched = {entry["labels"]["kind"]: entry["value"] for entry in controller.metrics.snapshot()["counters"]
+               if entry["name"] == "snapshot_total"}
+    assert fetched == {"full": 1, "diff": 2}
@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+from controller import AsyncProcessInputController
+from wire_protocol import TEXT_MODE_BULK, TEXT_MODE_PASTE
+
+
+def test_generator_source_is_typed_in_full(fleet, make_controller):
+    pid, = fleet.spawn(1)
+    controller = make_controller()
+    pieces = ("piece %d;" % index for index in range(100))
+    result = controller.stream_text(pieces, chunk_chars=64)[pid]
+    total = sum(len("piece %d;" % index) for index in range(100))
+    assert result["ok"] and result["acked_chars"] == result["sent_chars"] == total
+    assert result["chunks"] == -(-total // 64)
+    assert fleet.targets[pid].stats["typed_chars"] == total
+
+
+def test_window_bounds_unacknowledged_chunks(fleet, make_controller):
+    pid, = fleet.spawn(1, char_delay_s=0.001)
+    controller = make_controller()
+    pulled, in_flight = [], []
+
+    def source():
+        for index in range(20):
+            pulled.append(index)
+            yield "x" * 10
+
+    def progress(target, acked, sent):
+        in_flight.append((sent - acked) // 10)
+        # 第一次确认时最多只取出了 window 个块, 外加正在等待发送的一个
+        if len(in_flight) == 1:
+            assert len(pulled) <= 3
+
+    result = controller.stream_text(source(), chunk_chars=10, window=2, progress=progress)[pid]
+    assert result["ok"] and result["chunks"] == 20 and result["acked_chars"] == 200
+    assert len(in_flight) == 20 and max(in_flight) <= 2
+    assert in_flight[-1] == 0
+
+
+def test_legacy_targets_are_rejected(fleet, make_controller):
+    framed, = fleet.spawn(1)
+    legacy, = fleet.spawn(1, framed=False)
+    controller = make_controller()
+    results = controller.stream_text("hello")
+    assert results[framed]["ok"]
+    assert not results[legacy]["ok"] and "legacy" in results[legacy]["error"]
+    assert results[legacy]["sent_chars"] == 0
+    assert fleet.targets[legacy].stats["typed_chars"] == 0
+
+
+def test_unacknowledged_chunk_fails_at_the_deadline(fleet, make_controller):
+    slow, fast = fleet.spawn(1, char_delay_s=0.1) + fleet.spawn(1)
+    controller = make_controller()
+    start = time.monotonic()
+    # paste 模式没有按字符增加的确认预算, 截止时间就是 timeout_ms
+    results = controller.stream_text("y" * 50, TEXT_MODE_PASTE, chunk_chars=10, timeout_ms=200)
+    assert time.monotonic() - start < 1
+    assert not results[slow]["ok"] and results[slow]["error"] == "chunk was not acknowledged"
+    assert results[slow]["acked_chars"] == 0
+    assert results[fast]["ok"] and results[fast]["acked_chars"] == 50
+
+
+def test_async_stream_forwards_the_timeout(fleet, make_controller):
+    pid, = fleet.spawn(1, char_delay_s=0.1)
+    controller = AsyncProcessInputController(make_controller())
+    start = time.monotonic()
+    result = asyncio.run(controller.stream_text("z" * 6, TEXT_MODE_PASTE, timeout_ms=200))[pid]
+    assert not result["ok"] and time.monotonic() - start < 1
+    assert asyncio.run(controller.stream_text("ok", TEXT_MODE_BULK))[pid]["ok"]
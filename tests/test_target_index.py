@@ -0,0 +1,79 @@
+import re
+
+import psutil
+import pytest
+
+from target_index import TargetIndex, normalize_exe_name
+
+
+class FakeProcess:
+    names = {}
+
+    def __init__(self, pid: int):
+        if pid not in self.names:
+            raise psutil.NoSuchProcess(pid)
+        self.pid = pid
+
+    def name(self) -> str:
+        return self.names[self.pid]
+
+
+@pytest.fixture
+def exe_names(monkeypatch):
+    names = {}
+    monkeypatch.setattr(FakeProcess, "names", names)
+    monkeypatch.setattr(psutil, "Process", FakeProcess)
+    return names
+
+
+def queries(fleet, pids) -> list[int]:
+    return [fleet.targets[pid].stats["queries"] for pid in pids]
+
+
+def test_normalize_exe_name():
+    assert normalize_exe_name("TeXworks.EXE") == normalize_exe_name("texworks") == "texworks"
+
+
+def test_select_by_pid_exe_and_title(exe_names):
+    exe_names.update({1: "TeXworks.exe", 2: "notepad.exe", 3: "TeXworks.exe"})
+    index = TargetIndex()
+    for pid in (1, 2, 3, 4):
+        index.add(pid)
+    index.update_title(1, "paper.tex - TeXworks")
+    index.update_title(3, "notes.tex - TeXworks")
+    assert sorted(index.select(exe="texworks")) == [1, 3]
+    assert index.select(exe="TEXWORKS.EXE", pids=[3, 2]) == [3]
+    assert index.select(pids=[2, 99]) == [2]
+    assert index.select(title=r"^paper") == [1]
+    assert index.select(exe="notepad", title="TeXworks") == []
+    assert index.exe_name(4) == ""
+    assert sorted(index.pids_without_title()) == [2, 4]
+    assert index.pids_without_title([1, 2, 99]) == [2]
+    index.remove(1)
+    assert index.select(title="tex") == [3]
+    index.update_title(1, "gone")  # 已移除的 PID 不再记录标题
+    assert sorted(index.select()) == [2, 3, 4]
+
+
+def test_invalid_title_pattern_raises_before_querying(fleet, make_controller):
+    pids = fleet.spawn(2)
+    controller = make_controller()
+    with pytest.raises(re.error):
+        controller.select_targets(title="(")
+    assert queries(fleet, pids) == [0, 0]
+
+
+def test_titles_are_fetched_once_and_only_when_needed(fleet, make_controller, exe_names):
+    editor, viewer, other = fleet.spawn(1, title="Editor") + fleet.spawn(1, title="Viewer") + fleet.spawn(1)
+    exe_names.update({editor: "texworks.exe", viewer: "texworks.exe", other: "notepad.exe"})
+    controller = make_controller(info_ttl_s=0)
+    everyone = [editor, viewer, other]
+    assert sorted(controller.select_targets(exe="texworks")) == sorted([editor, viewer])
+    assert queries(fleet, everyone) == [0, 0, 0]
+    # 带 PID 过滤时只查询这些 PID 中尚不知道标题的
+    assert controller.select_targets(pids=[viewer], title="View") == [viewer]
+    assert queries(fleet, everyone) == [0, 1, 0]
+    # exe 过滤掉的 PID 也不查询
+    assert controller.select_targets(exe="texworks", title="^Edit") == [editor]
+    assert queries(fleet, everyone) == [1, 1, 0]
+    assert controller.select_targets(title="Editor|Viewer") and queries(fleet, everyone) == [1, 1, 1]
@@ -0,0 +1,68 @@
+import struct
+
+import pytest
+
+from wire_protocol import (FLAG_NO_REPLY, FRAME_HEADER, FRAME_HEADER_SIZE, MAX_PAYLOAD_SIZE, OP_MENU, OP_PING,
+                           OP_QUERY_INFO, OP_TYPE, PROTOCOL_MAGIC, PROTOCOL_VERSION, FrameDecoder, ProtocolError,
+                           decode_batch_response, encode_batch, encode_frame, legacy_to_frame)
+
+
+def test_frame_split_across_reads():
+    data = encode_frame(OP_TYPE, 7, "héllo".encode('utf-8'))
+    decoder = FrameDecoder()
+    assert decoder.feed(data[:3]) == []
+    assert decoder.feed(data[3:FRAME_HEADER_SIZE + 2]) == []
+    frame, = decoder.feed(data[FRAME_HEADER_SIZE + 2:])
+    assert (frame.opcode, frame.request_id, frame.payload.decode('utf-8')) == (OP_TYPE, 7, "héllo")
+
+
+def test_several_frames_in_one_read():
+    data = (encode_frame(OP_PING, 1) + encode_frame(OP_QUERY_INFO, 2, flags=FLAG_NO_REPLY)
+            + encode_frame(OP_TYPE, 3, b"x"))
+    decoder = FrameDecoder()
+    frames = decoder.feed(data + data[:5])
+    assert [(frame.opcode, frame.request_id) for frame in frames] == [(OP_PING, 1), (OP_QUERY_INFO, 2), (OP_TYPE, 3)]
+    assert frames[1].flags == FLAG_NO_REPLY
+    assert decoder.feed(data[5:])[0].request_id == 1
+
+
+def test_bad_magic_is_rejected():
+    with pytest.raises(ProtocolError, match="magic"):
+        FrameDecoder().feed(b"XX" + encode_frame(OP_PING, 1)[2:])
+
+
+def test_bad_version_is_rejected():
+    header = FRAME_HEADER.pack(PROTOCOL_MAGIC, PROTOCOL_VERSION + 1, OP_PING, 0, 1, 0)
+    with pytest.raises(ProtocolError, match="version"):
+        FrameDecoder().feed(header)
+
+
+def test_oversized_payload_is_rejected():
+    with pytest.raises(ProtocolError):
+        encode_frame(OP_TYPE, 1, bytes(MAX_PAYLOAD_SIZE + 1))
+    # 长度在头部就能判断, 不必等整个 payload 到达
+    header = FRAME_HEADER.pack(PROTOCOL_MAGIC, PROTOCOL_VERSION, OP_TYPE, 0, 1, MAX_PAYLOAD_SIZE + 1)
+    with pytest.raises(ProtocolError, match="exceeds"):
+        FrameDecoder().feed(header)
+
+
+def test_batch_round_trip():
+    frames = decode_batch_response(encode_batch([(OP_TYPE, b"ab"), (OP_MENU, struct.pack("<i", 302))]))
+    assert [(frame.opcode, frame.request_id, frame.payload) for frame in frames] == [
+        (OP_TYPE, 0, b"ab"), (OP_MENU, 1, struct.pack("<i", 302))]
+
+
+def decode(command: str):
+    frame, = FrameDecoder().feed(legacy_to_frame(command, 9, FLAG_NO_REPLY))
+    return frame
+
+
+def test_legacy_commands_translate_to_frames():
+    frame = decode("TYPE:a;b")
+    assert (frame.opcode, frame.request_id, frame.flags, frame.payload) == (OP_TYPE, 9, FLAG_NO_REPLY, b"a;b")
+    frame = decode("MENU:-5")
+    assert (frame.opcode, struct.unpack("<i", frame.payload)[0]) == (OP_MENU, -5)
+    assert decode("QUERY_INFO").opcode == OP_QUERY_INFO
+    for command in ("MENU:abc", "CLICK:1", "QUERY_INFO2"):
+        with pytest.raises(ProtocolError):
+            legacy_to_frame(command, 1)
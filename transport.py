@@ -0,0 +1,203 @@
+import errno
+import itertools
+import mmap
+import os
+import select
+import socket
+import sys
+import time
+
+from shared_ring import SharedRing, ring_size, RING_FIELD_NAME, RING_FIELD_EVENT
+
+# --- Connect Results ---
+CONNECT_CONNECTED = "connected"
+CONNECT_TIMED_OUT = "timed_out"
+CONNECT_BUSY = "busy"
+CONNECT_ERROR = "error"
+
+# 目标尚未创建服务端时的重试间隔
+CONNECT_RETRY_INTERVAL_S = 0.1
+LEGACY_READ_SIZE = 4096
+
+# 每个共享内存环形缓冲区使用唯一的名称, 重连时不会打开旧的映射
+_ring_ids = itertools.count(1)
+
+
+class TransportError(Exception):
+    """Raised by a transport when an I/O operation fails."""
+
+
+class TransportBrokenError(TransportError):
+    """Raised when the other end has closed the connection."""
+
+
+class Transport:
+    """
+    Byte-stream connection to one injected process.
+
+    ProcessInputController only talks to targets through this interface, so
+    the same controller runs over Windows named pipes in production and over
+    Unix domain sockets (see fake_dll.py) for benchmarks on any Linux box.
+    Connection objects are opaque to the controller.
+    """
+
+    name = "base"
+
+    def connect(self, address: str, deadline: float) -> tuple[str, object | None]:
+        """
+        Opens a connection, retrying until deadline (time.monotonic() based).
+
+        Returns:
+            A (status, connection) tuple; connection is None unless status is CONNECT_CONNECTED.
+        """
+        raise NotImplementedError
+
+    def write(self, connection: object, data: bytes):
+        """Writes one message. Raises TransportBrokenError or TransportError."""
+        raise NotImplementedError
+
+    def read(self, connection: object, deadline: float | None) -> bytes:
+        """
+        Returns the bytes available on the connection, waiting until some arrive.
+
+        Args:
+            deadline: time.monotonic() based deadline; None blocks until data arrives.
+
+        Returns:
+            The bytes read, or b"" if the deadline passed first.
+        """
+        raise NotImplementedError
+
+    def probe(self, connection: object):
+        """Checks that the other end is still there without sending anything. Raises TransportBrokenError."""
+        raise NotImplementedError
+
+    def close(self, connection: object):
+        raise NotImplementedError
+
+    def open_ring(self, address: str, slot_count: int, slot_size: int) -> SharedRing | None:
+        """
+        Creates a shared-memory command ring next to the target at address.
+
+        Returns:
+            The producer side of the ring, or None if the transport has no
+            shared memory; the controller then keeps using the connection.
+        """
+        return None
+
+
+class UnixSocketTransport(Transport):
+    """
+    Transport over Unix domain stream sockets named like the DLL's pipes (<prefix><pid>).
+
+    A stream socket has no message boundaries, so legacy string commands sent
+    back to back may arrive merged; the framed protocol is unaffected.
+    """
+
+    name = "unix"
+
+    def connect(self, address: str, deadline: float) -> tuple[str, object | None]:
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(address)
+                return CONNECT_CONNECTED, sock
+            except (FileNotFoundError, ConnectionRefusedError, BlockingIOError) as e:
+                sock.close()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return CONNECT_BUSY if isinstance(e, BlockingIOError) else CONNECT_TIMED_OUT, None
+                time.sleep(min(CONNECT_RETRY_INTERVAL_S, remaining))
+            except OSError:
+                sock.close()
+                return CONNECT_ERROR, None
+
+    def write(self, connection: socket.socket, data: bytes):
+        try:
+            connection.sendall(data)
+        except (BrokenPipeError, ConnectionResetError) as e:
+            raise TransportBrokenError(str(e)) from e
+        except OSError as e:
+            raise TransportError(str(e)) from e
+
+    def read(self, connection: socket.socket, deadline: float | None) -> bytes:
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        try:
+            readable, _, _ = select.select([connection], [], [], timeout)
+            if not readable:
+                return b""
+            data = connection.recv(LEGACY_READ_SIZE)
+        except (ConnectionResetError, ValueError) as e:
+            raise TransportBrokenError(str(e)) from e
+        except OSError as e:
+            raise TransportError(str(e)) from e
+        if not data:
+            raise TransportBrokenError("Connection closed by peer")
+        return data
+
+    def probe(self, connection: socket.socket):
+        try:
+            if connection.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b"":
+                raise TransportBrokenError("Connection closed by peer")
+        except BlockingIOError:
+            return
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise TransportBrokenError(str(e)) from e
+
+    def close(self, connection: socket.socket):
+        try:
+            connection.close()
+        except OSError:
+            pass
+
+    def open_ring(self, address: str, slot_count: int, slot_size: int) -> SharedRing | None:
+        """
+        Maps a file next to the socket and uses a FIFO as the wake-up event.
+
+        Both are named <address>.<controller pid>.<n>.ring/.bell, which
+        PipeNamespaceDiscovery does not mistake for targets.
+        """
+        path = f"{address}.{os.getpid()}.{next(_ring_ids)}"
+        ring_path, bell_path = f"{path}.ring", f"{path}.bell"
+        fd = os.open(ring_path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            os.ftruncate(fd, ring_size(slot_count, slot_size))
+            buffer = mmap.mmap(fd, ring_size(slot_count, slot_size))
+        finally:
+            os.close(fd)
+        os.mkfifo(bell_path, 0o600)
+        # O_RDWR: 打开时不需要读端已经存在, 写满时也不会阻塞
+        bell = os.open(bell_path, os.O_RDWR | os.O_NONBLOCK)
+
+        def wake():
+            try:
+                os.write(bell, b"\x01")
+            except BlockingIOError:
+                pass  # FIFO 已满, 消费者必然会被唤醒
+
+        def release():
+            buffer.close()
+            os.close(bell)
+            for leftover in (ring_path, bell_path):
+                try:
+                    os.unlink(leftover)
+                except FileNotFoundError:
+                    pass
+
+        return SharedRing(buffer, slot_count, slot_size, {RING_FIELD_NAME: ring_path, RING_FIELD_EVENT: bell_path},
+                          wake, release)
+
+
+def default_transport() -> Transport:
+    """Named pipes on Windows, Unix domain sockets elsewhere."""
+    if sys.platform == "win32":
+        from pipe_transport import NamedPipeTransport
+        return NamedPipeTransport()
+    return UnixSocketTransport()
+
+
+def socket_address_base(directory: str, prefix: str) -> str:
+    """Builds the pipe_name_base equivalent for Unix sockets created in directory."""
+    return os.path.join(directory, prefix)
@@ -0,0 +1,285 @@
+import threading
+import time
+from typing import NamedTuple
+
+# --- Snapshot Format (OP_SNAPSHOT) ---
+# 请求 payload: "Since:<版本>;"; 0 或与 DLL 记录的版本不一致时, DLL 返回完整快照, 否则只返回变化的记录
+# 响应: 第一行为 "Version:<v>;Base:<b>;Full:<0|1>;Windows:<n>;Menus:<m>;Truncated:<0|1>;"
+# 之后每行一条记录, 字段以制表符分隔, 文本字段中的 \ 制表符 换行 回车 转义为 \\ \t \n \r:
+#   W  hwnd  parent  control_id  class  style(十六进制)  visible+enabled(两位 0/1)  left,top,right,bottom  text
+#   M  path  command_id  state(十六进制)  submenu(0/1)  text       (path 为各级菜单中的位置, 如 "0.3")
+#   -W hwnd / -M path                                                 (自 Base 以来被删除的节点)
+# 与 MCP_Tool.cpp 中的 BuildSnapshotResponse 保持一致
+SNAPSHOT_SINCE_FIELD = "Since"
+SNAPSHOT_WINDOW = "W"
+SNAPSHOT_MENU = "M"
+SNAPSHOT_REMOVED = "-"
+_ESCAPES = {"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"}
+_UNESCAPES = {"\\": "\\", "t": "\t", "n": "\n", "r": "\r"}
+
+# 快照的默认有效期; 输入和菜单命令会使其提前过期
+DEFAULT_SNAPSHOT_TTL_S = 5.0
+# 每个 PID 保留的删除记录数, 更早的版本只能拿到完整快照
+MAX_SNAPSHOT_TOMBSTONES = 4096
+
+
+def encode_snapshot_request(since: int) -> bytes:
+    return f"{SNAPSHOT_SINCE_FIELD}:{since};".encode('utf-8')
+
+
+def escape_field(text: str) -> str:
+    return "".join(_ESCAPES.get(char, char) for char in text)
+
+
+def unescape_field(text: str) -> str:
+    if "\\" not in text:
+        return text
+    chars = []
+    escaped = False
+    for char in text:
+        if escaped:
+            chars.append(_UNESCAPES.get(char, char))
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        else:
+            chars.append(char)
+    return "".join(chars)
+
+
+def format_window_record(hwnd: int, parent: int, control_id: int, class_name: str, style: int, visible: bool,
+                         enabled: bool, rect: tuple[int, int, int, int], text: str) -> str:
+    """Encodes one window record line (without the newline), as the DLL does."""
+    return "\t".join((SNAPSHOT_WINDOW, str(hwnd), str(parent), str(control_id), escape_field(class_name),
+                      f"{style:x}", f"{int(visible)}{int(enabled)}", ",".join(map(str, rect)), escape_field(text)))
+
+
+def format_menu_record(path: str, command_id: int, state: int, submenu: bool, text: str) -> str:
+    """Encodes one menu record line (without the newline), as the DLL does."""
+    return "\t".join((SNAPSHOT_MENU, path, str(command_id), f"{state:x}", str(int(submenu)), escape_field(text)))
+
+
+def record_key(line: str) -> str:
+    """The node a record line describes ("W\\t<hwnd>" or "M\\t<path>"); removal lines are "-" + key."""
+    return line[:line.find("\t", 2)]
+
+
+class SnapshotDelta(NamedTuple):
+    version: int
+    base: int
+    full: bool
+    truncated: bool
+    windows: dict[int, dict]
+    menus: dict[str, dict]
+    removed_windows: list[int]
+    removed_menus: list[str]
+    header: dict
+
+
+def _parse_window(fields: list[str]) -> dict:
+    hwnd, parent, control_id, class_name, style, state, rect, text = fields
+    return {"hwnd": int(hwnd), "parent": int(parent), "id": int(control_id), "class": unescape_field(class_name),
+            "style": int(style, 16), "visible": state[:1] == "1", "enabled": state[1:2] == "1",
+            "rect": [int(value) for value in rect.split(",")], "text": unescape_field(text)}
+
+
+def _parse_menu(fields: list[str]) -> dict:
+    path, command_id, state, submenu, text = fields
+    return {"path": path, "id": int(command_id), "state": int(state, 16), "submenu": submenu == "1",
+            "text": unescape_field(text)}
+
+
+def parse_snapshot(payload: bytes) -> SnapshotDelta:
+    """
+    Parses an OP_SNAPSHOT response.
+
+    Raises:
+        ValueError: If the payload is not a valid snapshot.
+    """
+    lines = payload.decode('utf-8', errors='replace').split("\n")
+    header = {}
+    windows, menus, removed_windows, removed_menus = {}, {}, [], []
+    for line in lines:
+        if not line:
+            continue
+        fields = line.split("\t")
+        kind = fields[0]
+        if kind == SNAPSHOT_WINDOW and len(fields) == 9:
+            window = _parse_window(fields[1:])
+            windows[window["hwnd"]] = window
+        elif kind == SNAPSHOT_MENU and len(fields) == 6:
+            menu = _parse_menu(fields[1:])
+            menus[menu["path"]] = menu
+        elif kind == SNAPSHOT_REMOVED + SNAPSHOT_WINDOW and len(fields) == 2:
+            removed_windows.append(int(fields[1]))
+        elif kind == SNAPSHOT_REMOVED + SNAPSHOT_MENU and len(fields) == 2:
+            removed_menus.append(fields[1])
+        elif len(fields) == 1 and ":" in line:
+            # 头部行和 DLL 附加的 "ExecUs:<n>;"
+            for part in line.strip(";").split(";"):
+                key, _, value = part.partition(":")
+                header[key] = value
+        else:
+            raise ValueError(f"Malformed snapshot record: {line[:80]!r}")
+    try:
+        return SnapshotDelta(int(header["Version"]), int(header["Base"]), header["Full"] == "1",
+                             header.get("Truncated") == "1", windows, menus, removed_windows, removed_menus, header)
+    except KeyError as e:
+        raise ValueError(f"Snapshot header lacks {e}")
+
+
+class WindowSnapshot:
+    """
+    Controller-side copy of one target's window tree and menu table.
+
+    Deltas from the DLL are applied in place. Every node remembers the
+    version in which it last changed and removed nodes leave a tombstone,
+    so changes_since() can answer "what changed after version N" for MCP
+    clients without keeping old copies of the tree. A full resync (e.g.
+    after a reconnect) is compared node by node, so it does not reset the
+    change history.
+    """
+
+    def __init__(self, max_tombstones: int = MAX_SNAPSHOT_TOMBSTONES):
+        self.version = 0
+        self.truncated = False
+        self.windows = {}
+        self.menus = {}
+        self.max_tombstones = max_tombstones
+        # (kind, key) -> version of the last change / of the removal
+        self._changed = {}
+        self._removed = {}
+        # 早于此版本的删除记录已被丢弃
+        self._removed_floor = 0
+
+    def apply(self, delta: SnapshotDelta):
+        """
+        Applies a delta from the DLL.
+
+        Raises:
+            ValueError: If a partial delta is not based on this snapshot's version.
+        """
+        if not delta.full and delta.base != self.version:
+            raise ValueError(f"Snapshot delta is based on version {delta.base}, have {self.version}")
+        if delta.version == self.version:
+            return
+        version = delta.version
+        removed = [(SNAPSHOT_WINDOW, hwnd) for hwnd in delta.removed_windows]
+        removed += [(SNAPSHOT_MENU, path) for path in delta.removed_menus]
+        if delta.full:
+            removed += [(SNAPSHOT_WINDOW, hwnd) for hwnd in self.windows.keys() - delta.windows.keys()]
+            removed += [(SNAPSHOT_MENU, path) for path in self.menus.keys() - delta.menus.keys()]
+        for kind, nodes, updates in ((SNAPSHOT_WINDOW, self.windows, delta.windows),
+                                     (SNAPSHOT_MENU, self.menus, delta.menus)):
+            for key, node in updates.items():
+                if nodes.get(key) != node:
+                    nodes[key] = node
+                    self._changed[kind, key] = version
+                    self._removed.pop((kind, key), None)
+        for kind, key in removed:
+            if (self.windows if kind == SNAPSHOT_WINDOW else self.menus).pop(key, None) is not None:
+                self._changed.pop((kind, key), None)
+                self._removed[kind, key] = version
+        if len(self._removed) > self.max_tombstones:
+            expired = sorted(self._removed, key=self._removed.get)[:len(self._removed) - self.max_tombstones]
+            for key in expired:
+                self._removed_floor = max(self._removed_floor, self._removed.pop(key))
+        self.version = version
+        self.truncated = delta.truncated
+
+    def to_dict(self) -> dict:
+        """The whole snapshot: windows as a tree (children nested under their parent) and the menu table."""
+        children = {}
+        for window in self.windows.values():
+            children.setdefault(window["parent"], []).append(window)
+
+        def build(window: dict) -> dict:
+            return {**window, "children": [build(child) for child in children.get(window["hwnd"], ())]}
+
+        roots = [window for window in self.windows.values() if window["parent"] not in self.windows]
+        return {"version": self.version, "full": True, "truncated": self.truncated,
+                "windows": [build(window) for window in roots],
+                "menus": [self.menus[path] for path in sorted(self.menus, key=_menu_sort_key)]}
+
+    def changes_since(self, version: int) -> dict:
+        """
+        Nodes changed or removed after version, as flat lists.
+
+        Falls back to to_dict() (with "full": true) when version is 0, newer
+        than this snapshot or older than the oldest tombstone kept.
+        """
+        if version <= 0 or version > self.version or version < self._removed_floor:
+            return self.to_dict()
+        changed = [key for key, changed_in in self._changed.items() if changed_in > version]
+        removed = [key for key, removed_in in self._removed.items() if removed_in > version]
+        return {"version": self.version, "since": version, "full": False, "truncated": self.truncated,
+                "windows": [self.windows[key] for kind, key in changed if kind == SNAPSHOT_WINDOW],
+                "menus": [self.menus[key] for kind, key in changed if kind == SNAPSHOT_MENU],
+                "removed_windows": [key for kind, key in removed if kind == SNAPSHOT_WINDOW],
+                "removed_menus": [key for kind, key in removed if kind == SNAPSHOT_MENU]}
+
+
+def _menu_sort_key(path: str) -> list[int]:
+    return [int(part) for part in path.split(".")]
+
+
+class SnapshotCache:
+    """
+    Per-PID WindowSnapshots with an expiry time.
+
+    Unlike ProcessInfoCache, expiring or invalidating an entry keeps the
+    snapshot: its version is sent with the next OP_SNAPSHOT so the DLL only
+    returns what changed. Entries are dropped only when the process goes away.
+    """
+
+    def __init__(self, ttl_s: float = DEFAULT_SNAPSHOT_TTL_S):
+        self.ttl_s = ttl_s
+        # pid -> [WindowSnapshot, fetched_at]
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, pid: int) -> int:
+        """The version to send with the next OP_SNAPSHOT (0 requests a full snapshot)."""
+        with self._lock:
+            entry = self._entries.get(pid)
+            return entry[0].version if entry else 0
+
+    def get(self, pid: int, max_age_s: float | None = None, since: int | None = None) -> dict | None:
+        """
+        Returns the snapshot of a PID (or its changes after since), or None if it is missing or stale.
+
+        Args:
+            pid: The process ID.
+            max_age_s: Overrides ttl_s for this lookup.
+            since: Return only the changes after this version; see WindowSnapshot.changes_since().
+        """
+        max_age_s = self.ttl_s if max_age_s is None else max_age_s
+        with self._lock:
+            entry = self._entries.get(pid)
+            if entry is None or time.monotonic() - entry[1] >= max_age_s:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0].to_dict() if since is None else entry[0].changes_since(since)
+
+    def apply(self, pid: int, delta: SnapshotDelta):
+        """Applies a DLL delta and marks the entry fresh. Raises ValueError like WindowSnapshot.apply()."""
+        with self._lock:
+            entry = self._entries.get(pid)
+            if entry is None:
+                entry = self._entries[pid] = [WindowSnapshot(), 0.0]
+            entry[0].apply(delta)
+            entry[1] = time.monotonic()
+
+    def invalidate(self, pid: int | None = None):
+        """Marks the entry of one PID (or every entry) stale; the next lookup fetches a diff."""
+        with self._lock:
+            for key in (self._entries if pid is None else [pid]):
+                if key in self._entries:
+                    self._entries[key][1] = float("-inf")
+
+    def discard(self, pid: int):
+        with self._lock:
+            self._entries.pop(pid, None)
@@ -0,0 +1,175 @@
+import struct
+from typing import Iterable, Iterator, NamedTuple
+
+# --- Frame Layout ---
+# 每个帧: magic(2) | version(1) | opcode(1) | flags(2) | request_id(4) | payload_len(4) | payload
+# 所有整数均为小端序, 与 MCP_Tool.cpp 中的 FrameHeader 保持一致
+PROTOCOL_MAGIC = b"MI"
+PROTOCOL_VERSION = 1
+FRAME_HEADER = struct.Struct("<2sBBHII")
+FRAME_HEADER_SIZE = FRAME_HEADER.size
+MAX_PAYLOAD_SIZE = 1 << 20
+
+# --- Opcodes ---
+OP_HELLO = 0x01
+OP_TYPE = 0x02
+OP_MENU = 0x03
+OP_QUERY_INFO = 0x04
+OP_BATCH = 0x05  # payload 为若干子帧, DLL 按顺序执行并在一个响应中返回全部结果
+OP_TYPE_EX = 0x06  # payload: 输入模式(1字节) + UTF-8 文本; 响应包含字符数和耗时
+OP_PING = 0x07  # 心跳; DLL 在读取线程上直接应答, 不会排在慢速命令之后
+OP_RING_ATTACH = 0x08  # payload: 共享内存环形缓冲区的名称和槽位布局 (见 shared_ring.py); 不支持的 DLL 返回错误
+OP_SNAPSHOT = 0x09  # 窗口树和菜单表, 相对于本连接上一个版本的增量 (格式见 window_snapshot.py)
+OPCODE_NAMES = {OP_HELLO: "hello", OP_TYPE: "type", OP_MENU: "menu", OP_QUERY_INFO: "query",
+                OP_BATCH: "batch", OP_TYPE_EX: "type", OP_PING: "ping", OP_RING_ATTACH: "ring_attach",
+                OP_SNAPSHOT: "snapshot"}
+
+# --- Flags ---
+FLAG_RESPONSE = 0x0001  # 由 DLL 发出的响应帧
+FLAG_NO_REPLY = 0x0002  # 请求方不需要确认响应
+FLAG_ERROR = 0x0004     # 响应表示执行失败
+
+# --- Text Injection Modes (OP_TYPE_EX) ---
+# legacy: 每个字符 PostMessage + Sleep(25); bulk: 按消息队列配额批量投递; paste: 剪贴板 + WM_PASTE (之后恢复原剪贴板内容)
+TEXT_MODE_LEGACY = "legacy"
+TEXT_MODE_BULK = "bulk"
+TEXT_MODE_PASTE = "paste"
+TEXT_MODES = {TEXT_MODE_LEGACY: 0, TEXT_MODE_BULK: 1, TEXT_MODE_PASTE: 2}
+
+# --- Legacy String Commands ---
+LEGACY_TYPE_PREFIX = "TYPE:"
+LEGACY_MENU_PREFIX = "MENU:"
+LEGACY_QUERY_INFO = "QUERY_INFO"
+
+
+class ProtocolError(Exception):
+    """Raised when a byte stream does not contain valid frames."""
+
+
+class Frame(NamedTuple):
+    opcode: int
+    flags: int
+    request_id: int
+    payload: bytes
+
+    @property
+    def is_error(self) -> bool:
+        return bool(self.flags & FLAG_ERROR)
+
+
+def encode_frame(opcode: int, request_id: int, payload: bytes = b"", flags: int = 0) -> bytes:
+    if len(payload) > MAX_PAYLOAD_SIZE:
+        raise ProtocolError(f"Payload of {len(payload)} bytes exceeds {MAX_PAYLOAD_SIZE}")
+    return FRAME_HEADER.pack(PROTOCOL_MAGIC, PROTOCOL_VERSION, opcode, flags, request_id, len(payload)) + payload
+
+
+def encode_menu_payload(command_id: int) -> bytes:
+    return struct.pack("<i", command_id)
+
+
+def encode_type_ex_payload(text: str, mode: str) -> bytes:
+    """Raises KeyError for an unknown mode."""
+    return bytes([TEXT_MODES[mode]]) + text.encode('utf-8')
+
+
+def iter_text_chunks(source: str | Iterable[str], max_chars: int) -> Iterator[str]:
+    """
+    Re-chunks a string or a stream of text pieces into chunks of at most max_chars characters.
+
+    Chunks are cut on code point boundaries and are small enough for their
+    UTF-8 form to fit in one OP_TYPE_EX frame; only one chunk's worth of text
+    is buffered at a time.
+    """
+    max_chars = max(1, min(max_chars, (MAX_PAYLOAD_SIZE - 1) // 4))  # 最多 4 字节/码点
+    if isinstance(source, str):
+        source = (source,)
+    pending = ""
+    for piece in source:
+        if pending:
+            piece = pending + piece
+        offset = 0
+        while len(piece) - offset >= max_chars:
+            yield piece[offset:offset + max_chars]
+            offset += max_chars
+        pending = piece[offset:]
+    if pending:
+        yield pending
+
+
+def encode_batch(requests: list[tuple[int, bytes]]) -> bytes:
+    """Encodes (opcode, payload) pairs as the payload of an OP_BATCH frame; sub-request IDs are their indexes."""
+    return b"".join(encode_frame(opcode, index, payload) for index, (opcode, payload) in enumerate(requests))
+
+
+def decode_batch_response(payload: bytes) -> list[Frame]:
+    """Splits the payload of an OP_BATCH response into the sub-response frames."""
+    return FrameDecoder().feed(payload)
+
+
+def legacy_to_frame(command: str, request_id: int, flags: int = 0) -> bytes:
+    """
+    Translates a legacy string command ("TYPE:...", "MENU:<id>", "QUERY_INFO") into a frame.
+
+    Raises:
+        ProtocolError: If the command is not one of the known legacy commands.
+    """
+    if command.startswith(LEGACY_TYPE_PREFIX):
+        return encode_frame(OP_TYPE, request_id, command[len(LEGACY_TYPE_PREFIX):].encode('utf-8'), flags)
+    if command.startswith(LEGACY_MENU_PREFIX):
+        try:
+            command_id = int(command[len(LEGACY_MENU_PREFIX):])
+        except ValueError:
+            raise ProtocolError(f"Invalid menu id in command: {command!r}")
+        return encode_frame(OP_MENU, request_id, encode_menu_payload(command_id), flags)
+    if command == LEGACY_QUERY_INFO:
+        return encode_frame(OP_QUERY_INFO, request_id, b"", flags)
+    raise ProtocolError(f"Unknown legacy command: {command!r}")
+
+
+def parse_exec_us(payload: bytes) -> int | None:
+    """Returns the "ExecUs" field the DLL appends to responses (time spent executing), if present."""
+    start = payload.rfind(b"ExecUs:")
+    if start < 0:
+        return None
+    end = payload.find(b";", start)
+    try:
+        return int(payload[start + 7:end if end >= 0 else None])
+    except ValueError:
+        return None
+
+
+def parse_kv(payload: bytes | str) -> dict:
+    """Parses the "Key:Value;Key:Value;" format used by QUERY_INFO and framed responses."""
+    if isinstance(payload, bytes):
+        payload = payload.decode('utf-8', errors='replace')
+    info_dict = {}
+    for part in payload.strip('\x00').strip(';').split(';'):
+        if ':' in part:
+            key, value = part.split(':', 1)
+            info_dict[key] = value
+    return info_dict
+
+
+class FrameDecoder:
+    """Incrementally splits a byte stream into frames, buffering partial data between reads."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> list[Frame]:
+        self._buffer.extend(data)
+        frames = []
+        while len(self._buffer) >= FRAME_HEADER_SIZE:
+            magic, version, opcode, flags, request_id, length = FRAME_HEADER.unpack_from(self._buffer)
+            if magic != PROTOCOL_MAGIC:
+                raise ProtocolError(f"Bad frame magic {magic!r}")
+            if version != PROTOCOL_VERSION:
+                raise ProtocolError(f"Unsupported protocol version {version}")
+            if length > MAX_PAYLOAD_SIZE:
+                raise ProtocolError(f"Frame payload of {length} bytes exceeds {MAX_PAYLOAD_SIZE}")
+            end = FRAME_HEADER_SIZE + length
+            if len(self._buffer) < end:
+                break
+            frames.append(Frame(opcode, flags, request_id, bytes(self._buffer[FRAME_HEADER_SIZE:end])))
+            del self._buffer[:end]
+        return frames